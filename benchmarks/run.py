@@ -0,0 +1,246 @@
+"""
+Offline end-to-end benchmark, running the real jobs against local stand-ins for Binance, MEXC, Google Sheets and Notion
+
+    python3 -m benchmarks.run --ob-rows 10000 --journal-entries 200 --latency 5
+"""
+import argparse
+from datetime import datetime, timedelta
+import json
+import logging
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.stand_ins import BinanceStandIn, MexcStandIn, NotionStandIn, SheetsStandIn
+from src.helper import dt_to_str
+from src.jobs.journal_orders import JournalOrders
+from src.jobs.new_orders import NewOrders
+from src.jobs.order_book import OrderBook
+from src.services.binance_exchange import BinanceExchange
+from src.services.http_transport import HttpTransport
+from src.services.metrics import configure_metrics
+from src.services.mexc_exchange import MexcExchange
+from src.services.notion_journal import NotionJournal
+from src.services.quota_manager import QuotaManager
+from src.services.resilience import configure_resilience
+from src.services.sheets_ob import SheetsOB
+
+JOB_NAMES = ["NewOrders", "OrderBook", "JournalOrders"]
+ACCOUNTS = ["Binance Main Spot", "Binance Main Margin", "MEXC Main Futures"]
+PAIRS = ["BTC/USDT", "ETH/USDT", "SOL/USDT", "BNB/USDT"]
+OB_HEADER = ["Date", "Account", "Pair", "Buy/Sell", "Average", "Executed", "Effect", "Total (inc. Fees)", "Fees", "Fees Currency", "Fees USDT", "Reference", "Notes", "RTPS Refresh"]
+START_TIME = datetime(2024, 1, 1)
+FIRST_REFERENCE = 10000000
+# Quotas high enough to measure the jobs rather than the pacing
+UNLIMITED_QUOTAS = {upstream: (1000000, 1000000) for upstream in QuotaManager.DEFAULT_LIMITS}
+
+def build_dataset(ob_rows: int, pending_share: float, new_orders: int, journal_entries: int, refs_per_entry: int, seed: int = 0) -> dict:
+    """
+    Build the synthetic sheets, exchange orders and journal pages
+    Every OB row has its order on the exchange, new_orders more orders are placed after the New Orders last updated time
+    """
+    rng = random.Random(seed)
+    ob_grid = [list(OB_HEADER)]
+    spot_orders: dict[str, list[dict]] = {}
+    margin_orders: dict[str, list[dict]] = {}
+    futures_orders: list[dict] = []
+    last_updated = START_TIME + timedelta(minutes=ob_rows)
+
+    for idx in range(ob_rows + new_orders):
+        account = ACCOUNTS[idx % len(ACCOUNTS)]
+        pair = PAIRS[(idx // len(ACCOUNTS)) % len(PAIRS)]
+        reference = FIRST_REFERENCE + idx
+        updated = START_TIME + timedelta(minutes=idx) if idx < ob_rows else last_updated + timedelta(minutes=idx - ob_rows + 1)
+        updated_ms = int(updated.timestamp() * 1000)
+        average = round(rng.uniform(1, 1000), 2)
+        executed = round(rng.uniform(0.01, 10), 4)
+        side = rng.choice(["BUY", "SELL"])
+
+        if (account.startswith("Binance")):
+            orders = spot_orders if account.endswith("Spot") else margin_orders
+            orders.setdefault(pair.replace("/", ""), []).append({
+                "orderId": reference, "symbol": pair.replace("/", ""), "status": "FILLED", "side": side,
+                "updateTime": updated_ms, "executedQty": str(executed), "cummulativeQuoteQty": str(average * executed),
+            })
+        else:
+            futures_orders.append({
+                "orderId": str(reference), "symbol": pair.replace("/", "_"), "side": 1 if side == "BUY" else 3,
+                "price": average, "vol": executed, "takerFee": 0.1, "makerFee": 0.0, "feeCurrency": "USDT",
+                "state": 3, "createTime": updated_ms, "updateTime": updated_ms,
+            })
+
+        if (idx < ob_rows):
+            if (rng.random() < pending_share):
+                ob_grid.append(["", account, pair, "", "", "", "", "", "", "", "", str(reference), "", "TRUE"])
+            else:
+                effect = str(round(average * executed, 2))
+                ob_grid.append([updated.strftime("%d/%m/%Y"), account, pair, side.capitalize(), str(average), str(executed), effect, effect, "", "", "", str(reference), "", "COMPLETED"])
+
+    no_grid = [["Account", "Last Updated"]] + [[account, dt_to_str(last_updated)] for account in ACCOUNTS] + [[SheetsOB.NO_BREAK_STRING]]
+
+    pages = []
+    references = [str(FIRST_REFERENCE + idx) for idx in range(ob_rows)]
+    for idx in range(journal_entries):
+        pages.append({
+            "object": "page",
+            "id": "page-" + str(idx),
+            "properties": {
+                NotionJournal.NP_TAGS: {"multi_select": [{"name": "refresh-orders"}]},
+                NotionJournal.NP_ORDER_REFERENCES: {"rich_text": [{"type": "text", "plain_text": ",".join(rng.sample(references, min(refs_per_entry, len(references))))}]},
+                NotionJournal.NP_ORDERS_TABLE_ID: {"rich_text": []},
+            },
+        })
+
+    return {
+        "grid": {"OB": ob_grid, "NO": no_grid},
+        "spot_orders": spot_orders,
+        "margin_orders": margin_orders,
+        "futures_orders": futures_orders,
+        "pages": pages,
+        "pending": sum(1 for row in ob_grid[1:] if row[13] == "TRUE"),
+    }
+
+def run_benchmark(ob_rows=10000, pending_share=0.1, new_orders=500, journal_entries=200, refs_per_entry=10, latency=0.005, rate_limit=None, error_rate=0.0, ob_concurrency=None, journal_concurrency=None, write_buffer_rows=200, real_quotas=False, jobs: list[str] = None, seed=0) -> list[dict]:
+    """
+    Run the jobs against freshly seeded stand-ins, returns per job the rows processed, seconds, rows per second and per upstream request statistics
+    JournalOrders runs twice, creating the orders tables then syncing them in place
+    """
+    from googleapiclient.discovery import build
+    import httplib2
+
+    dataset = build_dataset(ob_rows, pending_share, new_orders, journal_entries, refs_per_entry, seed)
+    options = {"latency": latency, "rate_limit": rate_limit, "error_rate": error_rate, "seed": seed}
+    stand_ins = {
+        "binance": BinanceStandIn(dataset["spot_orders"], dataset["margin_orders"], **options).start(),
+        "mexc": MexcStandIn(dataset["futures_orders"], **options).start(),
+        "sheets": SheetsStandIn(dataset["grid"], **options).start(),
+        "notion": NotionStandIn(dataset["pages"], **options).start(),
+    }
+    snapshot_dir = tempfile.mkdtemp(prefix="rtps-benchmark-")
+    transport = HttpTransport()
+    try:
+        quotas = QuotaManager() if real_quotas else QuotaManager(UNLIMITED_QUOTAS)
+        metrics = configure_metrics()
+        # Fresh circuit breakers, so an earlier run's failures never fail this one fast
+        configure_resilience()
+
+        binance = BinanceExchange("Binance Main", "key", "secret", transport, quotas, metrics=metrics)
+        binance.BASE_URL = stand_ins["binance"].URL
+        mexc = MexcExchange("MEXC Main", "key", "secret", transport, quotas, metrics=metrics)
+        mexc.SPOT_BASE_URL = mexc.FUTURES_BASE_URL = stand_ins["mexc"].URL
+        exchanges = {"Binance Main": binance, "MEXC Main": mexc}
+
+        service = build("sheets", "v4", http=httplib2.Http(), static_discovery=True, client_options={"api_endpoint": stand_ins["sheets"].URL + "/"})
+        drive_service = build("drive", "v3", http=httplib2.Http(), static_discovery=True, client_options={"api_endpoint": stand_ins["sheets"].URL + "/drive/v3/"})
+        sheets = SheetsOB("benchmark", "OB", "NO", write_buffer_rows=write_buffer_rows, write_buffer_seconds=10, service=service, quotas=quotas, snapshot_dir=snapshot_dir, metrics=metrics, drive_service=drive_service)
+        notion = NotionJournal("token", "database", quotas, metrics, base_url=stand_ins["notion"].URL)
+
+        runs = []
+        for name in jobs or JOB_NAMES:
+            if (name == "NewOrders"):
+                runs.append((name, NewOrders(sheets, exchanges)))
+            elif (name == "OrderBook"):
+                runs.append((name, OrderBook(sheets, exchanges, {"default": ob_concurrency} if ob_concurrency else None)))
+            elif (name == "JournalOrders"):
+                job = JournalOrders(notion, sheets, journal_concurrency)
+                runs.append((name, job))
+                runs.append((name + " (sync)", job))
+            else:
+                raise ValueError("Unknown job [" + name + "], expected one of [" + ", ".join(JOB_NAMES) + "]")
+
+        results = []
+        for label, job in runs:
+            if (label.endswith("(sync)")):
+                stand_ins["notion"].retag()
+            for stand_in in stand_ins.values():
+                stand_in.reset_stats()
+            job_name = type(job).__name__
+            rows_before = metrics.get("job_rows_total", {"job": job_name})
+
+            started = time.perf_counter()
+            job.run()
+            sheets.flush_ob_rows()
+            seconds = time.perf_counter() - started
+
+            rows = int(metrics.get("job_rows_total", {"job": job_name}) - rows_before)
+            results.append({
+                "job": label,
+                "rows": rows,
+                "seconds": seconds,
+                "rows_per_second": rows / seconds if seconds > 0 else 0.0,
+                "upstreams": {name: stand_in.get_stats() for name, stand_in in stand_ins.items() if stand_in.get_stats()["requests"] > 0},
+            })
+        return results
+    finally:
+        transport.close()
+        for stand_in in stand_ins.values():
+            stand_in.stop()
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+def format_report(results: list[dict]) -> str:
+    """
+    Format the results as a table per job, then per upstream
+    """
+    lines = ["Job".ljust(22) + "Rows".rjust(8) + "Seconds".rjust(10) + "Rows/s".rjust(10)]
+    for result in results:
+        lines.append(result["job"].ljust(22) + str(result["rows"]).rjust(8) + str(round(result["seconds"], 3)).rjust(10) + str(round(result["rows_per_second"], 1)).rjust(10))
+    lines.append("")
+    lines.append("Job".ljust(22) + "Upstream".ljust(10) + "Requests".rjust(10) + "Errors".rjust(8) + "Throttled".rjust(11) + "p50 ms".rjust(9) + "p99 ms".rjust(9) + "KiB".rjust(10))
+    for result in results:
+        for name, stats in result["upstreams"].items():
+            lines.append(
+                result["job"].ljust(22) + name.ljust(10) + str(stats["requests"]).rjust(10) + str(stats["errors"]).rjust(8) + str(stats["throttled"]).rjust(11)
+                + str(round(stats["p50"] * 1000, 1)).rjust(9) + str(round(stats["p99"] * 1000, 1)).rjust(9) + str(round(stats["bytes"] / 1024, 1)).rjust(10)
+            )
+    return "\n".join(lines)
+
+def set_log_level(level: str):
+    """
+    Set the level of every repo logger, the jobs log each row at INFO
+    """
+    for name in list(logging.root.manager.loggerDict):
+        if (name == "src" or name.startswith("src.")):
+            logging.getLogger(name).setLevel(level)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RTP Squire offline benchmark")
+    parser.add_argument("--jobs", default=",".join(JOB_NAMES), help="comma separated jobs to run [" + ",".join(JOB_NAMES) + "]")
+    parser.add_argument("--ob-rows", type=int, default=10000, help="order book rows")
+    parser.add_argument("--pending-share", type=float, default=0.1, help="share of order book rows pending an RTPS refresh")
+    parser.add_argument("--new-orders", type=int, default=500, help="orders placed since the New Orders last updated time")
+    parser.add_argument("--journal-entries", type=int, default=200, help="journal entries tagged refresh-orders")
+    parser.add_argument("--refs-per-entry", type=int, default=10, help="order references per journal entry")
+    parser.add_argument("--latency", type=float, default=5, help="stand-in latency per request in milliseconds")
+    parser.add_argument("--rate-limit", type=float, default=0, help="stand-in requests per second before answering 429, 0 for unlimited")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests answered with a 500")
+    parser.add_argument("--ob-concurrency", type=int, default=0, help="Order Book fetch workers per exchange, sequential when 0")
+    parser.add_argument("--journal-concurrency", type=int, default=0, help="Journal Orders entries in flight, sequential when 0")
+    parser.add_argument("--write-buffer-rows", type=int, default=200, help="Order Book rows buffered before a Sheets write, as GS_WRITE_BUFFER_ROWS, 0 to write each row")
+    parser.add_argument("--real-quotas", action="store_true", help="pace requests with the production quotas instead of unlimited ones")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data and error injection")
+    parser.add_argument("--log-level", default="WARNING", help="level of the job logs")
+    parser.add_argument("--json", help="also write the results as JSON to this path, for comparing runs")
+    args = parser.parse_args()
+
+    set_log_level(args.log_level)
+    results = run_benchmark(
+        ob_rows=args.ob_rows,
+        pending_share=args.pending_share,
+        new_orders=args.new_orders,
+        journal_entries=args.journal_entries,
+        refs_per_entry=args.refs_per_entry,
+        latency=args.latency / 1000,
+        rate_limit=args.rate_limit or None,
+        error_rate=args.error_rate,
+        ob_concurrency=args.ob_concurrency or None,
+        journal_concurrency=args.journal_concurrency or None,
+        write_buffer_rows=args.write_buffer_rows or None,
+        real_quotas=args.real_quotas,
+        jobs=list(filter(None, args.jobs.split(","))),
+        seed=args.seed,
+    )
+    print(format_report(results))
+    if (args.json):
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,463 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+
+class StandIn:
+    """
+    Local HTTP stand-in for an upstream API, serving synthetic data with configurable latency, rate limit and error injection
+    Subclasses route requests in handle, returning (status, body, headers)
+    """
+    NAME = "stand-in"
+
+    def __init__(self, latency: float = 0.0, rate_limit: float = None, error_rate: float = 0.0, seed: int = 0):
+        """
+        Initialize the StandIn class
+        latency is in seconds per request, rate_limit in requests per second (None for unlimited), error_rate the share of requests failing with a 500
+        """
+        if (latency is None or latency < 0):
+            raise ValueError("Latency must not be negative")
+        if (error_rate is None or not 0 <= error_rate <= 1):
+            raise ValueError("Error rate must be between 0 and 1")
+
+        self.LATENCY = latency
+        self.RATE_LIMIT = rate_limit or None
+        self.ERROR_RATE = error_rate
+        self.RANDOM = random.Random(seed)
+        self.LOCK = threading.Lock()
+        # Rate limit bucket, refilled at RATE_LIMIT tokens per second up to RATE_LIMIT
+        self.TOKENS = self.RATE_LIMIT or 0
+        self.UPDATED = time.monotonic()
+        self.SERVER: ThreadingHTTPServer = None
+        self.URL = None
+        self.reset_stats()
+
+    def start(self):
+        """
+        Serve on a free local port from a background thread
+        """
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so the pooled transports reuse their connections as they would upstream
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, Nagle would hold the body back for the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                stand_in.dispatch(self)
+
+            do_POST = do_PUT = do_PATCH = do_DELETE = do_GET
+
+            def log_message(self, format, *args):
+                pass
+
+        self.SERVER = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.SERVER.daemon_threads = True
+        self.URL = "http://127.0.0.1:" + str(self.SERVER.server_address[1])
+        threading.Thread(target=self.SERVER.serve_forever, name=self.NAME + "-stand-in", daemon=True).start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving
+        """
+        if (self.SERVER is not None):
+            self.SERVER.shutdown()
+            self.SERVER.server_close()
+            self.SERVER = None
+
+    def reset_stats(self):
+        """
+        Reset the request statistics, e.g. between jobs
+        """
+        with self.LOCK:
+            self.LATENCIES: list[float] = []
+            self.REQUESTS = 0
+            self.ERRORS = 0
+            self.THROTTLED = 0
+            self.BYTES = 0
+
+    def get_stats(self) -> dict:
+        """
+        Get the request count, injected errors, throttled requests, bytes sent and the p50/p99 server side latency in seconds
+        """
+        with self.LOCK:
+            latencies = sorted(self.LATENCIES)
+            return {
+                "requests": self.REQUESTS,
+                "errors": self.ERRORS,
+                "throttled": self.THROTTLED,
+                "bytes": self.BYTES,
+                "p50": percentile(latencies, 0.5),
+                "p99": percentile(latencies, 0.99),
+            }
+
+    def try_acquire(self) -> bool:
+        """
+        Take a token from the rate limit bucket, False when the request must be throttled
+        """
+        if (self.RATE_LIMIT is None):
+            return True
+        with self.LOCK:
+            now = time.monotonic()
+            self.TOKENS = min(self.RATE_LIMIT, self.TOKENS + (now - self.UPDATED) * self.RATE_LIMIT)
+            self.UPDATED = now
+            if (self.TOKENS < 1):
+                return False
+            self.TOKENS -= 1
+            return True
+
+    def dispatch(self, handler: BaseHTTPRequestHandler):
+        """
+        Serve a request, applying the rate limit, error injection and latency before routing it
+        """
+        started = time.perf_counter()
+        url = urllib.parse.urlsplit(handler.path)
+        query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+        length = int(handler.headers.get("Content-Length") or 0)
+        raw = handler.rfile.read(length) if length > 0 else b""
+        method = handler.headers.get("X-HTTP-Method-Override") or handler.command
+        body = None
+        if ((handler.headers.get("Content-Type") or "").startswith("application/x-www-form-urlencoded")):
+            # Clients move the query of long GET requests into a form body
+            for name, values in urllib.parse.parse_qs(raw.decode("utf-8"), keep_blank_values=True).items():
+                query.setdefault(name, []).extend(values)
+        elif (raw):
+            body = json.loads(raw)
+
+        throttled = not self.try_acquire()
+        with self.LOCK:
+            failed = not throttled and self.RANDOM.random() < self.ERROR_RATE
+        if (throttled):
+            status, res, headers = 429, self.error_body(429), {"Retry-After": "1"}
+        elif (failed):
+            status, res, headers = 500, self.error_body(500), {}
+        else:
+            if (self.LATENCY > 0):
+                time.sleep(self.LATENCY)
+            try:
+                status, res, headers = self.handle(method, url.path, query, body)
+            except Exception as err:
+                status, res, headers = 500, self.error_body(500, str(err)), {}
+
+        payload = json.dumps(res).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+        with self.LOCK:
+            self.REQUESTS += 1
+            self.ERRORS += 1 if failed else 0
+            self.THROTTLED += 1 if throttled else 0
+            self.BYTES += len(payload)
+            self.LATENCIES.append(time.perf_counter() - started)
+
+    def handle(self, method: str, path: str, query: dict[str, list[str]], body) -> tuple[int, object, dict]:
+        """
+        Route a request
+        """
+        return 404, self.error_body(404), {}
+
+    def error_body(self, status: int, message: str = None) -> dict:
+        """
+        Build the error body of the upstream
+        """
+        return {"status": status, "message": message or "Injected error"}
+
+class BinanceStandIn(StandIn):
+    """
+    Binance spot and margin order endpoints, orders are Binance API orders by symbol [BTCUSDT]
+    """
+    NAME = "binance"
+
+    def __init__(self, spot_orders: dict[str, list[dict]], margin_orders: dict[str, list[dict]], **kwargs):
+        super().__init__(**kwargs)
+        self.ORDERS = {
+            "/api/v3": {symbol: sorted(orders, key=lambda order: order["orderId"]) for symbol, orders in spot_orders.items()},
+            "/sapi/v1/margin": {symbol: sorted(orders, key=lambda order: order["orderId"]) for symbol, orders in margin_orders.items()},
+        }
+        self.ORDERS_BY_ID = {
+            prefix: {(symbol, order["orderId"]): order for symbol, orders in orders_per_symbol.items() for order in orders}
+            for prefix, orders_per_symbol in self.ORDERS.items()
+        }
+
+    def handle(self, method, path, query, body):
+        params = {name: values[0] for name, values in query.items()}
+        if (path == "/api/v3/account"):
+            return 200, {"balances": []}, {}
+        if (path == "/sapi/v1/margin/account"):
+            return 200, {"userAssets": []}, {}
+
+        prefix, _, endpoint = path.rpartition("/")
+        if (prefix not in self.ORDERS):
+            return 404, self.error_body(404), {}
+        if (endpoint == "allOrders"):
+            orders = self.ORDERS[prefix].get(params["symbol"])
+            if (orders is None):
+                return 400, {"code": -1121, "msg": "Invalid symbol."}, {}
+            if ("orderId" in params):
+                orders = [order for order in orders if order["orderId"] >= int(params["orderId"])]
+            elif ("startTime" in params):
+                orders = [order for order in orders if order["updateTime"] >= int(params["startTime"])]
+            return 200, orders[:int(params.get("limit") or 500)], {}
+        if (endpoint == "order"):
+            order = self.ORDERS_BY_ID[prefix].get((params["symbol"], int(params["orderId"])))
+            if (order is None):
+                return 400, {"code": -2013, "msg": "Order does not exist."}, {}
+            return 200, order, {}
+        return 404, self.error_body(404), {}
+
+    def error_body(self, status, message=None):
+        return {"code": -1003 if status == 429 else -1000, "msg": message or "Injected error"}
+
+class MexcStandIn(StandIn):
+    """
+    MEXC futures order endpoints, orders are MEXC API futures orders
+    """
+    NAME = "mexc"
+
+    def __init__(self, futures_orders: list[dict], **kwargs):
+        super().__init__(**kwargs)
+        # History pages are served newest first
+        self.ORDERS = sorted(futures_orders, key=lambda order: order["createTime"], reverse=True)
+        self.ORDERS_BY_ID = {order["orderId"]: order for order in futures_orders}
+
+    def handle(self, method, path, query, body):
+        params = {name: values[0] for name, values in query.items()}
+        if (path.startswith("/api/v1/private/order/get/")):
+            order = self.ORDERS_BY_ID.get(path.rsplit("/", 1)[1])
+            if (order is None):
+                return 200, {"success": False, "code": 2013, "message": "Order does not exist"}, {}
+            return 200, {"success": True, "code": 0, "data": order}, {}
+        if (path == "/api/v1/private/order/batch_query"):
+            orders = [self.ORDERS_BY_ID[order_id] for order_id in params["order_ids"].split(",") if order_id in self.ORDERS_BY_ID]
+            return 200, {"success": True, "code": 0, "data": orders}, {}
+        if (path == "/api/v1/private/order/list/history_orders"):
+            page_num, page_size = int(params["page_num"]), int(params["page_size"])
+            orders = [order for order in self.ORDERS if order["createTime"] >= int(params.get("start_time") or 0)]
+            return 200, {"success": True, "code": 0, "data": orders[(page_num - 1) * page_size:page_num * page_size]}, {}
+        return 404, self.error_body(404), {}
+
+    def error_body(self, status, message=None):
+        return {"success": False, "code": 510 if status == 429 else 9999, "message": message or "Injected error"}
+
+class SheetsStandIn(StandIn):
+    """
+    Google Sheets v4 values API backed by an in-memory grid per sheet, with the Drive v3 files endpoint serving the spreadsheet version under /drive/v3
+    """
+    NAME = "sheets"
+
+    def __init__(self, grid: dict[str, list[list[str]]], **kwargs):
+        super().__init__(**kwargs)
+        self.GRID = grid
+        # Drive version of the spreadsheet, changed by every write
+        self.VERSION = 1
+
+    def handle(self, method, path, query, body):
+        if (path.startswith("/drive/v3/files/")):
+            with self.LOCK:
+                return 200, {"version": str(self.VERSION)}, {}
+        _, _, values_path = path.partition("/values")
+        params = {name: values[0] for name, values in query.items()}
+        if (values_path == ":batchGet"):
+            return 200, {"valueRanges": [self.read(range_str, params.get("majorDimension") or "ROWS") for range_str in query.get("ranges", [])]}, {}
+        if (values_path == ":batchUpdate"):
+            for value_range in body["data"]:
+                self.write(value_range["range"], value_range["values"])
+            return 200, {"totalUpdatedRanges": len(body["data"])}, {}
+
+        range_str = urllib.parse.unquote(values_path.lstrip("/"))
+        if (range_str.endswith(":clear")):
+            self.clear(range_str[:-len(":clear")])
+            return 200, {"clearedRange": range_str[:-len(":clear")]}, {}
+        if (method == "PUT"):
+            self.write(range_str, body["values"])
+            return 200, {"updatedRange": range_str}, {}
+        return 200, self.read(range_str), {}
+
+    def read(self, range_str: str, major_dimension: str = "ROWS") -> dict:
+        with self.LOCK:
+            sheet, start_row, start_column, end_row, end_column = parse_range(range_str)
+            rows = self.GRID.get(sheet, [])
+            end_row = len(rows) - 1 if end_row is None else end_row
+            values = [list(row[start_column:None if end_column is None else end_column + 1]) for row in rows[start_row:end_row + 1]]
+        if (major_dimension == "COLUMNS"):
+            width = max([len(row) for row in values] + [0])
+            values = [[row[idx] if idx < len(row) else "" for row in values] for idx in range(width)]
+        # The API trims trailing empty cells and rows
+        for row in values:
+            while row and row[-1] == "":
+                row.pop()
+        while values and not values[-1]:
+            values.pop()
+        return {"range": range_str, "majorDimension": major_dimension, "values": values} if values else {"range": range_str, "majorDimension": major_dimension}
+
+    def write(self, range_str: str, values: list[list]):
+        with self.LOCK:
+            self.VERSION += 1
+            sheet, start_row, start_column, _, _ = parse_range(range_str)
+            rows = self.GRID.setdefault(sheet, [])
+            for row_offset, row_values in enumerate(values):
+                while len(rows) <= start_row + row_offset:
+                    rows.append([])
+                row = rows[start_row + row_offset]
+                for column_offset, value in enumerate(row_values):
+                    while len(row) <= start_column + column_offset:
+                        row.append("")
+                    row[start_column + column_offset] = "" if value is None else str(value)
+
+    def clear(self, range_str: str):
+        with self.LOCK:
+            self.VERSION += 1
+            sheet, start_row, start_column, end_row, end_column = parse_range(range_str)
+            for row in self.GRID.get(sheet, [])[start_row:None if end_row is None else end_row + 1]:
+                for column in range(start_column, len(row) if end_column is None else min(len(row), end_column + 1)):
+                    row[column] = ""
+
+    def error_body(self, status, message=None):
+        return {"error": {"code": status, "message": message or "Injected error", "status": "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL"}}
+
+class NotionStandIn(StandIn):
+    """
+    Notion database query, pages and blocks endpoints backed by in-memory pages and blocks
+    """
+    NAME = "notion"
+    NP_TAGS = "RTPS-Actions"
+
+    def __init__(self, pages: list[dict], **kwargs):
+        super().__init__(**kwargs)
+        self.PAGES = {page["id"]: page for page in pages}
+        # Blocks by id, with the ids of their children
+        self.BLOCKS: dict[str, dict] = {}
+        self.CHILDREN: dict[str, list[str]] = {}
+        self.IDS = itertools.count(1)
+
+    def handle(self, method, path, query, body):
+        parts = path.strip("/").split("/")
+        if (parts[:2] == ["v1", "databases"] and parts[3:] == ["query"]):
+            return self.query_database(body or {})
+        if (parts[:2] == ["v1", "pages"] and method == "PATCH"):
+            return self.update_page(parts[2], body or {})
+        if (parts[:2] == ["v1", "blocks"] and parts[3:] == ["children"]):
+            if (method == "PATCH"):
+                return 200, {"object": "list", "results": self.append_children(parts[2], body["children"]), "has_more": False, "next_cursor": None}, {}
+            return self.list_children(parts[2], {name: values[0] for name, values in query.items()})
+        if (parts[:2] == ["v1", "blocks"] and len(parts) == 3):
+            return self.update_block(parts[2], method, body or {})
+        return 404, self.error_body(404), {}
+
+    def query_database(self, body):
+        tag = body.get("filter", {}).get("multi_select", {}).get("contains")
+        with self.LOCK:
+            pages = [page for page in self.PAGES.values() if tag is None or tag in [option["name"] for option in page["properties"][self.NP_TAGS]["multi_select"]]]
+        start = int(body.get("start_cursor") or 0)
+        end = start + int(body.get("page_size") or 100)
+        return 200, {"object": "list", "results": pages[start:end], "has_more": end < len(pages), "next_cursor": str(end) if end < len(pages) else None}, {}
+
+    def update_page(self, page_id, body):
+        with self.LOCK:
+            page = self.PAGES.get(page_id)
+            if (page is None):
+                return 404, self.error_body(404), {}
+            for name, value in body.get("properties", {}).items():
+                if ("rich_text" in value):
+                    value = {"rich_text": [{"type": "text", "plain_text": item["text"]["content"]} for item in value["rich_text"]]}
+                page["properties"][name] = value
+            return 200, page, {}
+
+    def create_block(self, parent_id, child: dict) -> dict:
+        """
+        Store a block and its nested children, the caller must hold LOCK
+        """
+        block_id = "block-" + str(next(self.IDS))
+        block = {"object": "block", "id": block_id, "type": child["type"], "has_children": False}
+        content = dict(child[child["type"]])
+        children = content.pop("children", [])
+        if (child["type"] == "table_row"):
+            content["cells"] = [[{"type": "text", "plain_text": item["text"]["content"]} for item in cell] for cell in content["cells"]]
+        block[child["type"]] = content
+        self.BLOCKS[block_id] = block
+        self.CHILDREN.setdefault(parent_id, []).append(block_id)
+        for grandchild in children:
+            block["has_children"] = True
+            self.create_block(block_id, grandchild)
+        return block
+
+    def append_children(self, parent_id, children: list[dict]) -> list[dict]:
+        with self.LOCK:
+            return [self.create_block(parent_id, child) for child in children]
+
+    def list_children(self, block_id, params):
+        with self.LOCK:
+            children = [self.BLOCKS[child_id] for child_id in self.CHILDREN.get(block_id, []) if child_id in self.BLOCKS]
+        start = int(params.get("start_cursor") or 0)
+        end = start + int(params.get("page_size") or 100)
+        return 200, {"object": "list", "results": children[start:end], "has_more": end < len(children), "next_cursor": str(end) if end < len(children) else None}, {}
+
+    def update_block(self, block_id, method, body):
+        with self.LOCK:
+            block = self.BLOCKS.get(block_id)
+            if (block is None):
+                return 404, {"object": "error", "status": 404, "code": "object_not_found", "message": "Block not found"}, {}
+            if (method == "DELETE"):
+                del self.BLOCKS[block_id]
+                return 200, dict(block, archived=True), {}
+            if ("table_row" in body):
+                block["table_row"] = {"cells": [[{"type": "text", "plain_text": item["text"]["content"]} for item in cell] for cell in body["table_row"]["cells"]]}
+            return 200, block, {}
+
+    def retag(self, tag: str = "refresh-orders"):
+        """
+        Tag every page with tag again, e.g. to run the job a second time over existing tables
+        """
+        with self.LOCK:
+            for page in self.PAGES.values():
+                tags = page["properties"][self.NP_TAGS]["multi_select"]
+                if (tag not in [option["name"] for option in tags]):
+                    tags.append({"name": tag})
+
+    def error_body(self, status, message=None):
+        return {"object": "error", "status": status, "code": "rate_limited" if status == 429 else "internal_server_error", "message": message or "Injected error"}
+
+def parse_range(range_str: str) -> tuple[str, int, int, int, int]:
+    """
+    Parse [Sheet!A5:C6], [Sheet!A:A], [Sheet!5:7], [Sheet!A5] or [Sheet] into sheet, 0-based start row/column and end row/column (None if open)
+    """
+    sheet, _, cells = range_str.partition("!")
+    if not cells:
+        return sheet, 0, 0, None, None
+    start, _, end = cells.partition(":")
+    end = end or start
+
+    def parse_cell(cell):
+        letters = "".join(c for c in cell if c.isalpha()).upper()
+        digits = "".join(c for c in cell if c.isdigit())
+        column = None
+        if letters:
+            column = 0
+            for letter in letters:
+                column = column * 26 + ord(letter) - 64
+            column -= 1
+        row = int(digits) - 1 if digits else None
+        return row, column
+
+    start_row, start_column = parse_cell(start)
+    end_row, end_column = parse_cell(end)
+    return sheet, start_row or 0, start_column or 0, end_row, end_column
+
+def percentile(values: list[float], share: float) -> float:
+    """
+    Nearest rank percentile of sorted values, 0 when empty
+    """
+    if (len(values) == 0):
+        return 0.0
+    return values[max(0, math.ceil(share * len(values)) - 1)]
@@ -1,31 +1,126 @@
+import time
+
+# Process start, for the startup time report
+STARTED = time.perf_counter()
+
+import argparse
 import os
+import signal
 
 from dotenv import load_dotenv
 
-from src.jobs.new_orders import NewOrders
-from src.logger_config import setup_logger
-from src.jobs.journal_orders import JournalOrders
-from src.jobs.order_book import OrderBook
-from src.services.binance_exchange import BinanceExchange
-from src.services.mexc_exchange import MexcExchange
-from src.services.notion_journal import NotionJournal
-from src.services.sheets_ob import SheetsOB
+from src.helper import parse_key_values
+from src.logger_config import configure_logging, setup_logger
+from src.scheduler import Scheduler, parse_schedule
+from src.services.metrics import configure_metrics
+from src.services.quota_manager import configure_quota_manager
+from src.services.resilience import configure_resilience
 
 logger = setup_logger(__name__)
 
-# Load environment variables
+# Load environment variables, then apply the log levels and format they set
 load_dotenv()
+configure_logging()
 
 
 class Main:
-    def __init__(self):
+    JOB_NAMES = ["NewOrders", "OrderBook", "JournalOrders"]
+    
+    def __init__(self, job_names: list[str] = None, profile_dir: str = None, record_path: str = None, replay_path: str = None, replay_speed: float = 1.0):
         """
         Initialize the main class
+        Services, exchanges and jobs are imported and built on first use, so running a subset of job_names only pays for what it needs
+        When profile_dir is set, every job run is profiled with a report written to profile_dir
+        When record_path is set, the upstream traffic is recorded to a cassette, which replay_path replays without network access
+        at replay_speed times the recorded latency (0 for none)
+        """
+        if (job_names is None):
+            job_names = self.JOB_NAMES
+        for name in job_names:
+            if (name not in self.JOB_NAMES):
+                raise ValueError("Unknown job [" + name + "], expected one of [" + ", ".join(self.JOB_NAMES) + "]")
+        
+        # Seconds spent importing and building each service, for the startup time report
+        self.STARTUP_TIMES: dict[str, float] = {"imports": time.perf_counter() - STARTED}
+        
+        # Initialize the API quotas shared by every service, overrides as [upstream=rate/capacity] e.g. [notion=3/3,sheets=1/60]
+        quota_limits = {}
+        for upstream, limit in parse_key_values(os.getenv("QUOTA_LIMITS")).items():
+            rate, capacity = limit.split("/")
+            quota_limits[upstream] = (float(rate), float(capacity))
+        self.QUOTAS = configure_quota_manager(quota_limits)
+        
+        # Initialize the retries and the circuit breaker per upstream shared by every service
+        self.RESILIENCE = configure_resilience(
+            max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS") or "4"),
+            base_delay=float(os.getenv("RETRY_BASE_DELAY") or "0.5"),
+            max_delay=float(os.getenv("RETRY_MAX_DELAY") or "30"),
+            failure_threshold=int(os.getenv("BREAKER_FAILURES") or "5"),
+            reset_seconds=float(os.getenv("BREAKER_RESET_SECONDS") or "30")
+        )
+        
+        # Initialize the metrics shared by every service and job, exported to a Prometheus text file and/or a local HTTP endpoint
+        self.METRICS = configure_metrics()
+        self.METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE") or None
+        metrics_port = int(os.getenv("METRICS_PORT") or "0")
+        if (metrics_port > 0):
+            self.METRICS.start_http_server(metrics_port, os.getenv("METRICS_HOST") or "127.0.0.1")
+        
+        self.JOB_NAMES = job_names
+        self.PROFILER = None
+        if (profile_dir is not None):
+            from src.profiler import Profiler
+            
+            self.PROFILER = Profiler(profile_dir)
+        self.CASSETTE = None
+        if (record_path is not None and replay_path is not None):
+            raise ValueError("Record and replay are exclusive")
+        if (record_path is not None or replay_path is not None):
+            from src.services.cassette import Cassette
+            
+            # Credentials redacted wherever they appear in a recording
+            secret_names = ["BINANCE_API_KEY", "BINANCE_API_SECRET", "MEXC_API_KEY", "MEXC_API_SECRET", "NOTION_TOKEN"]
+            secrets = [secret for name in secret_names for secret in (os.getenv(name) or "").split(",")]
+            if (record_path is not None):
+                self.CASSETTE = Cassette(record_path, "record", secrets=secrets)
+            else:
+                self.CASSETTE = Cassette(replay_path, "replay", replay_speed)
+        self.NOTION = None
+        self.SHEETS = None
+        self.TRANSPORT = None
+        self.ORDER_CACHE = None
+        self.EXCHANGES = None
+        self.JOBS = None
+    
+    def timed(self, name, build):
+        """
+        Build a service, recording the time spent for the startup time report
         """
+        start = time.perf_counter()
+        res = build()
+        self.STARTUP_TIMES[name] = time.perf_counter() - start
+        return res
+    
+    def get_notion(self):
+        if (self.NOTION is None):
+            self.NOTION = self.timed("notion", self.build_notion)
+        return self.NOTION
+    
+    def build_notion(self):
+        from src.services.notion_journal import NotionJournal
+        
         # Initialize the Notion API
-        token=os.getenv("NOTION_TOKEN")
+        token=self.get_secret("NOTION_TOKEN")
         journal_database_id=os.getenv("NOTION_JOURNAL_DATABASE_ID")
-        self.NOTION = NotionJournal(token, journal_database_id)
+        return NotionJournal(token, journal_database_id, self.QUOTAS, cassette=self.CASSETTE)
+    
+    def get_sheets(self):
+        if (self.SHEETS is None):
+            self.SHEETS = self.timed("sheets", self.build_sheets)
+        return self.SHEETS
+    
+    def build_sheets(self):
+        from src.services.sheets_ob import SheetsOB
         
         # Initialize the Google Sheets API
         ss_id=os.getenv("GS_SS_ID")
@@ -34,35 +129,222 @@ class Main:
         service_account_file=os.getenv("GS_SERVICE_ACCOUNT_FILE")
         user_token_file=os.getenv("GS_USER_TOKEN_FILE")
         user_secret_file=os.getenv("GS_USER_SECRET_FILE")
-        self.SHEETS = SheetsOB(ss_id, ob_sheet_name, neworders_sheet_name, service_account_file, user_token_file, user_secret_file)
+        write_buffer_rows=int(os.getenv("GS_WRITE_BUFFER_ROWS") or "200")
+        write_buffer_seconds=float(os.getenv("GS_WRITE_BUFFER_SECONDS") or "10")
+        snapshot_dir=os.getenv("GS_SNAPSHOT_DIR") or ".cache/sheets"
+        if (self.CASSETTE is not None):
+            # Recordings and replays start cold, so both make the same requests
+            snapshot_dir = None
+        return SheetsOB(ss_id, ob_sheet_name, neworders_sheet_name, service_account_file, user_token_file, user_secret_file, write_buffer_rows, write_buffer_seconds, quotas=self.QUOTAS, snapshot_dir=snapshot_dir, cassette=self.CASSETTE)
+    
+    def get_secret(self, name, count=1):
+        """
+        Get a credential from the environment, replays need none so placeholders stand in for count accounts
+        """
+        secret = os.getenv(name)
+        if (not secret and self.CASSETTE is not None and self.CASSETTE.replaying):
+            return ",".join(["replay"] * count)
+        return secret
+    
+    def get_exchanges(self):
+        if (self.EXCHANGES is None):
+            self.EXCHANGES = self.timed("exchanges", self.build_exchanges)
+        return self.EXCHANGES
+    
+    def build_exchanges(self):
+        from src.services.binance_exchange import BinanceExchange
+        from src.services.http_transport import configure_transport
+        from src.services.mexc_exchange import MexcExchange
+        from src.services.order_cache import OrderCache
+        
+        # Initialize the HTTP transport shared by the exchange APIs
+        pool_maxsize=int(os.getenv("HTTP_POOL_MAXSIZE") or "10")
+        timeout=float(os.getenv("HTTP_TIMEOUT") or "30")
+        self.TRANSPORT = configure_transport(pool_maxsize=pool_maxsize, timeout=(min(5, timeout), timeout))
+        transport = self.TRANSPORT
+        if (self.CASSETTE is not None):
+            from src.services.cassette import CassetteTransport
+            
+            transport = CassetteTransport(self.TRANSPORT, self.CASSETTE)
+        
+        # Initialize the local cache of terminal orders shared by the exchange APIs, in memory for recordings and replays so both start cold
+        order_cache_path = os.getenv("ORDER_CACHE_PATH") or ".cache/orders.sqlite3"
+        if (self.CASSETTE is not None):
+            order_cache_path = ":memory:"
+        self.ORDER_CACHE = OrderCache(order_cache_path)
         
         # Initialize exchange APIs
         exchanges = {}
         # Binance, may have more than one account
         binance_names = os.getenv("BINANCE_NAME").split(",")
-        binance_keys = os.getenv("BINANCE_API_KEY").split(",")
-        binance_secrets = os.getenv("BINANCE_API_SECRET").split(",")
+        binance_keys = self.get_secret("BINANCE_API_KEY", len(binance_names)).split(",")
+        binance_secrets = self.get_secret("BINANCE_API_SECRET", len(binance_names)).split(",")
+        # Pairs always searched for new orders, and the quote assets paired with account balances
+        binance_symbols = list(filter(None, (os.getenv("BINANCE_SYMBOLS") or "").split(",")))
+        binance_quote_assets = list(filter(None, (os.getenv("BINANCE_QUOTE_ASSETS") or "USDT").split(",")))
         for idx in range(len(binance_names)):
-            exchanges[binance_names[idx]] = BinanceExchange(binance_names[idx], binance_keys[idx], binance_secrets[idx])
+            exchanges[binance_names[idx]] = BinanceExchange(binance_names[idx], binance_keys[idx], binance_secrets[idx], transport, self.QUOTAS, binance_symbols, binance_quote_assets, order_cache=self.ORDER_CACHE)
         # Mexc
-        exchanges[os.getenv("MEXC_NAME")] = MexcExchange(os.getenv("MEXC_NAME"), os.getenv("MEXC_API_KEY"), os.getenv("MEXC_API_SECRET"))
-        
-        # Initialize jobs
-        self.JOBS = []
-        self.JOBS.append(NewOrders(self.SHEETS, exchanges))
-        self.JOBS.append(OrderBook(self.SHEETS, exchanges))
-        self.JOBS.append(JournalOrders(self.NOTION, self.SHEETS))
+        exchanges[os.getenv("MEXC_NAME")] = MexcExchange(os.getenv("MEXC_NAME"), self.get_secret("MEXC_API_KEY"), self.get_secret("MEXC_API_SECRET"), transport, self.QUOTAS, self.ORDER_CACHE)
+        return exchanges
+    
+    def get_jobs(self):
+        if (self.JOBS is None):
+            self.JOBS = [self.build_job(name) for name in self.JOB_NAMES]
+            self.log_startup_times()
+        return self.JOBS
+    
+    def build_job(self, name):
+        if (name == "NewOrders"):
+            from src.jobs.new_orders import NewOrders
+            
+            return NewOrders(self.get_sheets(), self.get_exchanges())
+        if (name == "OrderBook"):
+            from src.jobs.order_book import OrderBook
+            
+            # Order Book pipeline, per exchange fetch concurrency e.g. [default=2,MEXC=4], sequential when unset
+            ob_concurrency = {name: int(value) for name, value in parse_key_values(os.getenv("OB_CONCURRENCY")).items()}
+            ob_queue_size = int(os.getenv("OB_QUEUE_SIZE") or "100")
+            return OrderBook(self.get_sheets(), self.get_exchanges(), ob_concurrency, ob_queue_size)
+        if (name == "JournalOrders"):
+            from src.jobs.journal_orders import JournalOrders
+            
+            # Journal Orders entries processed concurrently on the Notion async client, sequential when unset
+            journal_concurrency = int(os.getenv("JOURNAL_CONCURRENCY") or "0") or None
+            return JournalOrders(self.get_notion(), self.get_sheets(), journal_concurrency)
+        raise ValueError("Unknown job [" + name + "]")
+    
+    def log_startup_times(self):
+        """
+        Log the time from process start until the jobs are ready, and the share of each service
+        """
+        total = time.perf_counter() - STARTED
+        details = ", ".join(name + " [" + str(round(seconds, 3)) + "s]" for name, seconds in self.STARTUP_TIMES.items())
+        logger.info("Started in [" + str(round(total, 3)) + "] seconds: " + details)
 
     def run(self):
         logger.info("Launching RTP Squire!")
         
         # Run the Journal Orders job
-        for job in self.JOBS:
-            job.run()
+        for job in self.get_jobs():
+            self.run_timed(job)
+        if (self.TRANSPORT is not None):
+            self.TRANSPORT.log_stats()
+        self.save_cassette()
+        self.METRICS.stop_http_server()
         
         logger.info("Launched RTP Squire to the moon!")
+    
+    def run_daemon(self):
+        """
+        Keep the services alive and run each job on its schedule until SIGINT or SIGTERM
+        Schedules are set per job class as [job=schedule;...], a schedule is a number of seconds or a cron expression
+        e.g. [NewOrders=*/5 * * * *;OrderBook=60;JournalOrders=300]
+        """
+        logger.info("Launching RTP Squire daemon!")
+        
+        schedules = parse_key_values(os.getenv("SCHEDULE"), ";")
+        default_schedule = os.getenv("SCHEDULE_DEFAULT") or "60"
+        credentials_refresh_seconds = float(os.getenv("GS_CREDENTIALS_REFRESH_SECONDS") or "300")
+        
+        scheduler = Scheduler()
+        for job in self.get_jobs():
+            name = type(job).__name__
+            scheduler.add_job(name, lambda job=job: self.run_job(job), parse_schedule(schedules.get(name) or default_schedule))
+        scheduler.add_background_task("refresh-credentials", self.get_sheets().refresh_credentials, credentials_refresh_seconds)
+        
+        # Push new orders from the exchanges that support it, rather than polling them on every run
+        if ((os.getenv("ORDER_STREAMS") or "false").lower() == "true" and self.EXCHANGES is not None):
+            for exchange in self.EXCHANGES.values():
+                exchange.start_order_stream()
+        
+        # Let the running job complete before shutting down
+        signal.signal(signal.SIGINT, lambda signum, frame: scheduler.stop())
+        signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+        
+        try:
+            scheduler.run()
+        finally:
+            self.close()
+        
+        logger.info("RTP Squire daemon stopped")
+    
+    def run_job(self, job):
+        """
+        Run a job against an up to date Google Sheets cache
+        """
+        self.SHEETS.expire_cache()
+        self.run_timed(job)
+    
+    def run_timed(self, job):
+        """
+        Run a job, recording its duration and outcome, then export the metrics
+        """
+        start = time.perf_counter()
+        failed = True
+        try:
+            if (self.PROFILER is not None):
+                self.PROFILER.run(type(job).__name__, job.run)
+            else:
+                job.run()
+            failed = False
+        finally:
+            self.METRICS.observe_job(type(job).__name__, time.perf_counter() - start, failed)
+            self.export_metrics()
+    
+    def export_metrics(self):
+        """
+        Write the metrics text file, when configured
+        """
+        if (self.METRICS_TEXTFILE is None):
+            return
+        try:
+            self.METRICS.write_textfile(self.METRICS_TEXTFILE)
+        except OSError as err:
+            logger.error("Failed to write metrics to [" + self.METRICS_TEXTFILE + "] with error [" + str(err) + "]")
+    
+    def save_cassette(self):
+        """
+        Write the recorded cassette, when recording
+        """
+        if (self.CASSETTE is None):
+            return
+        try:
+            self.CASSETTE.save()
+        except OSError as err:
+            logger.error("Failed to save cassette [" + self.CASSETTE.PATH + "] with error [" + str(err) + "]")
+    
+    def close(self):
+        """
+        Flush pending writes and release the connections
+        """
+        if (self.EXCHANGES is not None):
+            for exchange in self.EXCHANGES.values():
+                exchange.stop_order_stream()
+        if (self.SHEETS is not None):
+            self.SHEETS.flush_ob_rows()
+        if (self.TRANSPORT is not None):
+            self.TRANSPORT.log_stats()
+            self.TRANSPORT.close()
+        if (self.ORDER_CACHE is not None):
+            self.ORDER_CACHE.close()
+        self.save_cassette()
+        self.export_metrics()
+        self.METRICS.stop_http_server()
 
 
 if __name__ == "__main__":
-    main = Main()
-    main.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="RTP Squire")
+    parser.add_argument("--daemon", action="store_true", help="keep running, with each job on its own schedule")
+    parser.add_argument("--jobs", default=os.getenv("JOBS"), help="comma separated jobs to run, all by default e.g. [NewOrders,OrderBook]")
+    parser.add_argument("--profile", nargs="?", const=".cache/profiles", default=os.getenv("PROFILE_DIR"), metavar="DIR", help="profile each job run, writing CPU, wait, allocation and hot function reports to DIR [.cache/profiles]")
+    parser.add_argument("--record", default=os.getenv("RECORD_PATH"), metavar="PATH", help="record the exchange, Sheets and Notion traffic to a cassette at PATH, credentials redacted")
+    parser.add_argument("--replay", default=os.getenv("REPLAY_PATH"), metavar="PATH", help="replay the cassette at PATH instead of calling the upstreams")
+    parser.add_argument("--replay-speed", type=float, default=float(os.getenv("REPLAY_SPEED") or "1"), metavar="SPEED", help="multiplier of the recorded latencies when replaying, 0 for none [1]")
+    args = parser.parse_args()
+    
+    main = Main(list(filter(None, args.jobs.split(","))) if args.jobs else None, args.profile, args.record, args.replay, args.replay_speed)
+    if (args.daemon):
+        main.run_daemon()
+    else:
+        main.run()
\ No newline at end of file
@@ -14,6 +14,31 @@ def get_exchange_type(account: str, exchanges: dict[str, Exchange]) -> tuple[Exc
             exchange = exchanges[exchange_name]
     return exchange, account.split(" ")[2]
 
+def get_exchange_name(account: str, exchanges: dict[str, Exchange]) -> str:
+    """
+    Get the name of the exchange the account belongs to
+    [<ACCOUNT_NAME> <TYPE>]
+    """
+    name = None
+    for exchange_name in exchanges:
+        if account.startswith(exchange_name):
+            name = exchange_name
+    return name
+
+def parse_key_values(value: str, separator: str = ",") -> dict[str, str]:
+    """
+    Parse a separated list of key=value pairs, e.g. [Binance=4,MEXC=2]
+    """
+    res = {}
+    if (value is None):
+        return res
+    for item in value.split(separator):
+        if "=" not in item:
+            continue
+        key, val = item.split("=", 1)
+        res[key.strip()] = val.strip()
+    return res
+
 def get_rounded_time() -> dt:
     """
     Get the current time rounded to the previous quarter hour
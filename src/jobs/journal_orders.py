@@ -1,15 +1,21 @@
+import asyncio
+from typing import AsyncIterable
+
 from notion_client import APIResponseError
 
 from src.logger_config import setup_logger
-from src.services.notion_journal import NotionJournal
+from src.services.metrics import get_metrics
+from src.services.notion_journal import EntryPatch, NotionJournal, Operation
+from src.services.resilience import UpstreamUnavailableError
 from src.services.sheets_ob import SheetsOB
 
 logger = setup_logger(__name__)
 
 class JournalOrders:
-    def __init__(self, notion: NotionJournal, sheets: SheetsOB):
+    def __init__(self, notion: NotionJournal, sheets: SheetsOB, concurrency: int = None):
         """
         Initialize the JournalOrders class
+        When concurrency is set, entries are processed concurrently on the Notion async client, at most concurrency at a time
         """
         if (notion is None):
             raise ValueError("Notion is required")
@@ -18,6 +24,7 @@ class JournalOrders:
         
         self.NOTION=notion
         self.SHEETS=sheets
+        self.CONCURRENCY=concurrency
     
     def run(self):
         """
@@ -25,14 +32,28 @@ class JournalOrders:
         """
         logger.info("Running Journal Orders job...")
         
-        # Query the Notion database for any entries with tag 'refresh-orders'
-        entries = self.NOTION.query_db_for_refresh_orders()
-        if (entries is None):
-            logger.error("Failed to retrieve pending orders to refresh, exiting...")
+        if (self.CONCURRENCY):
+            asyncio.run(self.run_async())
             return
-
-        # Process each entry
-        self.process_entries(entries)
+        
+        # Query the Notion database entries with tag 'refresh-orders', then process each
+        self.process_entries(self.NOTION.iter_refresh_orders())
+        
+        logger.info("Journal Orders job completed successfully")
+    
+    async def run_async(self):
+        """
+        Run the job on the Notion async client
+        """
+        # Warm the order book cache off the event loop, on a cold cache the first entry would otherwise fetch it and stall every other entry
+        await asyncio.to_thread(self.SHEETS.warm_cache)
+        
+        self.NOTION.open_async_client()
+        try:
+            # Query the Notion database entries with tag 'refresh-orders', then process them concurrently
+            await self.process_entries_async(self.NOTION.iter_refresh_orders_async())
+        finally:
+            await self.NOTION.close_async_client()
         
         logger.info("Journal Orders job completed successfully")
     
@@ -44,54 +65,130 @@ class JournalOrders:
             raise ValueError("Entries are required")
         
         for entry in entries: 
+            get_metrics().add_job_rows("JournalOrders", 1)
             try:
                 self.process_entry(entry)
+            except UpstreamUnavailableError as err:
+                # An upstream is down, leave the entry tagged for refresh for the next run rather than failing it
+                logger.warning("Leaving entry [" + entry["id"] + "] for the next run with error [" + str(err) + "]")
             except Exception as err:
                 logger.error("Failed to process entry [" + entry["id"] + "] with error [" + str(err) + "], ignoring and continuing...")
                 try: 
                     self.NOTION.add_unknown_error_tag(entry["id"], entry["action-tags"])
-                except APIResponseError as err:
+                except (APIResponseError, UpstreamUnavailableError) as err:
                     logger.error("Failed to add failed orders tag to entry [" + entry["id"] + "] with error [" + str(err) + "], ignoring and continuing...")
             
+    async def process_entries_async(self, entries: AsyncIterable[dict]):
+        """
+        Process the entries concurrently as they arrive, at most CONCURRENCY at a time
+        """
+        if (entries is None):
+            raise ValueError("Entries are required")
+        
+        semaphore = asyncio.Semaphore(self.CONCURRENCY)
+        tasks = set()
+        
+        async def process(entry):
+            get_metrics().add_job_rows("JournalOrders", 1)
+            try:
+                await self.process_entry_async(entry)
+            except UpstreamUnavailableError as err:
+                # An upstream is down, leave the entry tagged for refresh for the next run rather than failing it
+                logger.warning("Leaving entry [" + entry["id"] + "] for the next run with error [" + str(err) + "]")
+            except Exception as err:
+                logger.error("Failed to process entry [" + entry["id"] + "] with error [" + str(err) + "], ignoring and continuing...")
+                try: 
+                    await self.NOTION.add_unknown_error_tag_async(entry["id"], entry["action-tags"])
+                except (APIResponseError, UpstreamUnavailableError) as err:
+                    logger.error("Failed to add failed orders tag to entry [" + entry["id"] + "] with error [" + str(err) + "], ignoring and continuing...")
+            finally:
+                semaphore.release()
+        
+        try:
+            async for entry in entries:
+                # Wait for a free slot before starting the next entry
+                await semaphore.acquire()
+                task = asyncio.create_task(process(entry))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            if (tasks):
+                await asyncio.gather(*tasks)
+    
     def process_entry(self, entry):
-        logger.info("Processing entry [" + entry["id"] + "] with [" + str(len(entry["order-references"])) + "] order references")
+        return self.NOTION.run_operation(self.process_entry_operation(entry))
+    
+    async def process_entry_async(self, entry):
+        return await self.NOTION.run_operation_async(self.process_entry_operation(entry))
+    
+    def process_entry_operation(self, entry) -> Operation:
+        """
+        Refresh the orders table and the properties of an entry, as a Notion operation driven by the sync or the async client
+        """
+        logger.info("Processing entry [%s] with [%d] order references", entry["id"], len(entry["order-references"]))
 
-        # Query the Google Sheets API to get rows with matching Order References
+        # Get rows with matching Order References from the Google Sheets cache
         entry["orders"] = self.SHEETS.get_rows_with_order_references(entry["order-references"])
         
-        # Delete exisiting table block if it exists
+        # Sum the columns Effect, Total (inc. Fees)
+        missing = self.append_net_row(entry["orders"])
+        
+        # Gather the entry property changes, committed at once when the entry is done
+        patch = self.NOTION.new_entry_patch(entry)
+        
+        # Update the existing table block in place, only writing the rows that changed
+        synced = False
         if (entry["table-block-id"]):
-            try: 
-                self.NOTION.delete_block(entry["table-block-id"])
+            try:
+                synced = yield from self.NOTION.sync_orders_table_block_operation(entry["table-block-id"], entry["orders"])
             except APIResponseError as err:
-                logger.error("Failed to delete table block [" + entry["table-block-id"] + "] with error [" + str(err) + "], ignoring and creating a new block...")
-        entry["table-block-id"] = None
+                logger.error("Failed to sync table block [" + entry["table-block-id"] + "] with error [" + str(err) + "], recreating it...")
         
-        # Sum the columns Effect, Total (inc. Fees)
+        if (not synced):
+            # Delete exisiting table block if it exists
+            if (entry["table-block-id"]):
+                try: 
+                    yield from self.NOTION.delete_block_operation(entry["table-block-id"])
+                except APIResponseError as err:
+                    logger.error("Failed to delete table block [" + entry["table-block-id"] + "] with error [" + str(err) + "], ignoring and creating a new block...")
+            entry["table-block-id"] = None
+            
+            # Create a new table block with the orders
+            if (entry["orders"]):
+                entry["table-block-id"] = yield from self.NOTION.create_orders_table_block_operation(entry["id"], entry["orders"])
+            else:
+                logger.warning("No orders found for entry [" + entry["id"] + "]")
+            
+            # Point the entry at the new table block
+            patch.set_table_block_id(entry["table-block-id"])
+        
+        # Remove the refresh-orders tag, keeping the other tags, and flag any missing orders
+        self.update_tags(patch, missing)
+        yield from self.NOTION.commit_entry_patch_operation(patch)
+    
+    def append_net_row(self, orders) -> bool:
+        """
+        Append the net row summing the columns Effect, Total (inc. Fees), returns whether any orders are missing
+        """
         effect = 0
         total = 0
         missing = False
-        for order in entry["orders"][1:]:
+        for order in orders[1:]:
             if order[6] is not None and order[6] != "" and order[7] is not None and order[7] != "":
                 effect += float(order[6].replace(',', ''))
                 total += float(order[7].replace(',', ''))
             else:
                 missing = True
-        entry["orders"].append(["", "", "", "", "", "Net:", str(round(effect, 2)), str(round(total, 2)), "", "", "", "", ""])
-        
-        # Create a new table block with the orders
-        if (entry["orders"]):
-            entry["table-block-id"] = self.NOTION.create_orders_table_block(entry["id"], entry["orders"])
-        else:
-            logger.warning("No orders found for entry [" + entry["id"] + "]")
-        
-        # Update the entry with the new table block id
-        self.NOTION.update_entry_table_block_id(entry["id"], entry["table-block-id"])
-        
-        # Remove the refresh-orders tag
-        tags = [tag["name"] for tag in entry["action-tags"]]
-        print(tags)
-        self.NOTION.remove_refresh_orders_tag(entry["id"])
-        # Add a missing orders tag if any orders are missing
+        orders.append(["", "", "", "", "", "Net:", str(round(effect, 2)), str(round(total, 2)), "", "", "", "", ""])
+        return missing
+    
+    def update_tags(self, patch: EntryPatch, missing: bool):
+        """
+        Compute the tags of a refreshed entry
+        """
+        patch.remove_tag("refresh-orders")
+        patch.remove_tag("unknown-error")
         if (missing):
-            self.NOTION.add_missing_orders_tag(entry["id"])
\ No newline at end of file
+            patch.add_tag("missing-orders")
+        else:
+            patch.remove_tag("missing-orders")
@@ -1,7 +1,9 @@
+import asyncio
 from datetime import datetime as dt
 
 from src.logger_config import setup_logger
-from src.services.exchange import Exchange
+from src.services.exchange import Exchange, Order
+from src.services.metrics import get_metrics
 from src.services.sheets_ob import SheetsOB
 from src.helper import dt_to_str, get_exchange_type, get_rounded_time
 
@@ -37,28 +39,14 @@ class NewOrders:
         if (last_updated is None or len(last_updated) == 0):
             raise ValueError("No accounts found! This is weird...")
         
-        # Accumulate orders from each account
-        account_orders = {}
-        for account in last_updated.keys():
-            try: 
-                timestamp: dt = None
-                if (last_updated[account] is not None):
-                    # Convert 27/05/2024 00:00:00 to datetime
-                    timestamp = dt.strptime(last_updated[account], "%d/%m/%Y %H:%M:%S")
-                else: 
-                    timestamp = last_updated_if_none
-                
-                orders = self.run_for_account(account, timestamp)
-
-                if (orders is None or len(orders) == 0):
-                    logger.info(f"No new orders found for account [{account}]")
-                    continue
-                else:
-                    logger.info(f"Found [{len(orders)}] new orders for account [{account}]")
-                    account_orders[account] = orders
-            except Exception as e:
-                logger.error(f"Error running New Orders job for account [{account}] with exception [{e}], skipping and continuing...")        
+        # Let exchanges that need a symbol to list orders search the pairs already in the order book
+        for exchange_name, exchange in self.EXCHANGES.items():
+            exchange.set_candidate_symbols(self.SHEETS.get_ob_pairs(exchange_name))
+        
+        # Accumulate orders from each account, querying every account concurrently
+        account_orders = asyncio.run(self.get_account_orders(last_updated, last_updated_if_none))
         logger.info(f"Finished running New Orders job for [{len(account_orders)}] accounts, with [{sum([len(v) for v in account_orders.values()])}] new orders found in total")
+        get_metrics().add_job_rows("NewOrders", sum([len(v) for v in account_orders.values()]))
         
         # Update Google Sheets with the new orders, regardless if there are any (clears the existing data)
         self.SHEETS.update_new_orders(account_orders)
@@ -69,9 +57,41 @@ class NewOrders:
             if (last_updated[account] is None):
                 self.SHEETS.update_no_last_updated(account, last_updated_if_none)
         
-    def run_for_account(self, account: str, start_time: dt):
+    async def get_account_orders(self, last_updated: dict[str, str], last_updated_if_none: dt) -> dict[str, list[Order]]:
+        """
+        Get the new orders of every account concurrently, an account failing does not affect the others
+        """
+        accounts = list(last_updated.keys())
+        results = await asyncio.gather(*[self.get_orders_for_account(account, last_updated[account], last_updated_if_none) for account in accounts])
+        return {account: orders for account, orders in zip(accounts, results) if len(orders) > 0}
+    
+    async def get_orders_for_account(self, account: str, last_updated: str, last_updated_if_none: dt) -> list[Order]:
+        """
+        Get the new orders of an account, an empty list if there are none or the account failed
+        """
+        try: 
+            timestamp: dt = None
+            if (last_updated is not None):
+                # Convert 27/05/2024 00:00:00 to datetime
+                timestamp = dt.strptime(last_updated, "%d/%m/%Y %H:%M:%S")
+            else: 
+                timestamp = last_updated_if_none
+            
+            # Only the parsed orders are kept
+            orders = [order for order in await self.run_for_account_async(account, timestamp) or [] if order is not None]
+
+            if (len(orders) == 0):
+                logger.info(f"No new orders found for account [{account}]")
+            else:
+                logger.info(f"Found [{len(orders)}] new orders for account [{account}]")
+            return orders
+        except Exception as e:
+            logger.error(f"Error running New Orders job for account [{account}] with exception [{e}], skipping and continuing...")
+            return []
+    
+    async def run_for_account_async(self, account: str, start_time: dt) -> list[Order]:
         """
-        Run the job for a specific account
+        Run the job for a specific account without blocking the event loop
         """
         if (account is None):
             raise ValueError("Account is required")
@@ -89,9 +109,9 @@ class NewOrders:
         
         # Get all orders from the exchange
         if type == "Spot":
-            return exchange.get_all_spot_orders_from(timestamp)
+            return await exchange.get_all_spot_orders_from_async(timestamp)
         elif type in ["Margin", "Futures"]:
-            return exchange.get_all_leverage_orders_from(timestamp)
+            return await exchange.get_all_leverage_orders_from_async(timestamp)
         else:
             raise ValueError("Invalid exchange type")
     
\ No newline at end of file
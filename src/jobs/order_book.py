@@ -1,9 +1,13 @@
 from datetime import datetime
+import queue
+import threading
 
 from src.logger_config import setup_logger
 from src.services.exchange import Exchange, Order
+from src.services.metrics import get_metrics
+from src.services.resilience import UpstreamUnavailableError
 from src.services.sheets_ob import SheetsOB
-from src.helper import get_exchange_type
+from src.helper import get_exchange_name, get_exchange_type
 
 logger = setup_logger(__name__)
 
@@ -11,17 +15,27 @@ class OrderBook:
     """
     Automates the population of the google sheets order book using order references
     """
-    def __init__(self, sheets: SheetsOB, exchanges: list[Exchange]):
+    # Sentinel pushed through the pipeline queues to signal the end of a stage
+    END_OF_STAGE = object()
+    
+    def __init__(self, sheets: SheetsOB, exchanges: list[Exchange], concurrency: dict[str, int] = None, queue_size: int = 100):
         """
         Initialize the OrderBook class
+        concurrency maps an exchange name (or "default") to its number of fetch workers, 
+        when set, rows are processed by the staged pipeline instead of sequentially
         """
         if (sheets is None):
             raise ValueError("Sheets is required")
         if (exchanges is None and len(exchanges) == 0):
             raise ValueError("Exchanges is required")
         
+        if (queue_size is None or queue_size < 1):
+            raise ValueError("Queue size must be a positive number")
+        
         self.SHEETS=sheets
         self.EXCHANGES=exchanges
+        self.CONCURRENCY=concurrency
+        self.QUEUE_SIZE=queue_size
         
     def run(self):
         """
@@ -36,7 +50,17 @@ class OrderBook:
             return
         
         # Process each order reference
-        self.process_rows(rows)
+        try:
+            if (self.CONCURRENCY):
+                self.process_rows_pipeline(rows)
+            else:
+                self.process_rows(rows)
+        finally:
+            # Orders not yet terminal are only shared between the rows of this run
+            for exchange in self.EXCHANGES.values():
+                exchange.clear_run_orders()
+        
+        get_metrics().add_job_rows("OrderBook", len(rows))
         
         # Refresh the Google Sheets cache
         self.SHEETS.populate_cache()
@@ -53,25 +77,184 @@ class OrderBook:
             logger.info("No rows to process")
             return
         
+        for group in self.group_rows(rows):
+            # Get the sheets updated rows
+            for row_number, order_row in self.process_group(group):
+                # Update the Google Sheets row with the order
+                self.SHEETS.update_ob_row(row_number, order_row)
+        
+        # Write any buffered row updates
+        self.SHEETS.flush_ob_rows()
+        
+    def process_rows_pipeline(self, rows):
+        """
+        Process rows through a staged pipeline joined by bounded queues:
+        reader -> per exchange fetch workers -> writer
+        """
+        logger.info("Processing [" + str(len(rows)) + "] rows with the pipeline")
+        
+        if (rows is None or len(rows) == 0):
+            logger.info("No rows to process")
+            return
+        
+        # One bounded fetch queue and worker pool per exchange, a single writer queue shared by all
+        write_queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        fetch_queues: dict[str, queue.Queue] = {}
+        workers: list[threading.Thread] = []
+        for exchange_name in self.EXCHANGES:
+            fetch_queues[exchange_name] = queue.Queue(maxsize=self.QUEUE_SIZE)
+            for idx in range(self.get_concurrency(exchange_name)):
+                worker = threading.Thread(
+                    target=self.fetch_stage, 
+                    args=(fetch_queues[exchange_name], write_queue), 
+                    name="ob-fetch-" + exchange_name + "-" + str(idx), 
+                    daemon=True
+                )
+                worker.start()
+                workers.append(worker)
+        
+        reader = threading.Thread(target=self.read_stage, args=(rows, fetch_queues, write_queue), name="ob-reader", daemon=True)
+        writer = threading.Thread(target=self.write_stage, args=(write_queue,), name="ob-writer", daemon=True)
+        reader.start()
+        writer.start()
+        
+        # Wait for the reader and fetch workers, then signal the writer to finish
+        reader.join()
+        for worker in workers:
+            worker.join()
+        write_queue.put(self.END_OF_STAGE)
+        writer.join()
+        
+        logger.info("Finished processing [" + str(len(rows)) + "] rows with the pipeline")
+    
+    def get_concurrency(self, exchange_name) -> int:
+        """
+        Get the number of fetch workers for the exchange
+        """
+        concurrency = self.CONCURRENCY.get(exchange_name, self.CONCURRENCY.get("default", 1))
+        return max(1, int(concurrency))
+    
+    def read_stage(self, rows, fetch_queues: dict[str, queue.Queue], write_queue: queue.Queue):
+        """
+        Reader stage, route each group of rows to the fetch queue of its exchange
+        """
+        try:
+            for group in self.group_rows(rows):
+                row = group[0]
+                account = row[1]
+                exchange_name = get_exchange_name(account, self.EXCHANGES) if account else None
+                if (exchange_name is None):
+                    logger.error("Failed to determine exchange for row [" + str(row) + "]")
+                    write_queue.put((row[0], {
+                        "RTPS_REFRESH": "FAILED - Failed to determine exchange for account [" + str(account) + "]"
+                    }))
+                    continue
+                fetch_queues[exchange_name].put(group)
+        finally:
+            # Signal every fetch worker that there are no more rows
+            for exchange_name, fetch_queue in fetch_queues.items():
+                for _ in range(self.get_concurrency(exchange_name)):
+                    fetch_queue.put(self.END_OF_STAGE)
+    
+    def fetch_stage(self, fetch_queue: queue.Queue, write_queue: queue.Queue):
+        """
+        Fetch stage, query the exchange for each group of rows and pass the updated rows to the writer
+        """
+        while True:
+            group = fetch_queue.get()
+            if (group is self.END_OF_STAGE):
+                return
+            
+            for item in self.process_group(group):
+                write_queue.put(item)
+    
+    def write_stage(self, write_queue: queue.Queue):
+        """
+        Writer stage, the only stage talking to Google Sheets
+        """
+        while True:
+            item = write_queue.get()
+            if (item is self.END_OF_STAGE):
+                # Write any buffered row updates
+                try:
+                    self.SHEETS.flush_ob_rows()
+                except Exception as e:
+                    logger.error("Failed to write buffered row updates with error [" + str(e) + "]")
+                return
+            
+            row_number, order_row = item
+            try:
+                self.SHEETS.update_ob_row(row_number, order_row)
+            except Exception as e:
+                logger.error("Failed to update row [" + str(row_number) + "] with error [" + str(e) + "]")
+        
+    def group_rows(self, rows) -> list[list]:
+        """
+        Group rows of the same account and pair when the exchange resolves orders of the account type in batches,
+        any other row is a group of its own, groups keep the order of their first row
+        """
+        groups: dict[tuple, list] = {}
+        for row in rows:
+            key = (row[0],)
+            try:
+                _, account, pair, order_reference = row
+                if (account and pair and order_reference):
+                    exchange, type = get_exchange_type(account, self.EXCHANGES)
+                    if (exchange is not None and type in getattr(exchange, "BATCH_ACCOUNT_TYPES", [])):
+                        key = (account, pair)
+            except Exception:
+                # Invalid rows are reported when processed on their own
+                pass
+            groups.setdefault(key, []).append(row)
+        return list(groups.values())
+    
+    def process_group(self, rows) -> list[tuple]:
+        """
+        Process a group of rows of the same account and pair, error handling
+        Orders are resolved in a single batch where possible, the orders the batch did not find are fetched individually
+        Returns the (row_num, updated row) of the rows to update
+        """
+        orders = self.fetch_orders_batch(rows) if len(rows) > 1 else {}
+        
+        res = []
         for row in rows:
             # Get the sheets updated row
             order_row = None
             try:
-                order_row = self.process_row(row)
+                order_row = self.process_row(row, orders)
+            except UpstreamUnavailableError as e:
+                # The exchange is down, leave the row pending for the next run rather than failing it
+                logger.warning("Leaving row [%s] pending with error [%s]", row[0], e)
             except Exception as e: 
                 logger.error("Failed to process row [" + str(row) + "] with error [" + str(e) + "]")
                 order_row = {
                     "RTPS_REFRESH": "FAILED - " + str(e)
                 }
-                
-            # Update the Google Sheets row with the order
+            
             if (order_row is not None):
-                self.SHEETS.update_ob_row(row[0], order_row)
+                res.append((row[0], order_row))
+        return res
+    
+    def fetch_orders_batch(self, rows) -> dict[str, Order]:
+        """
+        Fetch the orders of rows of the same account and pair in a batch, returns the orders found by order reference
+        A failed batch resolves no order, leaving every row to be fetched individually
+        """
+        _, account, pair, _ = rows[0]
+        order_references = [row[3] for row in rows]
+        exchange, type = get_exchange_type(account, self.EXCHANGES)
+        try:
+            if (type == "Spot"):
+                return exchange.query_spot_orders_batch(pair, order_references)
+            return exchange.query_leverage_orders_batch(pair, order_references)
+        except Exception as e:
+            logger.warning("Failed to fetch [" + str(len(rows)) + "] orders in batch for account [" + account + "], pair [" + pair + "] with error [" + str(e) + "], fetching individually...")
+            return {}
         
-    def process_row(self, row):
+    def process_row(self, row, orders: dict[str, Order] = None):
         """
         Process row with [row_num, account, pair, order reference]
-        Fetch the order from the corresponding exchange and update the Google Sheets row
+        Fetch the order from the corresponding exchange, unless already in orders, and update the Google Sheets row
         """
         _, account, pair, order_reference = row
         
@@ -79,10 +262,14 @@ class OrderBook:
         if (account is None or pair is None or order_reference is None):
             raise ValueError("Invalid row with account [" + account + "], pair [" + pair + "], order reference [" + order_reference + "]")
         
-        logger.info("Processing row with account [" + account + "], pair [" + pair + "], order reference [" + order_reference + "]")
+        logger.info("Processing row with account [%s], pair [%s], order reference [%s]", account, pair, order_reference)
         
-        # Fetch the order from the corresponding exchange
-        order: Order = self.fetch_order(account, pair, order_reference)
+        # Fetch the order from the corresponding exchange, unless resolved by a batch
+        order: Order = None
+        if (orders is not None and str(order_reference) in orders):
+            order = orders[str(order_reference)]
+        else:
+            order = self.fetch_order(account, pair, order_reference)
         
         # If the fetch_order returns None, the order is being skipped for some reason, ignore, do not update the Google Sheets row
         if (order is None):
@@ -106,7 +293,7 @@ class OrderBook:
         """
         Fetch the order from the corresponding exchange
         """
-        logger.debug("Fetching order for account [" + account + "], pair [" + pair + "], order reference [" + order_reference + "]")
+        logger.debug("Fetching order for account [%s], pair [%s], order reference [%s]", account, pair, order_reference)
         
         # Determine the exchange, type
         exchange: Exchange
@@ -1,25 +1,179 @@
+import atexit
+import copy
+from datetime import datetime, timezone
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
 
-def setup_logger(logger_name=None):
-    # Get the logger for this module or for the specified module
-    logger = logging.getLogger(logger_name or __name__)
+# Attributes of every log record, anything else on a record came from extra= and is a structured field
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)-7s] %(name)-25s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+EXCEPTION_FORMATTER = logging.Formatter()
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON line, with the fields passed in extra= alongside the message
+    """
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if (name not in RECORD_ATTRIBUTES and not name.startswith("_")):
+                entry[name] = value
+        if (record.exc_info and not record.exc_text):
+            record.exc_text = self.formatException(record.exc_info)
+        if (record.exc_text):
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
 
-    # Set the logging level
-    logger.setLevel(logging.DEBUG)
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler of the process wide logging, told apart from any handler added elsewhere
+    """
+    def prepare(self, record):
+        """
+        Merge the message arguments in the calling thread, as they may change once queued, and leave the rest of the formatting to the listener
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if (record.exc_info):
+            record.exc_text = EXCEPTION_FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
-    # Check if the logger already has handlers
-    if not logger.handlers:
-        # Create a console handler with the same log level
+class LoggingConfig:
+    """
+    Process wide logging, every record reaching the root logger goes to one queue drained by a background thread,
+    so logging never blocks the caller on the console
+    Levels are set per logger name prefix, the longest matching prefix wins
+    """
+    def __init__(self, level: str = "DEBUG", levels: dict[str, str] = None, format: str = "text"):
+        """
+        Initialize the LoggingConfig class
+        """
+        if (format not in ["text", "json"]):
+            raise ValueError("Log format must be text or json")
+
+        self.LEVEL = logging.getLevelName(level.upper())
+        self.LEVELS = {name: logging.getLevelName(value.upper()) for name, value in (levels or {}).items()}
+        for name, value in [("", self.LEVEL)] + list(self.LEVELS.items()):
+            if (not isinstance(value, int)):
+                raise ValueError("Unknown log level [" + str(value) + "] for [" + (name or "default") + "]")
+
+        # Records are formatted and written by the listener thread
         handler = logging.StreamHandler()
-        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(JsonFormatter() if format == "json" else logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT))
+        self.QUEUE = queue.SimpleQueue()
+        self.HANDLER = QueueHandler(self.QUEUE)
+        self.LISTENER = logging.handlers.QueueListener(self.QUEUE, handler)
+        self.LISTENER.start()
+        self.STOPPED = False
+
+        root = logging.getLogger()
+        for previous in [handler for handler in root.handlers if isinstance(handler, QueueHandler)]:
+            root.removeHandler(previous)
+        root.addHandler(self.HANDLER)
 
-        # Create a formatter
-        formatter = logging.Formatter('%(asctime)s [%(levelname)-7s] %(name)-25s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    def get_level(self, logger_name: str) -> int:
+        """
+        Get the level of a logger, from its longest configured prefix
+        """
+        level = self.LEVEL
+        match = -1
+        for prefix, value in self.LEVELS.items():
+            if (len(prefix) > match and (logger_name == prefix or logger_name.startswith(prefix + "."))):
+                level = value
+                match = len(prefix)
+        return level
 
-        # Add the formatter to the handler
-        handler.setFormatter(formatter)
+    def apply(self, logger: logging.Logger):
+        """
+        Set the level of a logger, its records propagate to the queue on the root logger
+        """
+        logger.setLevel(self.get_level(logger.name))
 
-        # Add the handler to the logger
-        logger.addHandler(handler)
+    def stop(self):
+        """
+        Write the queued records and stop the listener thread
+        """
+        if (not self.STOPPED):
+            self.STOPPED = True
+            self.LISTENER.stop()
+
+def parse_levels(value: str) -> dict[str, str]:
+    """
+    Parse per logger levels, e.g. [src.services.binance_exchange=WARNING,src.jobs=INFO]
+    """
+    res = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        res[name.strip()] = level.strip()
+    return res
+
+# Process wide logging shared by every module, and the loggers set up so far
+_LOGGING: LoggingConfig = None
+_LOGGERS: list[logging.Logger] = []
+_LOGGING_LOCK = threading.RLock()
+
+def configure_logging(level: str = None, levels: dict[str, str] = None, format: str = None) -> LoggingConfig:
+    """
+    Configure the process wide logging, from LOG_LEVEL, LOG_LEVELS and LOG_FORMAT unless given, replacing any existing configuration
+    Loggers already set up are reconfigured
+    """
+    global _LOGGING
+    with _LOGGING_LOCK:
+        config = LoggingConfig(
+            level or os.getenv("LOG_LEVEL") or "DEBUG",
+            levels if levels is not None else parse_levels(os.getenv("LOG_LEVELS")),
+            format or os.getenv("LOG_FORMAT") or "text"
+        )
+        previous = _LOGGING
+        _LOGGING = config
+        for logger in _LOGGERS:
+            config.apply(logger)
+        if (previous is not None):
+            previous.stop()
+        return config
+
+def get_logging() -> LoggingConfig:
+    """
+    Get the process wide logging, configuring it from the environment on first use
+    """
+    with _LOGGING_LOCK:
+        if (_LOGGING is None):
+            configure_logging()
+        return _LOGGING
+
+def setup_logger(logger_name=None):
+    """
+    Get the logger for this module or for the specified module, writing through the process wide logging
+    Pass the message arguments separately e.g. logger.debug("Params [%s]", params), so they are only formatted when the record is emitted
+    """
+    logger = logging.getLogger(logger_name or __name__)
+    with _LOGGING_LOCK:
+        if logger not in _LOGGERS:
+            _LOGGERS.append(logger)
+        get_logging().apply(logger)
+    return logger
 
-    return logger
\ No newline at end of file
+@atexit.register
+def stop_logging():
+    """
+    Write the records still queued at exit
+    """
+    with _LOGGING_LOCK:
+        if (_LOGGING is not None):
+            _LOGGING.stop()
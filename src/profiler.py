@@ -0,0 +1,121 @@
+import cProfile
+from datetime import datetime
+import io
+import os
+import pstats
+import time
+import tracemalloc
+
+from src.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+class Profiler:
+    """
+    Profiles a job run with cProfile and tracemalloc, writing a report per run to REPORT_DIR
+    The report splits wall clock time into CPU and waiting (I/O, quotas, sleeps), then lists the hottest functions and the top allocation sites
+    """
+    # Number of functions and allocation sites listed in a report
+    TOP = 25
+    # Frames kept per allocation traceback
+    TRACEMALLOC_FRAMES = 1
+
+    def __init__(self, report_dir: str, top: int = None):
+        """
+        Initialize the Profiler class
+        """
+        if (report_dir is None):
+            raise ValueError("Report directory is required")
+
+        self.REPORT_DIR = report_dir
+        self.TOP = top or self.TOP
+
+    def run(self, name: str, fn):
+        """
+        Run fn under the profilers and write its report, returns the result of fn
+        The report is written even when fn raises
+        """
+        started_tracing = not tracemalloc.is_tracing()
+        if (started_tracing):
+            tracemalloc.start(self.TRACEMALLOC_FRAMES)
+        before = tracemalloc.take_snapshot()
+        # The peak is global to tracemalloc, only count the peak of this run
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        error = None
+        try:
+            profile.enable()
+            try:
+                return fn()
+            finally:
+                profile.disable()
+        except BaseException as err:
+            error = err
+            raise
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if (started_tracing):
+                tracemalloc.stop()
+            try:
+                self.write_report(name, wall, cpu, peak, profile, before, after, error)
+            except Exception as err:
+                logger.error("Failed to write profile report for [" + name + "] with error [" + str(err) + "]")
+
+    def write_report(self, name: str, wall: float, cpu: float, peak: int, profile: cProfile.Profile, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, error: BaseException = None) -> str:
+        """
+        Write the report of a run, alongside the raw cProfile stats for pstats or snakeviz, returns the report path
+        """
+        os.makedirs(self.REPORT_DIR, exist_ok=True)
+        # Milliseconds then a counter, so runs close together do not overwrite each other's report
+        base_path = os.path.join(self.REPORT_DIR, name + "-" + datetime.now().strftime("%Y%m%d-%H%M%S-%f")[:-3])
+        suffix = 1
+        while os.path.exists(base_path + ("-" + str(suffix) if suffix > 1 else "") + ".txt"):
+            suffix += 1
+        if (suffix > 1):
+            base_path += "-" + str(suffix)
+        profile.dump_stats(base_path + ".prof")
+
+        lines = [
+            "Profile of [" + name + "]" + (" failed with error [" + str(error) + "]" if error is not None else ""),
+            "",
+            "Wall clock [" + format_seconds(wall) + "]",
+            # process_time counts the CPU of every thread, so pipelines with workers can exceed wall clock
+            "CPU        [" + format_seconds(cpu) + "] (" + str(round(100 * cpu / wall, 1) if wall > 0 else 0) + "% of wall clock, all threads)",
+            "Waiting    [" + format_seconds(max(0.0, wall - cpu)) + "] (I/O, quotas, sleeps)",
+            "Peak traced memory [" + format_bytes(peak) + "]",
+            "",
+            "Top allocation sites, net of the run",
+        ]
+        for stat in after.compare_to(before, "lineno")[:self.TOP]:
+            if (stat.size_diff <= 0):
+                break
+            frame = stat.traceback[0]
+            lines.append("  " + format_bytes(stat.size_diff).rjust(10) + " in [" + str(stat.count_diff) + "] blocks  " + frame.filename + ":" + str(frame.lineno))
+
+        # Functions of the thread running the job, workers started by the job are not profiled
+        for sort, title in [("tottime", "Hottest functions by own time"), ("cumulative", "Hottest functions by cumulative time")]:
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).strip_dirs().sort_stats(sort).print_stats(self.TOP)
+            lines += ["", title, stream.getvalue().strip()]
+
+        path = base_path + ".txt"
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        logger.info("Profiled [" + name + "] in [" + format_seconds(wall) + "], CPU [" + format_seconds(cpu) + "], report written to [" + path + "]")
+        return path
+
+def format_seconds(seconds: float) -> str:
+    return str(round(seconds, 3)) + "s"
+
+def format_bytes(size: int) -> str:
+    for unit in ["B", "KiB", "MiB"]:
+        if (abs(size) < 1024):
+            return str(round(size, 1)) + " " + unit
+        size /= 1024
+    return str(round(size, 1)) + " GiB"
@@ -0,0 +1,204 @@
+from datetime import datetime, timedelta
+import threading
+import time
+from typing import Callable
+
+from src.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+class IntervalSchedule:
+    """
+    Run every seconds, starting immediately
+    """
+    def __init__(self, seconds: float):
+        """
+        Initialize the IntervalSchedule class
+        """
+        if (seconds is None or seconds <= 0):
+            raise ValueError("Interval must be a positive number of seconds")
+
+        self.SECONDS=seconds
+
+    def first_run(self, now: datetime) -> datetime:
+        return now
+
+    def next_after(self, after: datetime) -> datetime:
+        return after + timedelta(seconds=self.SECONDS)
+
+    def __str__(self):
+        return "every " + str(self.SECONDS) + "s"
+
+class CronSchedule:
+    """
+    Run on a 5 field cron expression [minute hour day-of-month month day-of-week],
+    fields accept [*], [*/step], [a-b], [a-b/step] and comma separated lists, day-of-week 0 is Sunday
+    """
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression: str):
+        """
+        Initialize the CronSchedule class
+        """
+        if (expression is None):
+            raise ValueError("Cron expression is required")
+        fields = expression.split()
+        if (len(fields) != 5):
+            raise ValueError("Cron expression [" + expression + "] must have 5 fields")
+
+        self.EXPRESSION=expression
+        self.MINUTES, self.HOURS, self.DAYS, self.MONTHS, self.WEEKDAYS = [
+            self.parse_field(field, low, high) for field, (low, high) in zip(fields, self.FIELD_RANGES)
+        ]
+        # When both day fields are restricted, either may match
+        self.ANY_DAY = fields[2] == "*"
+        self.ANY_WEEKDAY = fields[4] == "*"
+
+    def parse_field(self, field: str, low: int, high: int) -> set[int]:
+        """
+        Parse a cron field into the set of values it matches
+        """
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if ("/" in part):
+                part, step = part.split("/", 1)
+                step = int(step)
+            if (part == "*"):
+                start, end = low, high
+            elif ("-" in part):
+                start, end = [int(value) for value in part.split("-", 1)]
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if (start < low or end > high or start > end or step < 1):
+                raise ValueError("Invalid cron field [" + field + "]")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def matches_day(self, moment: datetime) -> bool:
+        day = moment.day in self.DAYS
+        weekday = (moment.weekday() + 1) % 7 in self.WEEKDAYS
+        if (self.ANY_DAY or self.ANY_WEEKDAY):
+            return day and weekday
+        return day or weekday
+
+    def first_run(self, now: datetime) -> datetime:
+        return self.next_after(now)
+
+    def next_after(self, after: datetime) -> datetime:
+        """
+        Get the first matching minute strictly after after
+        """
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Every schedule matches within a few years, e.g. the 29th of February on a Monday
+        limit = moment + timedelta(days=366 * 8)
+        while moment < limit:
+            if (moment.month not in self.MONTHS or not self.matches_day(moment)):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif (moment.hour not in self.HOURS):
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif (moment.minute not in self.MINUTES):
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError("Cron expression [" + self.EXPRESSION + "] never matches")
+
+    def __str__(self):
+        return "cron [" + self.EXPRESSION + "]"
+
+def parse_schedule(value: str):
+    """
+    Parse a schedule, a number of seconds for an interval or a cron expression
+    """
+    try:
+        return IntervalSchedule(float(value))
+    except ValueError:
+        return CronSchedule(value)
+
+class Scheduler:
+    """
+    Run jobs on their schedules until stopped
+    Jobs run one at a time on the calling thread, so a job never overlaps itself or the others,
+    a run that overruns its next slot is coalesced into the next slot after it completes
+    Background tasks run on their own threads, unaffected by long jobs
+    """
+    def __init__(self):
+        """
+        Initialize the Scheduler class
+        """
+        self.JOBS: list[dict] = []
+        self.TASKS: list[threading.Thread] = []
+        self.STOP = threading.Event()
+
+    def add_job(self, name: str, fn: Callable[[], None], schedule):
+        """
+        Add a job run on schedule, an IntervalSchedule or CronSchedule
+        """
+        logger.info("Scheduling job [" + name + "] " + str(schedule))
+        self.JOBS.append({"name": name, "fn": fn, "schedule": schedule, "next": None, "runs": 0})
+
+    def add_background_task(self, name: str, fn: Callable[[], None], seconds: float):
+        """
+        Add a task run every seconds on its own thread until the scheduler stops
+        """
+        def loop():
+            while not self.STOP.wait(seconds):
+                try:
+                    fn()
+                except Exception as err:
+                    logger.error("Background task [" + name + "] failed with error [" + str(err) + "], retrying in [" + str(seconds) + "] seconds")
+
+        self.TASKS.append(threading.Thread(target=loop, name=name, daemon=True))
+
+    def run(self):
+        """
+        Run the jobs until stop is called
+        """
+        if (len(self.JOBS) == 0):
+            raise ValueError("No jobs scheduled")
+
+        for task in self.TASKS:
+            task.start()
+        now = datetime.now()
+        for job in self.JOBS:
+            job["next"] = job["schedule"].first_run(now)
+
+        while not self.STOP.is_set():
+            job = min(self.JOBS, key=lambda job: job["next"])
+            wait = (job["next"] - datetime.now()).total_seconds()
+            if (wait > 0):
+                self.STOP.wait(wait)
+                continue
+
+            self.run_job(job)
+
+            # Coalesce the slots missed while the job was running
+            now = datetime.now()
+            job["next"] = job["schedule"].next_after(job["next"])
+            if (job["next"] < now):
+                logger.warning("Job [" + job["name"] + "] overran its schedule, skipping to the next slot")
+                job["next"] = job["schedule"].next_after(now)
+
+        for task in self.TASKS:
+            task.join()
+        logger.info("Scheduler stopped")
+
+    def run_job(self, job: dict):
+        """
+        Run a job, a failing run is logged and the job stays scheduled
+        """
+        start = time.monotonic()
+        try:
+            job["fn"]()
+            logger.info("Job [" + job["name"] + "] completed in [" + str(round(time.monotonic() - start, 3)) + "] seconds")
+        except Exception as err:
+            logger.exception("Job [" + job["name"] + "] failed with error [" + str(err) + "]")
+        job["runs"] += 1
+
+    def stop(self):
+        """
+        Stop the scheduler once the running job, if any, completes
+        """
+        logger.info("Stopping scheduler...")
+        self.STOP.set()
@@ -1,22 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
+import heapq
 import time
-import requests
 import hmac
 import hashlib
 import urllib.parse
 
 from src.logger_config import setup_logger
 from src.services.exchange import Exchange, Order
+from src.services.http_transport import HttpTransport, get_transport
+from src.services.metrics import Metrics, get_metrics
+from src.services.order_cache import OrderCache
+from src.services.quota_manager import QuotaManager, get_quota_manager
+from src.services.resilience import Resilience, get_resilience, get_response_failure
 
 logger = setup_logger(__name__)
 
 class BinanceExchange(Exchange):
     BASE_URL = "https://api.binance.com"
     ACCECTED_STATUSES = ["FILLED", "PARTIALLY_FILLED", "CANCELED"]
+    TERMINAL_STATUSES = ["FILLED", "CANCELED"]
+    # Request weight per endpoint, https://binance-docs.github.io/apidocs/spot/en/#limits
+    ENDPOINT_WEIGHTS = {
+        "/api/v3/order": 4,
+        "/api/v3/allOrders": 20,
+        "/sapi/v1/margin/order": 10,
+        "/sapi/v1/margin/allOrders": 200,
+        "/api/v3/account": 20,
+        "/sapi/v1/margin/account": 10,
+        "/api/v3/userDataStream": 2,
+        "/sapi/v1/userDataStream": 1,
+    }
+    # Maximum number of orders returned by a single allOrders request
+    ALL_ORDERS_LIMIT = 1000
+    # Orders of a pair are resolved in batches with allOrders
+    BATCH_ACCOUNT_TYPES = ["Spot", "Margin"]
+    # Response headers reporting the used weight of the current minute, per quota upstream
+    USED_WEIGHT_HEADERS = {
+        "binance": "X-MBX-USED-WEIGHT-1M",
+        "binance-sapi": "X-SAPI-USED-IP-WEIGHT-1M",
+    }
 
-    def __init__(self, name, key, secret):
+    def __init__(self, name, key, secret, transport: HttpTransport = None, quotas: QuotaManager = None, symbols: list[str] = None, quote_assets: list[str] = None, max_workers: int = 8, order_cache: OrderCache = None, metrics: Metrics = None, resilience: Resilience = None):
         """
         Initialize the Binance class
+        symbols are pairs [BTC/USDT] always searched for new orders, alongside pairs of the account balances
+        in quote_assets and the candidate symbols set by the jobs
         """
         if (name is None):
             raise ValueError("Name is required")
@@ -25,10 +54,21 @@ class BinanceExchange(Exchange):
         if (secret is None):
             raise ValueError("Secret is required")
         
+        self.NAME = name
         self.ACC_NAME_SPOT = name + " Spot"
         self.ACC_NAME_LEVERAGE = name + " Margin"
         self.KEY=key
         self.SECRET=secret
+        self.TRANSPORT = transport if transport is not None else get_transport()
+        self.QUOTAS = quotas if quotas is not None else get_quota_manager()
+        self.METRICS = metrics if metrics is not None else get_metrics()
+        self.RESILIENCE = resilience if resilience is not None else get_resilience()
+        self.SYMBOLS = list(symbols) if symbols is not None else []
+        self.QUOTE_ASSETS = list(quote_assets) if quote_assets is not None else ["USDT"]
+        self.MAX_WORKERS = max_workers
+        self.CANDIDATE_SYMBOLS: set[str] = set()
+        self.ORDER_CACHE = order_cache
+        self.USER_STREAM = None
     
     def format_pair(self, pair):
         """
@@ -46,28 +86,140 @@ class BinanceExchange(Exchange):
     
     def request(self, method, endpoint, params=None, payload=None):
         """
-        Make a request to the Binance API
+        Make a request to the Binance API, retrying transient failures
         """
         url = self.BASE_URL + endpoint
         headers = {
             "X-MBX-APIKEY": self.KEY
         }
         
-        params['timestamp'] = int(time.time() * 1000) 
-        params['signature'] = self.get_signature(params)
+        if method != "GET":
+            raise ValueError("Invalid method")
+        
+        upstream = "binance-sapi" if endpoint.startswith("/sapi") else "binance"
+        
+        def send():
+            # Signed again on every attempt, the timestamp must stay within the receive window
+            params.pop('signature', None)
+            params['timestamp'] = int(time.time() * 1000) 
+            params['signature'] = self.get_signature(params)
+            
+            logger.debug("Making a [%s] request to [%s] with params [%s] and payload [%s]", method, url, params, payload)
+            
+            self.QUOTAS.acquire(upstream, self.ENDPOINT_WEIGHTS.get(endpoint, 1))
+            with self.METRICS.time_request(upstream, endpoint) as request:
+                res = self.TRANSPORT.request("GET", url, headers=headers, params=params)
+                request.set_response(res.status_code, len(res.content))
+            self.observe_quota(upstream, res)
+            return res
+        
+        return self.RESILIENCE.call(upstream, send, get_response_failure).json()
+    
+    def user_stream_request(self, method, endpoint, params=None):
+        """
+        Make a request to a Binance user data stream endpoint, these only need the API key
+        https://binance-docs.github.io/apidocs/spot/en/#listen-key-spot
+        """
+        url = self.BASE_URL + endpoint
+        headers = {
+            "X-MBX-APIKEY": self.KEY
+        }
         
-        logger.debug("Making a [" + method + "] request to [" + url + "] with params [" + str(params) + "] and payload [" + str(payload) + "]")
+        logger.debug("Making a [%s] request to [%s]", method, url)
         
-        if method == "GET":
-            res = requests.get(url, headers=headers, params=params)
-        else:
+        if method not in ["POST", "PUT", "DELETE"]:
             raise ValueError("Invalid method")
         
-        return res.json()
+        upstream = "binance-sapi" if endpoint.startswith("/sapi") else "binance"
+        
+        def send():
+            self.QUOTAS.acquire(upstream, self.ENDPOINT_WEIGHTS.get(endpoint, 1))
+            with self.METRICS.time_request(upstream, endpoint) as request:
+                res = self.TRANSPORT.request(method, url, headers=headers, params=params)
+                request.set_response(res.status_code, len(res.content))
+            self.observe_quota(upstream, res)
+            return res
+        
+        # Creating a listen key is not idempotent, keeping alive and closing one are
+        res = self.RESILIENCE.call(upstream, send, get_response_failure, idempotent=method != "POST")
+        body = res.json()
+        if (isinstance(body, dict) and body.get("code") is not None):
+            raise ValueError("User data stream request [" + method + " " + endpoint + "] failed with code [" + str(body.get("code")) + "] and error [" + str(body.get("msg")) + "]")
+        return body
+    
+    def observe_quota(self, upstream, res):
+        """
+        Feed the used weight and throttling reported by Binance to the quota manager
+        https://binance-docs.github.io/apidocs/spot/en/#limits
+        """
+        used = res.headers.get(self.USED_WEIGHT_HEADERS[upstream])
+        if (used is not None):
+            self.QUOTAS.observe_used(upstream, float(used))
+        if (res.status_code in [418, 429]):
+            self.QUOTAS.throttled(upstream, res.headers.get("Retry-After"))
 
-    def parse_order(self, api_order) -> Order:
+    def set_candidate_symbols(self, symbols: list[str]):
         """
-        Parse the order response from the Binance API
+        Set the pairs [BTC/USDT] to search for orders, e.g. pairs already in the order book
+        """
+        self.CANDIDATE_SYMBOLS = set(symbols) if symbols is not None else set()
+    
+    def to_pair(self, symbol) -> str:
+        """
+        Format the Binance symbol [BTCUSDT] as a pair [BTC/USDT], using the known pairs then the quote assets
+        """
+        for pair in set(self.SYMBOLS) | self.CANDIDATE_SYMBOLS:
+            if (self.format_pair(pair) == symbol):
+                return pair.upper()
+        for quote_asset in self.QUOTE_ASSETS:
+            if (symbol.endswith(quote_asset) and len(symbol) > len(quote_asset)):
+                return symbol[:-len(quote_asset)] + "/" + quote_asset
+        return symbol
+    
+    def start_order_stream(self, stream_url=None):
+        """
+        Start ingesting spot and margin orders from the user data streams, served by get_all_*_orders_from once they cover the start time
+        """
+        from src.services.binance_user_stream import BinanceUserStream
+        
+        if (self.USER_STREAM is not None):
+            return
+        self.USER_STREAM = BinanceUserStream(self, stream_url)
+        self.USER_STREAM.start()
+    
+    def stop_order_stream(self):
+        if (self.USER_STREAM is not None):
+            self.USER_STREAM.stop()
+            self.USER_STREAM = None
+    
+    def poll_orders_from(self, account_type, start_time) -> list[Order]:
+        """
+        Get all orders of the account type [Spot, Margin] from the start time over REST
+        """
+        if (account_type == "Spot"):
+            # allOrders requires a symbol, so query every candidate symbol
+            symbols = self.get_candidate_symbols(self.get_spot_assets())
+            return self.get_all_orders_for_symbols("/api/v3/allOrders", self.ACC_NAME_SPOT, symbols, start_time)
+        if (account_type == "Margin"):
+            # margin/allOrders requires a symbol, so query every candidate symbol
+            symbols = self.get_candidate_symbols(self.get_margin_assets())
+            return self.get_all_orders_for_symbols("/sapi/v1/margin/allOrders", self.ACC_NAME_LEVERAGE, symbols, start_time)
+        raise ValueError("Invalid account type [" + str(account_type) + "]")
+    
+    def get_orders_from(self, account_type, start_time) -> list[Order]:
+        """
+        Get all orders of the account type from the start time, from the user data stream when it covers the start time, over REST otherwise
+        """
+        if (self.USER_STREAM is not None):
+            orders = self.USER_STREAM.get_orders_from(account_type, start_time)
+            if (orders is not None):
+                logger.info("Found [" + str(len(orders)) + "] orders for account [" + self.NAME + " " + account_type + "] in the user data stream")
+                return orders
+        return self.poll_orders_from(account_type, start_time)
+    
+    def parse_order(self, api_order, symbol=None) -> Order:
+        """
+        Parse the order response from the Binance API, symbol is the [BTC/USDT] pair if known
         """
         timestamp = int(api_order["updateTime"]) / 1000
         executed_qty = float(api_order.get("executedQty"))
@@ -75,7 +227,7 @@ class BinanceExchange(Exchange):
         order: Order = {
             "order_id": str(api_order["orderId"]), 
             "datetime": dt.fromtimestamp(timestamp),
-            "symbol": str(api_order["symbol"]), # TODO BTCUSDT should be BTC/USDT
+            "symbol": symbol if symbol is not None else self.to_pair(api_order["symbol"]),
             "side": api_order["side"].capitalize(),
             "average": average_price,
             "executed": executed_qty,
@@ -86,7 +238,13 @@ class BinanceExchange(Exchange):
     
     def query_spot_order(self, symbol, orderId) -> Order:
         """
-        Query a spot account order
+        Query a spot account order, terminal orders are read through the order cache
+        """
+        return self.read_through_cache("Spot", self.format_pair(symbol), orderId, lambda: self.fetch_spot_order(symbol, orderId))
+
+    def fetch_spot_order(self, symbol, orderId) -> tuple[Order, bool]:
+        """
+        Query a spot account order, returns the order and whether it reached a terminal status
         https://binance-docs.github.io/apidocs/spot/en/#query-order-user_data
         """
         endpoint = "/api/v3/order"
@@ -109,22 +267,33 @@ class BinanceExchange(Exchange):
         
         # Check if the order has FILLED, PARTIALLY_FILLED, CANCELLED status 
         if (api_order["status"] not in self.ACCECTED_STATUSES):
-            logger.warning("Order for account [" + self.ACC_NAME_SPOT + "], pair [" + pair + "], order reference [" + str(orderId) + "] has status [" + str(api_order.get("status")) + "] which is not accecpted, skipping...")
-            return None
+            logger.warning("Order for account [%s], pair [%s], order reference [%s] has status [%s] which is not accecpted, skipping...", self.ACC_NAME_SPOT, pair, orderId, api_order.get("status"))
+            return None, False
         
-        return self.parse_order(api_order)
+        return self.parse_order(api_order), api_order["status"] in self.TERMINAL_STATUSES
 
+    def query_spot_orders_batch(self, symbol, order_ids) -> dict[str, Order]:
+        """
+        Query several spot account orders of a pair with allOrders, terminal orders are read through the order cache
+        """
+        return self.read_batch_through_cache("Spot", self.format_pair(symbol), order_ids, lambda missing: self.fetch_orders_batch("/api/v3/allOrders", "/api/v3/order", self.ACC_NAME_SPOT, symbol, missing))
+    
     def get_all_spot_orders_from(self, start_time) -> list[Order]:
         """
         Get all spot orders from the exchange from the start time
         https://binance-docs.github.io/apidocs/spot/en/#all-orders-user_data
         """
-        # TODO Spot read all orders require symbol as part of the request, so we can't get all orders
-        pass
+        return self.get_orders_from("Spot", start_time)
 
     def query_leverage_order(self, symbol, orderId) -> Order:
         """
-        Query a margin account order
+        Query a margin account order, terminal orders are read through the order cache
+        """
+        return self.read_through_cache("Margin", self.format_pair(symbol), orderId, lambda: self.fetch_leverage_order(symbol, orderId))
+
+    def fetch_leverage_order(self, symbol, orderId) -> tuple[Order, bool]:
+        """
+        Query a margin account order, returns the order and whether it reached a terminal status
         https://binance-docs.github.io/apidocs/spot/en/#query-margin-account-39-s-order-user_data
         """
         endpoint = "/sapi/v1/margin/order"
@@ -147,15 +316,160 @@ class BinanceExchange(Exchange):
         
         # Check if the order has FILLED, PARTIALLY_FILLED, CANCELLED status 
         if (api_order["status"] not in self.ACCECTED_STATUSES):
-            logger.warning("Order for account [" + self.ACC_NAME_LEVERAGE + "], pair [" + pair + "], order reference [" + str(orderId) + "] has status [" + str(api_order.get("status")) + "] which is not accecpted, skipping...")
-            return None
+            logger.warning("Order for account [%s], pair [%s], order reference [%s] has status [%s] which is not accecpted, skipping...", self.ACC_NAME_LEVERAGE, pair, orderId, api_order.get("status"))
+            return None, False
+        
+        return self.parse_order(api_order), api_order["status"] in self.TERMINAL_STATUSES
+    
+    def query_leverage_orders_batch(self, symbol, order_ids) -> dict[str, Order]:
+        """
+        Query several margin account orders of a pair with margin/allOrders, terminal orders are read through the order cache
+        """
+        return self.read_batch_through_cache("Margin", self.format_pair(symbol), order_ids, lambda missing: self.fetch_orders_batch("/sapi/v1/margin/allOrders", "/sapi/v1/margin/order", self.ACC_NAME_LEVERAGE, symbol, missing))
+    
+    def fetch_orders_batch(self, endpoint, order_endpoint, account_name, symbol, order_ids: list[str]) -> dict[str, tuple[Order, bool]]:
+        """
+        Resolve orders of a pair with allOrders pages from the lowest order id, following the orderId cursor until every order is found
+        Pages are capped at the weight the individual order_endpoint queries would have used, the orders not found are left out
+        Returns {order id: (order, terminal)}, the order is None when its status is not accepted
+        """
+        pair = self.format_pair(symbol)
+        wanted = set(str(order_id) for order_id in order_ids)
+        max_order_id = max(int(order_id) for order_id in wanted)
+        max_pages = max(1, len(wanted) * self.ENDPOINT_WEIGHTS[order_endpoint] // self.ENDPOINT_WEIGHTS[endpoint])
+        logger.info("Querying [" + str(len(wanted)) + "] orders for account [" + account_name + "], pair [" + pair + "] in batch")
+        
+        res = {}
+        from_order_id = min(int(order_id) for order_id in wanted)
+        for _ in range(max_pages):
+            params = {
+                "symbol": pair,
+                "orderId": from_order_id,
+                "limit": self.ALL_ORDERS_LIMIT,
+            }
+            api_orders = self.request("GET", endpoint, params=params)
+            
+            # Check Error
+            if (api_orders is None or isinstance(api_orders, dict)):
+                code = api_orders.get("code") if isinstance(api_orders, dict) else None
+                raise ValueError("Failed to fetch orders for account [" + account_name + "], pair [" + pair + "] with code [" + str(code) + "] and response [" + str(api_orders) + "]")
+            
+            for api_order in api_orders:
+                order_id = str(api_order["orderId"])
+                if (order_id not in wanted):
+                    continue
+                # Check if the order has FILLED, PARTIALLY_FILLED, CANCELLED status 
+                if (api_order["status"] not in self.ACCECTED_STATUSES):
+                    logger.warning("Order for account [%s], pair [%s], order reference [%s] has status [%s] which is not accecpted, skipping...", account_name, pair, order_id, api_order.get("status"))
+                    res[order_id] = (None, False)
+                    continue
+                # Orders without an executed quantity are left to the individual query
+                if (float(api_order["executedQty"]) == 0):
+                    continue
+                res[order_id] = (self.parse_order(api_order, symbol), api_order["status"] in self.TERMINAL_STATUSES)
+            
+            # Stop once every order is found or there are no more orders up to the highest order id
+            if (len(res) == len(wanted) or len(api_orders) < self.ALL_ORDERS_LIMIT):
+                break
+            from_order_id = max(int(api_order["orderId"]) for api_order in api_orders) + 1
+            if (from_order_id > max_order_id):
+                break
         
-        return self.parse_order(api_order)
+        logger.debug("Found [%d] of [%d] orders for account [%s], pair [%s] in batch", len(res), len(wanted), account_name, pair)
+        return res
     
     def get_all_leverage_orders_from(self, start_time) -> list[Order]:
         """
         Get all margin orders from the exchange from the start time
         https://binance-docs.github.io/apidocs/spot/en/#query-margin-account-39-s-all-orders-user_data
         """
-        # TODO Margin read all orders require symbol as part of the request, so we can't get all orders
-        pass
\ No newline at end of file
+        return self.get_orders_from("Margin", start_time)
+    
+    def get_spot_assets(self) -> list[str]:
+        """
+        Get the assets with a spot balance
+        https://binance-docs.github.io/apidocs/spot/en/#account-information-user_data
+        """
+        account = self.request("GET", "/api/v3/account", params={"omitZeroBalances": "true"})
+        if (account is None or not isinstance(account, dict) or account.get("code") is not None):
+            logger.warning("Failed to fetch spot balances for account [" + self.ACC_NAME_SPOT + "] with response [" + str(account) + "]")
+            return []
+        return [balance["asset"] for balance in account.get("balances", []) if float(balance["free"]) + float(balance["locked"]) > 0]
+    
+    def get_margin_assets(self) -> list[str]:
+        """
+        Get the assets with a cross margin balance or loan
+        https://binance-docs.github.io/apidocs/spot/en/#query-cross-margin-account-details-user_data
+        """
+        account = self.request("GET", "/sapi/v1/margin/account", params={})
+        if (account is None or not isinstance(account, dict) or account.get("code") is not None):
+            logger.warning("Failed to fetch margin balances for account [" + self.ACC_NAME_LEVERAGE + "] with response [" + str(account) + "]")
+            return []
+        return [asset["asset"] for asset in account.get("userAssets", []) if float(asset["netAsset"]) != 0 or float(asset["borrowed"]) != 0]
+    
+    def get_candidate_symbols(self, assets: list[str]) -> list[str]:
+        """
+        Get the pairs [BTC/USDT] to search for orders, from the balance assets, the candidate symbols and the configured symbols
+        """
+        symbols = set(self.SYMBOLS) | self.CANDIDATE_SYMBOLS
+        for asset in assets:
+            for quote_asset in self.QUOTE_ASSETS:
+                if asset != quote_asset:
+                    symbols.add(asset + "/" + quote_asset)
+        return sorted(symbol.upper() for symbol in symbols if symbol)
+    
+    def get_all_orders_for_symbols(self, endpoint, account_name, symbols: list[str], start_time) -> list[Order]:
+        """
+        Query the allOrders endpoint for each symbol concurrently, merging the results by time
+        """
+        if (len(symbols) == 0):
+            logger.info("No candidate symbols for account [" + account_name + "]")
+            return []
+        logger.debug("Getting all orders for account [" + account_name + "] across [" + str(len(symbols)) + "] symbols starting from [" + str(start_time) + "]")
+        
+        # Request weight is paced by the quota manager, the pool only bounds the requests in flight
+        with ThreadPoolExecutor(max_workers=max(1, min(self.MAX_WORKERS, len(symbols))), thread_name_prefix="binance-all-orders") as executor:
+            results = list(executor.map(lambda symbol: self.get_all_orders_for_symbol(endpoint, account_name, symbol, start_time), symbols))
+        
+        orders = list(heapq.merge(*results, key=lambda order: order["datetime"]))
+        logger.debug("Found [" + str(len(orders)) + "] orders for account [" + account_name + "] since [" + str(start_time) + "]")
+        return orders
+    
+    def get_all_orders_for_symbol(self, endpoint, account_name, symbol, start_time) -> list[Order]:
+        """
+        Get all orders for a single symbol from the start time, following the orderId cursor when a page is full
+        Returns the orders sorted by time
+        """
+        pair = self.format_pair(symbol)
+        orders = []
+        from_order_id = None
+        while True:
+            params = {
+                "symbol": pair,
+                "limit": self.ALL_ORDERS_LIMIT,
+            }
+            if (from_order_id is None):
+                params["startTime"] = start_time
+            else:
+                params["orderId"] = from_order_id
+            api_orders = self.request("GET", endpoint, params=params)
+            
+            # Check Error, an invalid symbol (e.g. an asset without a pair in this quote) is expected
+            if (api_orders is None or isinstance(api_orders, dict)):
+                code = api_orders.get("code") if isinstance(api_orders, dict) else None
+                if (code != -1121):
+                    logger.warning("Failed to fetch orders for account [%s], pair [%s] with response [%s]", account_name, pair, api_orders)
+                break
+            
+            for api_order in api_orders:
+                if (api_order["status"] not in self.ACCECTED_STATUSES or float(api_order["executedQty"]) == 0):
+                    continue
+                orders.append(self.parse_order(api_order, symbol))
+            
+            # A full page may have more orders after it
+            if (len(api_orders) < self.ALL_ORDERS_LIMIT):
+                break
+            from_order_id = max(int(api_order["orderId"]) for api_order in api_orders) + 1
+        
+        orders.sort(key=lambda order: order["datetime"])
+        return orders
@@ -0,0 +1,200 @@
+from datetime import datetime as dt
+import json
+import threading
+import time
+
+import websocket
+
+from src.logger_config import setup_logger
+from src.services.exchange import Order
+
+logger = setup_logger(__name__)
+
+class BinanceUserStream:
+    """
+    Push based order ingestion from the Binance spot and margin user data streams of an account
+    Orders are buffered as executionReport events arrive, a reconnect fills the gap since the last event over REST
+    https://binance-docs.github.io/apidocs/spot/en/#user-data-streams
+    """
+    STREAM_URL = "wss://stream.binance.com:9443/ws/"
+    # listenKey endpoint per account type, keys expire 60 minutes after the last keepalive
+    LISTEN_KEY_ENDPOINTS = {
+        "Spot": "/api/v3/userDataStream",
+        "Margin": "/sapi/v1/userDataStream",
+    }
+    KEEPALIVE_SECONDS = 30 * 60
+    # Seconds to wait before reconnecting after a failure
+    RECONNECT_SECONDS = 5
+    # Seconds of overlap when filling the gap after a reconnect, covering events in flight when the stream dropped
+    GAP_FILL_MARGIN_SECONDS = 60
+    # Seconds a recv waits before checking for a keepalive or a stop
+    RECV_TIMEOUT = 5
+    # Seconds without any frame, server pings included, before a silent connection is reopened and the gap filled
+    SILENCE_SECONDS = 5 * 60
+
+    def __init__(self, exchange, stream_url=None, account_types: list[str] = None):
+        """
+        Initialize the BinanceUserStream class for a BinanceExchange
+        """
+        if (exchange is None):
+            raise ValueError("Exchange is required")
+
+        self.EXCHANGE = exchange
+        self.STREAM_URL = stream_url or self.STREAM_URL
+        self.ACCOUNT_TYPES = account_types if account_types is not None else list(self.LISTEN_KEY_ENDPOINTS.keys())
+        self.STOP = threading.Event()
+        self.LOCK = threading.Lock()
+        self.THREADS: list[threading.Thread] = []
+        # Per account type, buffered orders by order id
+        self.ORDERS: dict[str, dict[str, Order]] = {account_type: {} for account_type in self.ACCOUNT_TYPES}
+        # Per account type, the epoch ms since which every order is in the buffer, None while disconnected
+        self.COVERED_FROM: dict[str, int] = {account_type: None for account_type in self.ACCOUNT_TYPES}
+        # Per account type, the epoch ms a frame was last received, when the stream was last known to be healthy
+        self.LAST_SEEN: dict[str, int] = {account_type: None for account_type in self.ACCOUNT_TYPES}
+        self.CONNECTIONS: dict[str, websocket.WebSocket] = {}
+
+    def start(self):
+        """
+        Start a thread per account type stream
+        """
+        for account_type in self.ACCOUNT_TYPES:
+            thread = threading.Thread(target=self.run_stream, args=(account_type,), name="binance-user-stream-" + account_type, daemon=True)
+            thread.start()
+            self.THREADS.append(thread)
+
+    def stop(self):
+        """
+        Stop the streams and wait for their threads
+        """
+        self.STOP.set()
+        with self.LOCK:
+            connections = list(self.CONNECTIONS.values())
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        for thread in self.THREADS:
+            thread.join()
+        self.THREADS = []
+
+    def get_orders_from(self, account_type: str, start_time: int) -> list[Order]:
+        """
+        Get the buffered orders updated since start_time (epoch ms), sorted by time
+        Returns None when the stream has not covered every event since start_time, the caller should then poll
+        """
+        with self.LOCK:
+            covered_from = self.COVERED_FROM.get(account_type)
+            if (covered_from is None or covered_from > start_time):
+                return None
+
+            # start_time only moves forward once orders are written, so older orders are no longer needed
+            buffer = self.ORDERS[account_type]
+            for order_id in [order_id for order_id, order in buffer.items() if order["datetime"].timestamp() * 1000 < start_time]:
+                del buffer[order_id]
+            return sorted(buffer.values(), key=lambda order: order["datetime"])
+
+    def run_stream(self, account_type: str):
+        """
+        Keep the account type stream connected until stopped
+        """
+        while not self.STOP.is_set():
+            try:
+                self.connect(account_type)
+            except Exception as err:
+                if (self.STOP.is_set()):
+                    break
+                logger.error("User data stream for account [" + self.EXCHANGE.NAME + " " + account_type + "] failed with error [" + str(err) + "], reconnecting in [" + str(self.RECONNECT_SECONDS) + "] seconds...")
+            with self.LOCK:
+                self.COVERED_FROM[account_type] = None
+                self.CONNECTIONS.pop(account_type, None)
+            self.STOP.wait(self.RECONNECT_SECONDS)
+
+    def connect(self, account_type: str):
+        """
+        Open the stream and consume it until it drops, filling the gap since the last healthy moment first
+        """
+        endpoint = self.LISTEN_KEY_ENDPOINTS[account_type]
+        listen_key = self.EXCHANGE.user_stream_request("POST", endpoint)["listenKey"]
+        connection = websocket.create_connection(self.STREAM_URL + listen_key, timeout=self.RECV_TIMEOUT)
+        with self.LOCK:
+            self.CONNECTIONS[account_type] = connection
+        connected_at = int(time.time() * 1000)
+        logger.info("Connected user data stream for account [" + self.EXCHANGE.NAME + " " + account_type + "]")
+
+        try:
+            # Events are buffered from now on, fill the gap since the stream was last healthy over REST
+            covered_from = connected_at
+            last_seen = self.LAST_SEEN[account_type]
+            if (last_seen is not None):
+                gap_start = last_seen - self.GAP_FILL_MARGIN_SECONDS * 1000
+                logger.info("Filling user data stream gap for account [" + self.EXCHANGE.NAME + " " + account_type + "] since [" + str(dt.fromtimestamp(gap_start / 1000)) + "]")
+                self.add_orders(account_type, self.EXCHANGE.poll_orders_from(account_type, gap_start))
+                covered_from = gap_start
+            with self.LOCK:
+                self.COVERED_FROM[account_type] = covered_from
+            self.LAST_SEEN[account_type] = connected_at
+
+            keepalive_at = time.monotonic() + self.KEEPALIVE_SECONDS
+            while not self.STOP.is_set():
+                if (time.monotonic() >= keepalive_at):
+                    self.EXCHANGE.user_stream_request("PUT", endpoint, {"listenKey": listen_key})
+                    keepalive_at = time.monotonic() + self.KEEPALIVE_SECONDS
+                try:
+                    opcode, frame = connection.recv_data_frame(control_frame=True)
+                except websocket.WebSocketTimeoutException:
+                    # A half-open connection only ever times out, reopen it once the server has been silent for too long
+                    if (time.time() * 1000 - self.LAST_SEEN[account_type] >= self.SILENCE_SECONDS * 1000):
+                        raise ConnectionError("No frame received for [" + str(self.SILENCE_SECONDS) + "] seconds")
+                    continue
+                if (opcode == websocket.ABNF.OPCODE_CLOSE):
+                    raise ConnectionError("Stream closed by the server")
+                self.LAST_SEEN[account_type] = int(time.time() * 1000)
+                if (opcode != websocket.ABNF.OPCODE_TEXT):
+                    continue
+                if (not self.handle_message(account_type, json.loads(frame.data))):
+                    return
+        finally:
+            connection.close()
+
+    def handle_message(self, account_type: str, event: dict) -> bool:
+        """
+        Handle a stream event, returns False when the stream must be reopened
+        """
+        if (event.get("e") == "executionReport"):
+            order = self.parse_execution_report(event)
+            if (order is not None):
+                self.add_orders(account_type, [order])
+        elif (event.get("e") == "listenKeyExpired"):
+            logger.warning("Listen key expired for account [" + self.EXCHANGE.NAME + " " + account_type + "], reconnecting...")
+            return False
+        return True
+
+    def parse_execution_report(self, event: dict) -> Order:
+        """
+        Parse an executionReport event into an order, None unless it has executed and has an accepted status
+        """
+        executed_qty = float(event["z"])
+        if (event["X"] not in self.EXCHANGE.ACCECTED_STATUSES or executed_qty == 0):
+            return None
+
+        order: Order = {
+            "order_id": str(event["i"]),
+            "datetime": dt.fromtimestamp(int(event["T"]) / 1000),
+            "symbol": self.EXCHANGE.to_pair(event["s"]),
+            "side": event["S"].capitalize(),
+            "average": float(event["Z"]) / executed_qty,
+            "executed": executed_qty,
+            "fee": None,
+            "fee_currency": None
+        }
+        return order
+
+    def add_orders(self, account_type: str, orders: list[Order]):
+        """
+        Buffer orders, keeping the latest state of each order
+        """
+        with self.LOCK:
+            buffer = self.ORDERS[account_type]
+            for order in orders:
+                buffer[order["order_id"]] = order
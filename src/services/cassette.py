@@ -0,0 +1,245 @@
+import asyncio
+from collections import deque
+import gzip
+import json
+import os
+import threading
+import time
+
+from requests.structures import CaseInsensitiveDict
+
+from src.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+class Cassette:
+    """
+    Record of the upstream calls of a run, to replay the run offline
+    Recording appends each call, its response and its duration, written to a gzipped JSON lines file on save
+    Replaying serves the recorded responses in order per request, waiting speed times the recorded duration (0 for no latency)
+    """
+    VERSION = 1
+    REDACTED = "[REDACTED]"
+    # Fields never written to a cassette, whatever their value
+    REDACTED_FIELDS = {"signature", "listenkey", "apikey", "x-mbx-apikey", "auth", "authorization", "token", "access_token", "refresh_token", "client_secret"}
+    # Request fields changing on every call, left out of the request key
+    VOLATILE_FIELDS = {"timestamp", "signature", "recvWindow"}
+
+    def __init__(self, path: str, mode: str, speed: float = 1.0, secrets: list[str] = None):
+        """
+        Initialize the Cassette class in mode [record] or [replay]
+        secrets are values redacted wherever they appear in the recording, e.g. API keys
+        """
+        if (path is None):
+            raise ValueError("Path is required")
+        if (mode not in ["record", "replay"]):
+            raise ValueError("Mode must be record or replay")
+        if (speed is None or speed < 0):
+            raise ValueError("Speed must not be negative")
+
+        self.PATH = path
+        self.MODE = mode
+        self.SPEED = speed
+        self.SECRETS = [secret for secret in (secrets or []) if secret]
+        self.LOCK = threading.Lock()
+        self.INTERACTIONS: list[dict] = []
+        # Replay queues of unplayed interactions, by request key and by route as a fallback
+        self.BY_KEY: dict[str, deque] = {}
+        self.BY_ROUTE: dict[str, deque] = {}
+        if (mode == "replay"):
+            self.load()
+
+    @property
+    def replaying(self) -> bool:
+        return self.MODE == "replay"
+
+    def get_key(self, upstream: str, route: str, request: dict) -> str:
+        """
+        Get the key identifying a request, without its volatile and redacted fields
+        """
+        request = {name: value for name, value in (request or {}).items() if name not in self.VOLATILE_FIELDS}
+        return upstream + " " + route + " " + json.dumps(self.redact(request), sort_keys=True, default=str)
+
+    def call(self, upstream: str, route: str, request: dict, fn, encode, decode):
+        """
+        Make a call through the cassette
+        Recording, fn() is called and encode(result, error) turns its result or exception into a JSON response
+        Replaying, decode(response) turns the recorded response back into the result, or raises the recorded exception
+        """
+        key = self.get_key(upstream, route, request)
+        if (self.replaying):
+            interaction = self.take(key, upstream + " " + route)
+            if (self.SPEED > 0):
+                time.sleep(interaction["seconds"] * self.SPEED)
+            return decode(interaction["response"])
+
+        start = time.perf_counter()
+        try:
+            res = fn()
+        except Exception as err:
+            self.add_error(key, upstream + " " + route, encode(None, err), time.perf_counter() - start)
+            raise
+        self.add(key, upstream + " " + route, encode(res, None), time.perf_counter() - start)
+        return res
+
+    async def call_async(self, upstream: str, route: str, request: dict, fn, encode, decode):
+        """
+        Make a call through the cassette from a coroutine, fn() returns an awaitable
+        """
+        key = self.get_key(upstream, route, request)
+        if (self.replaying):
+            interaction = self.take(key, upstream + " " + route)
+            if (self.SPEED > 0):
+                await asyncio.sleep(interaction["seconds"] * self.SPEED)
+            return decode(interaction["response"])
+
+        start = time.perf_counter()
+        try:
+            res = await fn()
+        except Exception as err:
+            self.add_error(key, upstream + " " + route, encode(None, err), time.perf_counter() - start)
+            raise
+        self.add(key, upstream + " " + route, encode(res, None), time.perf_counter() - start)
+        return res
+
+    def add_error(self, key: str, route: str, response: dict, seconds: float):
+        """
+        Record a failed call, unless encode returned None for an error it cannot replay e.g. a connection error
+        """
+        if (response is not None):
+            self.add(key, route, response, seconds)
+
+    def add(self, key: str, route: str, response: dict, seconds: float):
+        """
+        Record an interaction
+        """
+        with self.LOCK:
+            self.INTERACTIONS.append({"key": key, "route": route, "seconds": round(seconds, 6), "response": self.redact(response)})
+
+    def take(self, key: str, route: str) -> dict:
+        """
+        Take the next unplayed interaction for the request, or for its route when the request was not recorded as is,
+        e.g. a start time derived from the clock
+        """
+        with self.LOCK:
+            # An interaction sits in both queues, the played flag skips it in the other one
+            for queue in [self.BY_KEY.get(key), self.BY_ROUTE.get(route)]:
+                while queue:
+                    interaction = queue.popleft()
+                    if (interaction.get("played")):
+                        continue
+                    interaction["played"] = True
+                    if (interaction["key"] != key):
+                        logger.debug("Replaying [%s] with the next recorded call to route [%s]", key, route)
+                    return interaction
+        raise LookupError("No recorded response left for [" + key + "] in cassette [" + self.PATH + "]")
+
+    def redact(self, value):
+        """
+        Redact the credential fields and the secret values of a JSON value
+        """
+        if (isinstance(value, dict)):
+            return {name: self.REDACTED if str(name).lower() in self.REDACTED_FIELDS else self.redact(item) for name, item in value.items()}
+        if (isinstance(value, list)):
+            return [self.redact(item) for item in value]
+        if (isinstance(value, str)):
+            for secret in self.SECRETS:
+                value = value.replace(secret, self.REDACTED)
+        return value
+
+    def save(self):
+        """
+        Write the recorded interactions, replacing the cassette file atomically
+        """
+        if (self.replaying):
+            return
+        if (os.path.dirname(self.PATH)):
+            os.makedirs(os.path.dirname(self.PATH), exist_ok=True)
+        with self.LOCK:
+            interactions = list(self.INTERACTIONS)
+        temp_path = self.PATH + ".tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as file:
+            file.write(json.dumps({"version": self.VERSION, "interactions": len(interactions)}) + "\n")
+            for interaction in interactions:
+                file.write(json.dumps(interaction, separators=(",", ":"), default=str) + "\n")
+        os.replace(temp_path, self.PATH)
+        logger.info("Recorded [" + str(len(interactions)) + "] upstream calls to cassette [" + self.PATH + "]")
+
+    def load(self):
+        """
+        Load the interactions of the cassette file for replay
+        """
+        with gzip.open(self.PATH, "rt", encoding="utf-8") as file:
+            header = json.loads(file.readline())
+            if (header.get("version") != self.VERSION):
+                raise ValueError("Unsupported cassette version [" + str(header.get("version")) + "] in [" + self.PATH + "]")
+            self.INTERACTIONS = [json.loads(line) for line in file if line.strip()]
+        for interaction in self.INTERACTIONS:
+            self.BY_KEY.setdefault(interaction["key"], deque()).append(interaction)
+            self.BY_ROUTE.setdefault(interaction["route"], deque()).append(interaction)
+        logger.info("Loaded [" + str(len(self.INTERACTIONS)) + "] upstream calls from cassette [" + self.PATH + "]")
+
+class RecordedResponse:
+    """
+    Replayed HTTP response, with the parts of requests.Response the exchange adapters use
+    """
+    def __init__(self, status_code: int, headers: dict, text: str):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.text = text
+        self.content = text.encode("utf-8")
+
+    def json(self):
+        return json.loads(self.text)
+
+class CassetteTransport:
+    """
+    HttpTransport recording or replaying the exchange adapters' requests through a cassette
+    """
+    # Response headers the adapters read, any other header is left out of the recording
+    RECORDED_HEADERS = ["Retry-After", "X-MBX-USED-WEIGHT-1M", "X-SAPI-USED-IP-WEIGHT-1M"]
+
+    def __init__(self, transport, cassette: Cassette):
+        """
+        Initialize the CassetteTransport class around transport, which is not used when replaying
+        """
+        if (cassette is None):
+            raise ValueError("Cassette is required")
+
+        self.TRANSPORT = transport
+        self.CASSETTE = cassette
+
+    def request(self, method, url, headers=None, params=None, json=None, timeout=None):
+        """
+        Make a request through the cassette, request headers carry the credentials and are never recorded
+        """
+        host, _, path = url.partition("://")[2].partition("/")
+
+        request = dict(params or {})
+        if (json is not None):
+            request["json"] = json
+        return self.CASSETTE.call(host, method + " /" + path, request, lambda: self.TRANSPORT.request(method, url, headers=headers, params=params, json=json, timeout=timeout), self.encode_response, self.decode_response)
+
+    def encode_response(self, res, err) -> dict:
+        """
+        Encode a response for the cassette, errors raised by the transport are not recorded
+        """
+        if (err is not None):
+            return None
+        response = {
+            "status": res.status_code,
+            "headers": {name: res.headers[name] for name in self.RECORDED_HEADERS if name in res.headers},
+        }
+        # JSON bodies are recorded parsed, so their credential fields e.g. listenKey are redacted
+        try:
+            response["json"] = res.json()
+        except ValueError:
+            response["text"] = res.text
+        return response
+
+    def decode_response(self, response: dict) -> RecordedResponse:
+        """
+        Decode a response from the cassette
+        """
+        text = response["text"] if "text" in response else json.dumps(response["json"])
+        return RecordedResponse(response["status"], response["headers"], text)
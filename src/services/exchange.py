@@ -1,4 +1,5 @@
 from abc import ABC
+import asyncio
 from datetime import datetime as dt
 from typing import Literal, NotRequired, TypedDict
 
@@ -13,12 +14,82 @@ class Order(TypedDict):
     fee_currency: NotRequired[str]
 
 class Exchange(ABC):
+    # Account types [Spot, Margin, Futures] whose query_*_orders_batch resolve several orders per request
+    BATCH_ACCOUNT_TYPES: list[str] = []
+    
+    def read_through_cache(self, account_type: str, symbol: str, orderId: str, fetch) -> Order:
+        """
+        Read an order through the order cache of the exchange when it has one (ORDER_CACHE)
+        fetch returns the order and whether it reached a terminal status
+        """
+        order_cache = getattr(self, "ORDER_CACHE", None)
+        if (order_cache is None):
+            order, _ = fetch()
+            return order
+        return order_cache.read_through((self.NAME, account_type, symbol, str(orderId)), fetch)
+    
+    def read_batch_through_cache(self, account_type: str, symbol: str, order_ids: list[str], fetch) -> dict[str, Order]:
+        """
+        Read orders through the order cache of the exchange when it has one (ORDER_CACHE), returns the orders found by order id
+        fetch takes the order ids not cached and returns {order id: (order, terminal)} for the orders it found
+        """
+        order_cache = getattr(self, "ORDER_CACHE", None)
+        res = {}
+        missing = []
+        for order_id in dict.fromkeys(str(order_id) for order_id in order_ids):
+            key = (self.NAME, account_type, symbol, order_id)
+            order = (order_cache.get_run_order(key) or order_cache.get(key)) if order_cache is not None else None
+            if (order is not None):
+                res[order_id] = order
+            else:
+                missing.append(order_id)
+        
+        if (len(missing) > 0):
+            for order_id, (order, terminal) in fetch(missing).items():
+                if (order_cache is not None):
+                    order_cache.store((self.NAME, account_type, symbol, order_id), order, terminal)
+                res[order_id] = order
+        return res
+    
+    def clear_run_orders(self):
+        """
+        Forget the orders the order cache remembered for the run (ORDER_CACHE), at the end of a job run
+        """
+        order_cache = getattr(self, "ORDER_CACHE", None)
+        if (order_cache is not None):
+            order_cache.clear_run_orders()
+    
+    def set_candidate_symbols(self, symbols: list[str]):
+        """
+        Set the pairs [BTC/USDT] known to be traded on the account, used by exchanges that need a symbol to list orders
+        """
+        pass
+    
+    def start_order_stream(self):
+        """
+        Start pushing new orders from the exchange, for long running processes, a no-op for exchanges that only poll
+        """
+        pass
+    
+    def stop_order_stream(self):
+        """
+        Stop pushing new orders from the exchange
+        """
+        pass
+    
     def query_spot_order(self, symbol: str, orderId: str) -> Order:
         """
         Query a spot account order
         """
         pass
     
+    def query_spot_orders_batch(self, symbol: str, order_ids: list[str]) -> dict[str, Order]:
+        """
+        Query several spot account orders of a pair, returns the orders found by order id, None for an order found but skipped
+        Orders missing from the result should be queried individually, by default none are found
+        """
+        return {}
+    
     def get_all_spot_orders_from(self, start_time) -> list[Order]:
         """
         Get all spot orders from the exchange from the start time
@@ -31,9 +102,41 @@ class Exchange(ABC):
         """
         pass
     
+    def query_leverage_orders_batch(self, symbol: str, order_ids: list[str]) -> dict[str, Order]:
+        """
+        Query several leveraged (margin, futures) orders of a pair, returns the orders found by order id, None for an order found but skipped
+        Orders missing from the result should be queried individually, by default none are found
+        """
+        return {}
+    
     def get_all_leverage_orders_from(self, start_time) -> list[Order]:
         """
         Get all leveraged (margin, futures) orders from the exchange from the start time
         """
         pass
-    
\ No newline at end of file
+    
+    
+    async def query_spot_order_async(self, symbol: str, orderId: str) -> Order:
+        """
+        Query a spot account order without blocking the event loop
+        The adapters share the blocking HTTP transport, its connection pools, quotas and order cache, so the call runs on a worker thread
+        """
+        return await asyncio.to_thread(self.query_spot_order, symbol, orderId)
+    
+    async def get_all_spot_orders_from_async(self, start_time) -> list[Order]:
+        """
+        Get all spot orders from the exchange from the start time without blocking the event loop
+        """
+        return await asyncio.to_thread(self.get_all_spot_orders_from, start_time)
+    
+    async def query_leverage_order_async(self, symbol: str, orderId: str) -> Order:
+        """
+        Query a leveraged (margin, futures) order without blocking the event loop
+        """
+        return await asyncio.to_thread(self.query_leverage_order, symbol, orderId)
+    
+    async def get_all_leverage_orders_from_async(self, start_time) -> list[Order]:
+        """
+        Get all leveraged (margin, futures) orders from the exchange from the start time without blocking the event loop
+        """
+        return await asyncio.to_thread(self.get_all_leverage_orders_from, start_time)
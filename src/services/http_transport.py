@@ -0,0 +1,120 @@
+import threading
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+class HttpTransport:
+    """
+    Shared HTTP transport for the exchange adapters, holding a keep-alive connection pool per host
+    """
+    def __init__(self, pool_connections=4, pool_maxsize=10, timeout=(5, 30)):
+        """
+        Initialize the HttpTransport class
+        pool_maxsize is the number of connections kept alive per host, timeout is (connect, read) in seconds
+        """
+        if (pool_connections is None or pool_connections < 1):
+            raise ValueError("Pool connections must be a positive number")
+        if (pool_maxsize is None or pool_maxsize < 1):
+            raise ValueError("Pool max size must be a positive number")
+
+        self.POOL_CONNECTIONS=pool_connections
+        self.POOL_MAXSIZE=pool_maxsize
+        self.TIMEOUT=timeout
+        self.SESSIONS: dict[str, requests.Session] = {}
+        self.LOCK = threading.Lock()
+
+    def get_session(self, host) -> requests.Session:
+        """
+        Get the session for the host, creating it on first use
+        """
+        session = self.SESSIONS.get(host)
+        if (session is not None):
+            return session
+
+        with self.LOCK:
+            if (host not in self.SESSIONS):
+                logger.debug("Creating connection pool for host [" + host + "] with max size [" + str(self.POOL_MAXSIZE) + "]")
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.POOL_CONNECTIONS, pool_maxsize=self.POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self.SESSIONS[host] = session
+            return self.SESSIONS[host]
+
+    def request(self, method, url, headers=None, params=None, json=None, timeout=None) -> requests.Response:
+        """
+        Make a request through the connection pool of the url's host
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        session = self.get_session(host)
+        return session.request(method, url, headers=headers, params=params, json=json, timeout=timeout or self.TIMEOUT)
+
+    def get_stats(self) -> dict[str, dict[str, int]]:
+        """
+        Get the connection reuse statistics per host,
+        [requests] made, [connections] opened and [reused] requests served by an existing connection
+        """
+        stats = {}
+        for host, session in list(self.SESSIONS.items()):
+            adapter: HTTPAdapter = session.get_adapter("https://" + host)
+            num_requests = 0
+            num_connections = 0
+            # Each session only serves its own host
+            for pool_key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                num_requests += pool.num_requests
+                num_connections += pool.num_connections
+            stats[host] = {
+                "requests": num_requests,
+                "connections": num_connections,
+                "reused": max(0, num_requests - num_connections),
+            }
+        return stats
+
+    def log_stats(self):
+        """
+        Log the connection reuse statistics per host
+        """
+        for host, stats in self.get_stats().items():
+            logger.info("Host [" + host + "] made [" + str(stats["requests"]) + "] requests over [" + str(stats["connections"]) + "] connections, reusing connections [" + str(stats["reused"]) + "] times")
+
+    def close(self):
+        """
+        Close every connection pool
+        """
+        with self.LOCK:
+            for session in self.SESSIONS.values():
+                session.close()
+            self.SESSIONS = {}
+
+# Process wide transport shared by every exchange adapter
+_TRANSPORT: HttpTransport = None
+_TRANSPORT_LOCK = threading.Lock()
+
+def configure_transport(pool_connections=4, pool_maxsize=10, timeout=(5, 30)) -> HttpTransport:
+    """
+    Configure the process wide transport, replacing any existing one
+    """
+    global _TRANSPORT
+    with _TRANSPORT_LOCK:
+        if (_TRANSPORT is not None):
+            _TRANSPORT.close()
+        _TRANSPORT = HttpTransport(pool_connections, pool_maxsize, timeout)
+        return _TRANSPORT
+
+def get_transport() -> HttpTransport:
+    """
+    Get the process wide transport, creating it with the default configuration on first use
+    """
+    global _TRANSPORT
+    with _TRANSPORT_LOCK:
+        if (_TRANSPORT is None):
+            _TRANSPORT = HttpTransport()
+        return _TRANSPORT
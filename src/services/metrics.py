@@ -0,0 +1,256 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+import time
+
+from src.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+class RequestTimer:
+    """
+    Times an upstream request, the caller records the response status and sizes once known
+    Leaving the block with an exception counts the request as an error
+    """
+    def __init__(self, metrics, upstream: str, endpoint: str):
+        self.METRICS = metrics
+        self.UPSTREAM = upstream
+        self.ENDPOINT = endpoint
+        self.STATUS: int = None
+        self.BYTES_SENT = 0
+        self.BYTES_RECEIVED = 0
+        self.STARTED = None
+
+    def set_response(self, status: int = None, bytes_received: int = 0, bytes_sent: int = None):
+        """
+        Record the response status code and the bytes transferred
+        """
+        self.STATUS = status
+        self.BYTES_RECEIVED = bytes_received or 0
+        if (bytes_sent is not None):
+            self.BYTES_SENT = bytes_sent
+
+    def __enter__(self):
+        self.STARTED = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.METRICS.observe_request(
+            self.UPSTREAM,
+            self.ENDPOINT,
+            time.perf_counter() - self.STARTED,
+            status=self.STATUS,
+            error=exc_type is not None,
+            bytes_sent=self.BYTES_SENT,
+            bytes_received=self.BYTES_RECEIVED
+        )
+        return False
+
+class Metrics:
+    """
+    Thread safe registry of per upstream request and per job metrics,
+    exported in the Prometheus text format to a file or over a local HTTP endpoint
+    """
+    PREFIX = "rtp_squire_"
+    # Latency histogram buckets in seconds
+    BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+    # Status codes the upstreams use to throttle requests
+    THROTTLE_STATUSES = [418, 429]
+    # Metric families as name: (type, help)
+    FAMILIES = {
+        "request_duration_seconds": ("histogram", "Upstream request latency in seconds"),
+        "requests_total": ("counter", "Upstream requests made"),
+        "request_errors_total": ("counter", "Upstream requests failed with an exception or an error status"),
+        "request_throttles_total": ("counter", "Upstream requests rejected by a rate limit"),
+        "request_bytes_total": ("counter", "Bytes transferred with the upstreams, by direction"),
+        "job_duration_seconds": ("histogram", "Job run duration in seconds"),
+        "job_runs_total": ("counter", "Job runs, by outcome"),
+        "job_rows_total": ("counter", "Rows processed by the jobs"),
+    }
+
+    def __init__(self):
+        """
+        Initialize the Metrics class
+        """
+        self.LOCK = threading.Lock()
+        # Per family, the value (counter) or [bucket counts, sum, count] (histogram) by label values
+        self.VALUES: dict[str, dict[tuple, object]] = {name: {} for name in self.FAMILIES}
+        self.SERVER: ThreadingHTTPServer = None
+
+    def inc(self, name: str, labels: dict[str, str], value: float = 1):
+        """
+        Increment a counter
+        """
+        key = tuple(sorted(labels.items()))
+        with self.LOCK:
+            values = self.VALUES[name]
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name: str, labels: dict[str, str], value: float):
+        """
+        Record a value in a histogram
+        """
+        key = tuple(sorted(labels.items()))
+        with self.LOCK:
+            values = self.VALUES[name]
+            histogram = values.get(key)
+            if (histogram is None):
+                histogram = values[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+            for idx, bound in enumerate(self.BUCKETS):
+                if (value <= bound):
+                    histogram[0][idx] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get(self, name: str, labels: dict[str, str]) -> float:
+        """
+        Get the value of a counter, 0 when never incremented
+        """
+        with self.LOCK:
+            return self.VALUES[name].get(tuple(sorted(labels.items())), 0)
+
+    def time_request(self, upstream: str, endpoint: str) -> RequestTimer:
+        """
+        Time a request to an upstream endpoint, used as a context manager
+        """
+        return RequestTimer(self, upstream, endpoint)
+
+    def observe_request(self, upstream: str, endpoint: str, seconds: float, status: int = None, error: bool = False, bytes_sent: int = 0, bytes_received: int = 0):
+        """
+        Record an upstream request, a status of 400 and above counts as an error
+        """
+        labels = {"upstream": upstream, "endpoint": endpoint}
+        self.observe("request_duration_seconds", labels, seconds)
+        self.inc("requests_total", labels)
+        if (error or (status is not None and status >= 400)):
+            self.inc("request_errors_total", labels)
+        if (status in self.THROTTLE_STATUSES):
+            self.inc("request_throttles_total", labels)
+        if (bytes_sent):
+            self.inc("request_bytes_total", dict(labels, direction="sent"), bytes_sent)
+        if (bytes_received):
+            self.inc("request_bytes_total", dict(labels, direction="received"), bytes_received)
+
+    def observe_job(self, job: str, seconds: float, failed: bool = False):
+        """
+        Record a job run
+        """
+        self.observe("job_duration_seconds", {"job": job}, seconds)
+        self.inc("job_runs_total", {"job": job, "outcome": "failed" if failed else "completed"})
+
+    def add_job_rows(self, job: str, rows: int):
+        """
+        Record rows processed by a job
+        """
+        self.inc("job_rows_total", {"job": job}, rows)
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format
+        """
+        lines = []
+        with self.LOCK:
+            for name, (type, help) in self.FAMILIES.items():
+                full_name = self.PREFIX + name
+                lines.append("# HELP " + full_name + " " + help)
+                lines.append("# TYPE " + full_name + " " + type)
+                for key, value in sorted(self.VALUES[name].items()):
+                    labels = dict(key)
+                    if (type == "counter"):
+                        lines.append(full_name + format_labels(labels) + " " + format_value(value))
+                        continue
+                    bucket_counts, total, count = value
+                    for bound, bucket_count in zip(self.BUCKETS, bucket_counts):
+                        lines.append(full_name + "_bucket" + format_labels(dict(labels, le=format_value(bound))) + " " + str(bucket_count))
+                    lines.append(full_name + "_bucket" + format_labels(dict(labels, le="+Inf")) + " " + str(count))
+                    lines.append(full_name + "_sum" + format_labels(labels) + " " + format_value(total))
+                    lines.append(full_name + "_count" + format_labels(labels) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """
+        Write the metrics to path for the node exporter textfile collector, replacing the file atomically
+        """
+        directory = os.path.dirname(path)
+        if (directory):
+            os.makedirs(directory, exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as file:
+            file.write(self.render())
+        os.replace(temp_path, path)
+
+    def start_http_server(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        Serve the metrics on [http://host:port/metrics] from a background thread
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if (self.path.split("?")[0] != "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics request [" + (format % args) + "]")
+
+        self.SERVER = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.SERVER.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info("Serving metrics on [http://" + host + ":" + str(self.SERVER.server_address[1]) + "/metrics]")
+        return self.SERVER
+
+    def stop_http_server(self):
+        """
+        Stop serving the metrics
+        """
+        if (self.SERVER is not None):
+            self.SERVER.shutdown()
+            self.SERVER.server_close()
+            self.SERVER = None
+
+def format_labels(labels: dict[str, str]) -> str:
+    """
+    Format labels as [{name="value",...}], escaping the values
+    """
+    if (len(labels) == 0):
+        return ""
+    return "{" + ",".join(name + "=\"" + str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") + "\"" for name, value in labels.items()) + "}"
+
+def format_value(value: float) -> str:
+    """
+    Format a sample value, integers without a decimal point
+    """
+    if (float(value).is_integer()):
+        return str(int(value))
+    return repr(float(value))
+
+# Process wide metrics shared by every service and job
+_METRICS: Metrics = None
+_METRICS_LOCK = threading.Lock()
+
+def configure_metrics() -> Metrics:
+    """
+    Configure the process wide metrics, replacing any existing ones
+    """
+    global _METRICS
+    with _METRICS_LOCK:
+        if (_METRICS is not None):
+            _METRICS.stop_http_server()
+        _METRICS = Metrics()
+        return _METRICS
+
+def get_metrics() -> Metrics:
+    """
+    Get the process wide metrics, creating them on first use
+    """
+    global _METRICS
+    with _METRICS_LOCK:
+        if (_METRICS is None):
+            _METRICS = Metrics()
+        return _METRICS
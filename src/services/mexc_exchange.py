@@ -1,19 +1,33 @@
 from datetime import datetime as dt
 import time
-import requests
 import hmac
 import hashlib
+import re
+import urllib.parse
 
 from src.logger_config import setup_logger
 from src.services.exchange import Exchange, Order
+from src.services.http_transport import HttpTransport, get_transport
+from src.services.metrics import Metrics, get_metrics
+from src.services.order_cache import OrderCache
+from src.services.quota_manager import QuotaManager, get_quota_manager
+from src.services.resilience import Resilience, get_resilience, get_response_failure
 
 logger = setup_logger(__name__)
 
 class MexcExchange(Exchange):
     SPOT_BASE_URL = "https://api.mexc.com" # SpotV3
     FUTURES_BASE_URL = "https://contract.mexc.com"
+    # Maximum page size of the futures history orders endpoint
+    HISTORY_PAGE_SIZE = 100
+    SPOT_TERMINAL_STATUSES = ["FILLED", "CANCELED"]
+    # Futures order state: 1 uninformed, 2 uncompleted, 3 completed, 4 cancelled, 5 invalid
+    FUTURES_TERMINAL_STATES = [3, 4]
+    # Futures orders are resolved in batches with batch_query, at most BATCH_QUERY_MAX_IDS per request
+    BATCH_ACCOUNT_TYPES = ["Futures"]
+    BATCH_QUERY_MAX_IDS = 50
     
-    def __init__(self, name, key, secret):
+    def __init__(self, name, key, secret, transport: HttpTransport = None, quotas: QuotaManager = None, order_cache: OrderCache = None, metrics: Metrics = None, resilience: Resilience = None):
         """
         Initialize the Mexc class
         """
@@ -24,10 +38,16 @@ class MexcExchange(Exchange):
         if (secret is None):
             raise ValueError("Secret is required")
         
+        self.NAME = name
         self.ACC_NAME_SPOT = name + " Spot"
         self.ACC_NAME_LEVERAGE = name + " Futures"
         self.api_key = key
         self.api_secret = secret
+        self.TRANSPORT = transport if transport is not None else get_transport()
+        self.QUOTAS = quotas if quotas is not None else get_quota_manager()
+        self.METRICS = metrics if metrics is not None else get_metrics()
+        self.RESILIENCE = resilience if resilience is not None else get_resilience()
+        self.ORDER_CACHE = order_cache
     
     def format_pair(self, pair) -> str:
         """
@@ -45,26 +65,37 @@ class MexcExchange(Exchange):
     
     def request(self, method, url, params=None, payload=None) -> dict:
         """
-        Make a request to the Mexc API
+        Make a request to the Mexc API, retrying transient failures
         """
-        timestamp = str(int(time.time() * 1000))
-        if params is not None:
-            params["timestamp"] = timestamp
-        headers = {
-            "ApiKey": self.api_key,
-            "Request-Time": timestamp,
-            "Signature": self.get_signature(timestamp, params),
-            "Content-Type": "application/json",
-        }
+        if method != "GET":
+            raise ValueError("Invalid method")
         
-        logger.debug("Making a [" + method + "] request to [" + url + "] with params [" + str(params) + "] and payload [" + str(payload) + "]")
+        # Order ids in the path are left out of the endpoint label
+        endpoint = re.sub(r"/\d+(?=/|$)", "/{id}", urllib.parse.urlsplit(url).path)
         
-        if method == "GET":
-            res = requests.get(url, headers=headers, params=params)
-        else:
-            raise ValueError("Invalid method")
+        def send():
+            # Signed again on every attempt, the request time must stay within the receive window
+            timestamp = str(int(time.time() * 1000))
+            if params is not None:
+                params["timestamp"] = timestamp
+            headers = {
+                "ApiKey": self.api_key,
+                "Request-Time": timestamp,
+                "Signature": self.get_signature(timestamp, params),
+                "Content-Type": "application/json",
+            }
+            
+            logger.debug("Making a [%s] request to [%s] with params [%s] and payload [%s]", method, url, params, payload)
+            
+            self.QUOTAS.acquire("mexc")
+            with self.METRICS.time_request("mexc", endpoint) as request:
+                res = self.TRANSPORT.request("GET", url, headers=headers, params=params)
+                request.set_response(res.status_code, len(res.content))
+            if (res.status_code == 429):
+                self.QUOTAS.throttled("mexc", res.headers.get("Retry-After"))
+            return res
         
-        return res.json()
+        return self.RESILIENCE.call("mexc", send, get_response_failure).json()
     
     def parse_order(self, api_order) -> Order:
         """
@@ -83,9 +114,15 @@ class MexcExchange(Exchange):
         }
         return order
     
-    def query_spot_order(self, symbol, orderId) -> list[Order]:
+    def query_spot_order(self, symbol, orderId) -> Order:
+        """
+        Query a spot account order, terminal orders are read through the order cache
+        """
+        return self.read_through_cache("Spot", self.format_pair(symbol), orderId, lambda: self.fetch_spot_order(symbol, orderId))
+    
+    def fetch_spot_order(self, symbol, orderId) -> tuple[Order, bool]:
         """
-        Query a spot account order
+        Query a spot account order, returns the order and whether it reached a terminal status
         https://mexcdevelop.github.io/apidocs/spot_v3_en/#query-order
         TODO this is currently not working
         """
@@ -105,9 +142,9 @@ class MexcExchange(Exchange):
         # Check Error
         if "code" not in api_order or api_order["code"] != 0:
             logger.error("Failed to fetch spot order for account [" + self.ACC_NAME_SPOT + "], pair [" + pair + "], order reference [" + orderId + "] with code [" + str(api_order["code"]) + "] and error [" + str(api_order["message"]) + "]")
-            return None
+            return None, False
         
-        return self.parse_order(api_order)
+        return self.parse_order(api_order), api_order.get("status") in self.SPOT_TERMINAL_STATUSES
             
     def get_all_spot_orders_from(self, start_time: int) -> list[Order]:
         """
@@ -118,7 +155,13 @@ class MexcExchange(Exchange):
 
     def query_leverage_order(self, symbol, orderId) -> Order:
         """
-        Query a futures account order
+        Query a futures account order, terminal orders are read through the order cache
+        """
+        return self.read_through_cache("Futures", self.format_pair(symbol), orderId, lambda: self.fetch_leverage_order(symbol, orderId))
+    
+    def fetch_leverage_order(self, symbol, orderId) -> tuple[Order, bool]:
+        """
+        Query a futures account order, returns the order and whether it reached a terminal status
         https://mexcdevelop.github.io/apidocs/contract_v1_en/#query-the-order-based-on-the-order-number
         """
         endpoint = "/api/v1/private/order/get/{order_id}"
@@ -132,44 +175,89 @@ class MexcExchange(Exchange):
         # Check Error
         if "code" not in api_order or api_order["code"] != 0:
             logger.error("Failed to fetch futures order for account [" + self.ACC_NAME_LEVERAGE + "], pair [" + symbol + "], order reference [" + orderId + "] with code [" + str(api_order["code"]) + "] and error [" + str(api_order["message"]) + "]")
-            return None
+            return None, False
         
-        return self.parse_order(api_order["data"])
+        return self.parse_order(api_order["data"]), api_order["data"]["state"] in self.FUTURES_TERMINAL_STATES
     
-    def get_all_leverage_orders_from(self, start_time: int) -> list[Order]:
+    def query_leverage_orders_batch(self, symbol, order_ids) -> dict[str, Order]:
         """
-        Get all futures orders from the exchange from the start time
+        Query several futures account orders with batch_query, terminal orders are read through the order cache
         """
-        endpoint = "/api/v1/private/order/list/history_orders"
+        return self.read_batch_through_cache("Futures", self.format_pair(symbol), order_ids, lambda missing: self.fetch_leverage_orders_batch(symbol, missing))
+    
+    def fetch_leverage_orders_batch(self, symbol, order_ids: list[str]) -> dict[str, tuple[Order, bool]]:
+        """
+        Query futures orders in batches of at most BATCH_QUERY_MAX_IDS, returns {order id: (order, terminal)} for the orders found
+        https://mexcdevelop.github.io/apidocs/contract_v1_en/#query-the-order-in-bulk-based-on-the-order-number
+        """
+        endpoint = "/api/v1/private/order/batch_query"
         url = self.FUTURES_BASE_URL + endpoint
         
+        logger.info("Querying [" + str(len(order_ids)) + "] futures orders for symbol [" + symbol + "] in batch")
+        
+        res = {}
+        for idx in range(0, len(order_ids), self.BATCH_QUERY_MAX_IDS):
+            # Query Mexc
+            params = {
+                "order_ids": ",".join(order_ids[idx:idx + self.BATCH_QUERY_MAX_IDS])
+            }
+            api_orders = self.request("GET", url, params=params)
+            
+            # Check Error
+            if "code" not in api_orders or api_orders["code"] != 0:
+                raise ValueError("Failed to fetch futures orders for account [" + self.ACC_NAME_LEVERAGE + "], pair [" + symbol + "] with code [" + str(api_orders.get("code")) + "] and error [" + str(api_orders.get("message")) + "]")
+            
+            for api_order in api_orders.get("data") or []:
+                res[str(api_order["orderId"])] = (self.parse_order(api_order), api_order["state"] in self.FUTURES_TERMINAL_STATES)
+        return res
+    
+    def get_all_leverage_orders_from(self, start_time: int) -> list[Order]:
+        """
+        Get all futures orders from the exchange from the start time, walking the history pages newest first
+        """
         logger.debug("Getting all futures orders starting from [" + str(start_time) + "]")
         
+        res = []
+        page_num = 0
+        while True:
+            page_num += 1
+            api_orders = self.get_leverage_orders_page(start_time, page_num)
+            for order in api_orders:
+                if int(order["createTime"]) < start_time:
+                    continue
+                # Ignore order state 1, 4, and 5
+                # Order state: 1 uninformed, 2 uncompleted, 3 completed, 4 cancelled, 5 invalid; multiple separate by ','
+                if order["state"] in [1, 4, 5]:
+                    continue
+                res.append(self.parse_order(order))
+            
+            # Pages are ordered newest first, only a full page reaching back to start_time may have more orders after it
+            if len(api_orders) < self.HISTORY_PAGE_SIZE or int(api_orders[-1]["createTime"]) < start_time:
+                break
+        
+        logger.debug("Found [" + str(len(res)) + "] futures orders across [" + str(page_num) + "] pages since [" + str(start_time) + "]")
+        return res
+    
+    def get_leverage_orders_page(self, start_time: int, page_num: int) -> list[dict]:
+        """
+        Get a page of futures historical orders from the start time
+        https://mexcdevelop.github.io/apidocs/contract_v1_en/#get-all-of-the-user-39-s-historical-orders
+        """
+        endpoint = "/api/v1/private/order/list/history_orders"
+        url = self.FUTURES_BASE_URL + endpoint
+        
         # Query Mexc
         params = {
-            "page_num": 1,
-            "page_size": 100,
+            "page_num": page_num,
+            "page_size": self.HISTORY_PAGE_SIZE,
             "start_time": start_time,
         }
         api_orders = self.request("GET", url, params=params)
         
         # Check Error
         if "code" not in api_orders or api_orders["code"] != 0:
-            logger.error("Failed to fetch futures historical orders with code [" + str(api_orders["code"]) + "] and error [" + api_orders["message"] + "]")
-            return None
-        
-        # Parse the orders
-        orders = []
-        if "data" not in api_orders or len(api_orders["data"]) == 0:
-            logger.debug("No futures orders found since [" + str(start_time) + "]")
-            return None
-        for order in api_orders["data"]:
-            # Ignore order state 1, 4, and 5
-            # Order state: 1 uninformed, 2 uncompleted, 3 completed, 4 cancelled, 5 invalid; multiple separate by ','
-            if order["state"] in [1, 4, 5]:
-                continue
-            
-            orders.append(self.parse_order(order))
+            raise ValueError("Failed to fetch futures historical orders page [" + str(page_num) + "] with code [" + str(api_orders.get("code")) + "] and error [" + str(api_orders.get("message")) + "]")
         
-        logger.debug("Found [" + str(len(orders)) + "] futures orders since [" + str(start_time) + "]")
-        return orders
\ No newline at end of file
+        if "data" not in api_orders or api_orders["data"] is None:
+            return []
+        return api_orders["data"]
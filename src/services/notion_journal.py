@@ -1,41 +1,282 @@
-from notion_client import Client
+from functools import reduce
+import itertools
+import json
+from typing import AsyncIterator, Generator, Iterator
+
+import httpx
+from notion_client import APIResponseError, AsyncClient, Client
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
 
 from src.logger_config import setup_logger
+from src.services.cassette import Cassette
+from src.services.metrics import Metrics, get_metrics
+from src.services.quota_manager import QuotaManager, get_quota_manager
+from src.services.resilience import Resilience, get_resilience, get_status_failure
 
 logger = setup_logger(__name__)
 
+# An operation is a generator yielding (endpoint, request) pairs for each Notion call it needs, 
+# receiving the responses, and returning its result, so it can be driven by the sync or the async client
+Operation = Generator[tuple[str, dict], dict, object]
+
+class EntryPatch:
+    """
+    Property changes to a journal entry, gathered while it is processed and committed in a single pages.update
+    """
+    def __init__(self, entry_id, tags: list[dict] = None):
+        """
+        Initialize the EntryPatch class with the entry's current tags
+        """
+        if (entry_id is None):
+            raise ValueError("Entry ID is required")
+        
+        self.ENTRY_ID=entry_id
+        self.TAGS=[tag["name"] for tag in tags or []]
+        self.TAGS_CHANGED=False
+        self.PROPERTIES={}
+    
+    def set_table_block_id(self, table_block_id):
+        """
+        Set the orders table block id, None clears it
+        """
+        self.PROPERTIES[NotionJournal.NP_ORDERS_TABLE_ID] = {
+            "rich_text": [
+                {
+                    "type": "text",
+                    "text": {
+                        "content": table_block_id
+                    }
+                }
+            ] if table_block_id is not None else []
+        }
+    
+    def add_tag(self, name):
+        if (name not in self.TAGS):
+            self.TAGS.append(name)
+            self.TAGS_CHANGED=True
+    
+    def remove_tag(self, name):
+        if (name in self.TAGS):
+            self.TAGS.remove(name)
+            self.TAGS_CHANGED=True
+    
+    def get_properties(self) -> dict:
+        """
+        Get the properties to update, empty when nothing changed
+        """
+        properties = dict(self.PROPERTIES)
+        if (self.TAGS_CHANGED):
+            properties[NotionJournal.NP_TAGS] = {
+                "multi_select": [{"name": name} for name in self.TAGS]
+            }
+        return properties
+
 class NotionJournal:
     NP_TAGS = "RTPS-Actions"
     NP_ORDERS_TABLE_ID = "RTPS-OrdersTable-Id"
     NP_ORDER_REFERENCES = "Order References"
+    # Entries per database query page, the Notion maximum
+    QUERY_PAGE_SIZE = 100
+    # Children per block append or list request, the Notion maximum
+    MAX_BLOCK_CHILDREN = 100
+    # Endpoints with side effects on a repeat, e.g. appending the same rows twice, only retried when throttled
+    NON_IDEMPOTENT_ENDPOINTS = ["blocks.children.append", "pages.create", "databases.create", "comments.create"]
+    # Orders table columns, in the order of the OB sheet columns
+    ORDERS_TABLE_COLUMNS = (
+        "Date", "Account", "Pair", "Buy/Sell", "Average", "Executed", "Effect", "Total (inc. Fees)",
+        "Fees", "Fees Currency", "Fees USDT", "Reference", "Notes"
+    )
     
-    def __init__(self, token, database_id):
+    def __init__(self, token, database_id, quotas: QuotaManager = None, metrics: Metrics = None, base_url: str = None, cassette: Cassette = None, resilience: Resilience = None):
         """
         Initialize the notion API class
+        base_url overrides the Notion API root, e.g. to run against a local stand-in
+        When cassette is set, the client calls are recorded to it or replayed from it
         """
         if (token is None):
             raise ValueError("Token is required")
         if (database_id is None):
             raise ValueError("Database ID is required")
         
-        self.CLIENT=Client(auth=token)
+        self.TOKEN=token
+        self.CLIENT_OPTIONS = {"auth": token}
+        if (base_url is not None):
+            self.CLIENT_OPTIONS["base_url"] = base_url
+        self.CLIENT=Client(**self.CLIENT_OPTIONS)
+        self.ASYNC_CLIENT: AsyncClient = None
         self.DATABASE_ID=database_id
+        self.QUOTAS = quotas if quotas is not None else get_quota_manager()
+        self.METRICS = metrics if metrics is not None else get_metrics()
+        self.CASSETTE = cassette
+        self.RESILIENCE = resilience if resilience is not None else get_resilience()
+    
+    def call(self, endpoint: str, **kwargs):
+        """
+        Call a Notion client endpoint e.g. [pages.update] within the Notion quota, retrying transient failures
+        """
+        return self.RESILIENCE.call("notion", lambda: self.call_once(endpoint, kwargs), get_notion_failure, endpoint not in self.NON_IDEMPOTENT_ENDPOINTS)
+    
+    def call_once(self, endpoint: str, kwargs: dict):
+        """
+        Make an attempt at a Notion client call
+        The client only returns parsed responses, so only the bytes sent are measured
+        """
+        self.QUOTAS.acquire("notion")
+        with self.METRICS.time_request("notion", endpoint) as request:
+            request.set_response(bytes_sent=len(json.dumps(kwargs, default=str)))
+            try:
+                fn = lambda: reduce(getattr, endpoint.split("."), self.CLIENT)(**kwargs)
+                if (self.CASSETTE is not None):
+                    res = self.CASSETTE.call("notion", endpoint, kwargs, fn, encode_cassette_response, decode_cassette_response)
+                else:
+                    res = fn()
+            except HTTPResponseError as err:
+                request.set_response(err.status)
+                if (err.status == 429):
+                    self.QUOTAS.throttled("notion", err.headers.get("Retry-After"))
+                raise
+            request.set_response(200)
+            return res
+    
+    async def call_async(self, endpoint: str, **kwargs):
+        """
+        Call a Notion async client endpoint e.g. [pages.update] within the Notion quota, retrying transient failures
+        """
+        if (self.ASYNC_CLIENT is None):
+            raise ValueError("Async client is not open, use open_async_client")
+        
+        return await self.RESILIENCE.call_async("notion", lambda: self.call_once_async(endpoint, kwargs), get_notion_failure, endpoint not in self.NON_IDEMPOTENT_ENDPOINTS)
+    
+    async def call_once_async(self, endpoint: str, kwargs: dict):
+        """
+        Make an attempt at a Notion async client call
+        """
+        await self.QUOTAS.acquire_async("notion")
+        with self.METRICS.time_request("notion", endpoint) as request:
+            request.set_response(bytes_sent=len(json.dumps(kwargs, default=str)))
+            try:
+                fn = lambda: reduce(getattr, endpoint.split("."), self.ASYNC_CLIENT)(**kwargs)
+                if (self.CASSETTE is not None):
+                    res = await self.CASSETTE.call_async("notion", endpoint, kwargs, fn, encode_cassette_response, decode_cassette_response)
+                else:
+                    res = await fn()
+            except HTTPResponseError as err:
+                request.set_response(err.status)
+                if (err.status == 429):
+                    self.QUOTAS.throttled("notion", err.headers.get("Retry-After"))
+                raise
+            request.set_response(200)
+            return res
+    
+    def open_async_client(self) -> AsyncClient:
+        """
+        Open the async client, bound to the running event loop
+        """
+        self.ASYNC_CLIENT = AsyncClient(**self.CLIENT_OPTIONS)
+        return self.ASYNC_CLIENT
+    
+    async def close_async_client(self):
+        """
+        Close the async client
+        """
+        if (self.ASYNC_CLIENT is not None):
+            await self.ASYNC_CLIENT.aclose()
+            self.ASYNC_CLIENT = None
+    
+    def run_operation(self, operation: Operation):
+        """
+        Drive an operation with the sync client, a failed call is raised inside the operation where it yielded
+        """
+        try:
+            endpoint, request = next(operation)
+            while True:
+                try:
+                    res = self.call(endpoint, **request)
+                except Exception as err:
+                    endpoint, request = operation.throw(err)
+                    continue
+                endpoint, request = operation.send(res)
+        except StopIteration as res:
+            return res.value
+    
+    async def run_operation_async(self, operation: Operation):
+        """
+        Drive an operation with the async client, a failed call is raised inside the operation where it yielded
+        """
+        try:
+            endpoint, request = next(operation)
+            while True:
+                try:
+                    res = await self.call_async(endpoint, **request)
+                except Exception as err:
+                    endpoint, request = operation.throw(err)
+                    continue
+                endpoint, request = operation.send(res)
+        except StopIteration as res:
+            return res.value
 
     def query_db_for_refresh_orders(self):
+        return list(self.iter_refresh_orders())
+    
+    async def query_db_for_refresh_orders_async(self):
+        return [entry async for entry in self.iter_refresh_orders_async()]
+    
+    def iter_refresh_orders(self) -> Iterator[dict]:
+        """
+        Iterate the entries with tag 'refresh-orders'
+        Every page is queried before the first entry is yielded, as processing an entry removes its tag from the filtered results
+        and would shift the entries of the pages not yet queried past the cursor
+        """
         logger.info("Querying the database for any entries with tag 'refresh-orders'...")
         
-        entries = self.CLIENT.databases.query(
-            **{
-                "database_id": self.DATABASE_ID,
-                "filter": {
-                    "property": self.NP_TAGS,
-                    "multi_select": {
-                        "contains": "refresh-orders"
-                    }
+        res = []
+        cursor = None
+        while True:
+            entries, cursor = self.run_operation(self.query_db_for_refresh_orders_page_operation(cursor))
+            res += entries
+            if (cursor is None):
+                break
+        
+        logger.info("Successfully queried the database for [" + str(len(res)) + "] entries")
+        yield from res
+    
+    async def iter_refresh_orders_async(self) -> AsyncIterator[dict]:
+        """
+        Iterate the entries with tag 'refresh-orders' on the async client, every page is queried before the first entry is yielded
+        """
+        logger.info("Querying the database for any entries with tag 'refresh-orders'...")
+        
+        res = []
+        cursor = None
+        while True:
+            entries, cursor = await self.run_operation_async(self.query_db_for_refresh_orders_page_operation(cursor))
+            res += entries
+            if (cursor is None):
+                break
+        
+        logger.info("Successfully queried the database for [" + str(len(res)) + "] entries")
+        for entry in res:
+            yield entry
+    
+    def query_db_for_refresh_orders_page_operation(self, cursor=None) -> Operation:
+        """
+        Query one page of entries with tag 'refresh-orders' starting at cursor, returns the parsed entries and the next cursor, None on the last page
+        """
+        request = {
+            "database_id": self.DATABASE_ID,
+            "filter": {
+                "property": self.NP_TAGS,
+                "multi_select": {
+                    "contains": "refresh-orders"
                 }
-            }
-        )
-        logger.info("Successfully queried the database for [" + str(len(entries['results'])) + "] entries")
+            },
+            "page_size": self.QUERY_PAGE_SIZE
+        }
+        if (cursor is not None):
+            request["start_cursor"] = cursor
+        
+        entries = yield "databases.query", request
+        logger.debug("Queried a page of [" + str(len(entries['results'])) + "] entries")
         
         # Extract id and order references from the results
         res = []
@@ -54,129 +295,68 @@ class NotionJournal:
                 })
             else:
                 logger.warning("Empty order references for entry [" + entry["id"] + "]")
-                        
-        return res
+        
+        return res, entries["next_cursor"] if entries.get("has_more") else None
     
-    def generate_orders_table_block_children(self, orders):
-        table_rows = []
+    def get_table_cell(self, content, cells: dict) -> list[dict]:
+        """
+        Get the table cell for the content, cells holds the cells already built so repeated values share one template
+        """
+        content = "" if content is None else str(content)
+        cell = cells.get(content)
+        if (cell is None):
+            cell = [{"type": "text", "text": {"content": content}}]
+            cells[content] = cell
+        return cell
 
-        # Create the data rows
-        for order in orders: 
-            table_rows.append({
+    def iter_orders_table_rows(self, orders) -> Iterator[dict]:
+        """
+        Lazily build a table row per order following ORDERS_TABLE_COLUMNS, rows missing trailing columns get empty cells
+        """
+        cells = {}
+        width = len(self.ORDERS_TABLE_COLUMNS)
+        for order in orders:
+            yield {
                 "type": "table_row",
                 "table_row": {
-                    "cells": [
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[0],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[1],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[2],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[3],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[4],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[5],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[6],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[7],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[8],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[9],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[10],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[11],
-                            },
-                            }
-                        ],
-                        [
-                            {
-                            "type": "text",
-                            "text": {
-                                "content": order[12],
-                            },
-                            }
-                        ]
-                    ]
+                    "cells": [self.get_table_cell(order[idx] if idx < len(order) else None, cells) for idx in range(width)]
                 }
-            })
+            }
+
+    def generate_orders_table_block_children(self, orders):
+        return list(self.iter_orders_table_rows(orders))
 
-        return table_rows
+    def iter_chunks(self, rows: Iterator[dict]) -> Iterator[list[dict]]:
+        """
+        Split rows into chunks of at most MAX_BLOCK_CHILDREN
+        """
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.MAX_BLOCK_CHILDREN))
+            if (not chunk):
+                return
+            yield chunk
+
+    def append_table_rows_operation(self, table_block_id, rows: Iterator[dict]) -> Operation:
+        """
+        Append rows to a table block, at most MAX_BLOCK_CHILDREN per request, returns the number of rows appended
+        """
+        count = 0
+        for chunk in self.iter_chunks(rows):
+            yield "blocks.children.append", {
+                "block_id": table_block_id,
+                "children": chunk
+            }
+            count += len(chunk)
+        return count
     
     def create_orders_table_block(self, parent_id, orders):
+        return self.run_operation(self.create_orders_table_block_operation(parent_id, orders))
+    
+    async def create_orders_table_block_async(self, parent_id, orders):
+        return await self.run_operation_async(self.create_orders_table_block_operation(parent_id, orders))
+    
+    def create_orders_table_block_operation(self, parent_id, orders) -> Operation:
         logger.info("Creating a table block under parent id [" + parent_id + "]...")
         
         if (parent_id is None):
@@ -184,132 +364,212 @@ class NotionJournal:
         if (orders is None):
             raise ValueError("Orders are required")
 
-        table_rows = self.generate_orders_table_block_children(orders)
-        
-        # Create the table block
-        res = self.CLIENT.blocks.children.append(
-            **{
-                "block_id": parent_id,
-                "children": [
-                    {
-                        "object": "block",
-                        "type": "table",
-                        "table": {
-                            "table_width": 13,
-                            "has_column_header": True,
-                            "has_row_header": False,
-                            "children": table_rows,
-                        }
+        # Create the table block with the first chunk of rows, then append the rest as they are built
+        chunks = self.iter_chunks(self.iter_orders_table_rows(orders))
+        res = yield "blocks.children.append", {
+            "block_id": parent_id,
+            "children": [
+                {
+                    "object": "block",
+                    "type": "table",
+                    "table": {
+                        "table_width": len(self.ORDERS_TABLE_COLUMNS),
+                        "has_column_header": True,
+                        "has_row_header": False,
+                        "children": next(chunks, []),
                     }
-                ]
-            }
-        )
+                }
+            ]
+        }
+        table_block_id = res["results"][0]["id"]
+        try:
+            yield from self.append_table_rows_operation(table_block_id, itertools.chain.from_iterable(chunks))
+        except Exception:
+            # Remove the partly filled table instead of orphaning it, the entry is left without a table until the next run
+            logger.warning("Failed to append rows to table block [" + table_block_id + "], deleting it...")
+            try:
+                yield "blocks.delete", {"block_id": table_block_id}
+            except Exception as err:
+                logger.error("Failed to delete table block [" + table_block_id + "]: " + str(err))
+            raise
         
-        logger.info("Successfully created table block with id [" + res["results"][0]["id"] + "] under parent id [" + parent_id + "]")
-        return res["results"][0]["id"]
+        logger.info("Successfully created table block with id [" + table_block_id + "] with [" + str(len(orders)) + "] rows under parent id [" + parent_id + "]")
+        return table_block_id
 
     def delete_block(self, block_id):
-        logger.info("Deleting block with id [" + block_id + "]...")
+        return self.run_operation(self.delete_block_operation(block_id))
+    
+    async def delete_block_async(self, block_id):
+        return await self.run_operation_async(self.delete_block_operation(block_id))
+    
+    def delete_block_operation(self, block_id) -> Operation:
+        logger.info("Deleting block with id [" + str(block_id) + "]...")
         
         if (block_id is None):
             raise ValueError("Block ID is required")
         
-        res = self.CLIENT.blocks.delete(
-            **{
-                "block_id": block_id
-            }
-        )
+        res = yield "blocks.delete", {
+            "block_id": block_id
+        }
         
         logger.info("Successfully deleted block with id [" + block_id + "]")
         return res
-    
-    def update_entry_table_block_id(self, entry_id, table_block_id):
-        if (entry_id is None):
-            raise ValueError("Entry ID is required")
+
+    def list_block_children_operation(self, block_id) -> Operation:
+        """
+        List every child of the block, following the pagination cursor
+        """
+        children = []
+        request = {"block_id": block_id, "page_size": self.MAX_BLOCK_CHILDREN}
+        while True:
+            res = yield "blocks.children.list", request
+            children += res["results"]
+            if (not res.get("has_more")):
+                return children
+            request = {"block_id": block_id, "page_size": self.MAX_BLOCK_CHILDREN, "start_cursor": res["next_cursor"]}
+
+    def get_cells_text(self, cells) -> list[str]:
+        """
+        Get the plain text of each table row cell, for cells read from Notion or generated by generate_orders_table_block_children
+        """
+        res = []
+        for cell in cells:
+            text = ""
+            for item in cell:
+                if ("plain_text" in item):
+                    text += item["plain_text"] or ""
+                else:
+                    text += item["text"]["content"] or ""
+            res.append(text)
+        return res
+
+    def sync_orders_table_block(self, table_block_id, orders):
+        return self.run_operation(self.sync_orders_table_block_operation(table_block_id, orders))
+
+    async def sync_orders_table_block_async(self, table_block_id, orders):
+        return await self.run_operation_async(self.sync_orders_table_block_operation(table_block_id, orders))
+
+    def sync_orders_table_block_operation(self, table_block_id, orders) -> Operation:
+        """
+        Bring an existing table block in line with the orders, updating, appending or deleting only the rows that differ
+        Returns False without writing when the table cannot be reused, e.g. a different table width, the caller should then recreate it
+        """
         if (table_block_id is None):
             raise ValueError("Table block ID is required")
-        logger.info("Updating entry [" + entry_id + "] with table block id [" + table_block_id + "]...")  
+        if (orders is None):
+            raise ValueError("Orders are required")
+        logger.info("Syncing table block [" + table_block_id + "] with [" + str(len(orders)) + "] rows...")
 
-        res = self.CLIENT.pages.update(
-            **{
-                "page_id": entry_id,
-                "properties": {
-                    self.NP_ORDERS_TABLE_ID: {
-                        "rich_text": [
-                            {
-                                "type": "text",
-                                "text": {
-                                    "content": table_block_id
-                                }
-                            }
-                        ]
-                    }
+        existing_rows = yield from self.list_block_children_operation(table_block_id)
+        table_rows = self.generate_orders_table_block_children(orders)
+        if (not table_rows):
+            return False
+
+        for row in existing_rows:
+            if (row.get("type") != "table_row" or len(row["table_row"]["cells"]) != len(self.ORDERS_TABLE_COLUMNS)):
+                logger.warning("Table block [" + table_block_id + "] does not match the orders table layout, cannot sync in place")
+                return False
+
+        updated = 0
+        for existing_row, table_row in zip(existing_rows, table_rows):
+            if (self.get_cells_text(existing_row["table_row"]["cells"]) != self.get_cells_text(table_row["table_row"]["cells"])):
+                yield "blocks.update", {
+                    "block_id": existing_row["id"],
+                    "table_row": table_row["table_row"]
                 }
+                updated += 1
+
+        # Rows past the end of the existing table
+        appended = table_rows[len(existing_rows):]
+        yield from self.append_table_rows_operation(table_block_id, appended)
+
+        # Rows past the end of the new table
+        deleted = existing_rows[len(table_rows):]
+        for row in deleted:
+            yield "blocks.delete", {
+                "block_id": row["id"]
             }
-        )
-        
-        logger.info("Successfully updated entry [" + entry_id + "] with table block id [" + table_block_id + "]")
-        return res
+
+        logger.info("Successfully synced table block [" + table_block_id + "], updated [" + str(updated) + "], appended [" + str(len(appended)) + "] and deleted [" + str(len(deleted)) + "] rows")
+        return True
+
+    def new_entry_patch(self, entry) -> EntryPatch:
+        """
+        Start a patch for an entry returned by query_db_for_refresh_orders
+        """
+        return EntryPatch(entry["id"], entry["action-tags"])
     
-    def remove_refresh_orders_tag(self, entry_id, exisiting_tags=[]):
-        if (entry_id is None):
-            raise ValueError("Entry ID is required")
-        
-        tags = [tag for tag in exisiting_tags if tag["name"] != "refresh-orders"]
-        
-        self.CLIENT.pages.update(
-            **{
-                "page_id": entry_id,
-                "properties": {
-                    self.NP_TAGS: {
-                        "multi_select": tags
-                    }
-                }
-            }
-        )
-        
-        return tags
+    def commit_entry_patch(self, patch: EntryPatch):
+        return self.run_operation(self.commit_entry_patch_operation(patch))
     
-    def add_missing_orders_tag(self, entry_id, exisiting_tags=[]):
-        if (entry_id is None):
-            raise ValueError("Entry ID is required")
+    async def commit_entry_patch_async(self, patch: EntryPatch):
+        return await self.run_operation_async(self.commit_entry_patch_operation(patch))
+    
+    def commit_entry_patch_operation(self, patch: EntryPatch) -> Operation:
+        properties = patch.get_properties()
+        if (not properties):
+            logger.info("No changes to entry [" + patch.ENTRY_ID + "]")
+            return None
+        logger.info("Updating entry [" + patch.ENTRY_ID + "] properties [" + ", ".join(properties.keys()) + "]...")
         
-        tags = exisiting_tags
-        tags.append({
-            "name": "missing-orders"
-        })
+        res = yield "pages.update", {
+            "page_id": patch.ENTRY_ID,
+            "properties": properties
+        }
         
-        self.CLIENT.pages.update(
-            **{
-                "page_id": entry_id,
-                "properties": {
-                    self.NP_TAGS: {
-                        "multi_select": tags
-                    }
-                }
-            }
-        )
-        
-        return tags
+        logger.info("Successfully updated entry [" + patch.ENTRY_ID + "]")
+        return res
+    
+    def add_unknown_error_tag(self, entry_id, exisiting_tags=None):
+        return self.run_operation(self.update_tags_operation(entry_id, (exisiting_tags or []) + [{"name": "unknown-error"}]))
+    
+    async def add_unknown_error_tag_async(self, entry_id, exisiting_tags=None):
+        return await self.run_operation_async(self.update_tags_operation(entry_id, (exisiting_tags or []) + [{"name": "unknown-error"}]))
     
-    def add_unknown_error_tag(self, entry_id, exisiting_tags=[]):
+    def update_tags_operation(self, entry_id, tags) -> Operation:
         if (entry_id is None):
             raise ValueError("Entry ID is required")
         
-        tags = exisiting_tags
-        tags.append({
-            "name": "unknown-error"
-        })
-        
-        self.CLIENT.pages.update(
-            **{
-                "page_id": entry_id,
-                "properties": {
-                    self.NP_TAGS: {
-                        "multi_select": tags
-                    }
+        yield "pages.update", {
+            "page_id": entry_id,
+            "properties": {
+                self.NP_TAGS: {
+                    "multi_select": tags
                 }
             }
-        )
+        }
         
-        return tags
\ No newline at end of file
+        return tags
+
+def encode_cassette_response(res, err) -> dict:
+    """
+    Encode a Notion client response or API error for a cassette
+    """
+    if (err is None):
+        return {"status": 200, "body": res}
+    if (isinstance(err, HTTPResponseError)):
+        return {"status": err.status, "headers": {"Retry-After": err.headers.get("Retry-After")} if err.headers.get("Retry-After") else {}, "code": getattr(err, "code", None), "message": str(err), "text": err.body}
+    return None
+
+def decode_cassette_response(response: dict):
+    """
+    Decode a Notion response from a cassette, raising the recorded API error
+    """
+    if (response["status"] >= 400):
+        http_response = httpx.Response(response["status"], headers=response["headers"], text=response["text"])
+        # Error bodies that are not Notion API errors, e.g. a gateway HTML page, have no code
+        if (response["code"] is None):
+            raise HTTPResponseError(http_response, response["message"])
+        raise APIResponseError(http_response, response["message"], response["code"])
+    return response["body"]
+
+def get_notion_failure(res, err) -> tuple:
+    """
+    Classify a Notion client call, transient on a transient status, a timeout or a connection error
+    The status of error bodies that are not Notion API errors, e.g. a gateway HTML page, is classified as well
+    """
+    if (isinstance(err, HTTPResponseError)):
+        return get_status_failure(err.status, err.headers.get("Retry-After"))
+    if (isinstance(err, (RequestTimeoutError, httpx.TransportError))):
+        return None, None
+    return None
@@ -0,0 +1,163 @@
+from datetime import datetime as dt
+import json
+import os
+import sqlite3
+import threading
+from typing import Callable
+
+from src.logger_config import setup_logger
+from src.services.exchange import Order
+
+logger = setup_logger(__name__)
+
+# (exchange, account type, symbol, order id)
+OrderKey = tuple[str, str, str, str]
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into a single call, sharing its result
+    """
+    def __init__(self):
+        """
+        Initialize the SingleFlight class
+        """
+        self.CALLS: dict = {}
+        self.LOCK = threading.Lock()
+
+    def do(self, key, fn: Callable):
+        """
+        Call fn unless a call for key is already in flight, in which case wait for and return its result
+        """
+        with self.LOCK:
+            call = self.CALLS.get(key)
+            leader = call is None
+            if (leader):
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self.CALLS[key] = call
+
+        if (not leader):
+            call["done"].wait()
+            if (call["error"] is not None):
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as err:
+            call["error"] = err
+            raise
+        finally:
+            with self.LOCK:
+                del self.CALLS[key]
+            call["done"].set()
+
+class OrderCache:
+    """
+    Persistent SQLite store of orders that reached a terminal status, and will therefore never change
+    Orders not yet terminal are only remembered in memory for the current run, until clear_run_orders
+    """
+    def __init__(self, path):
+        """
+        Initialize the OrderCache class
+        """
+        if (path is None):
+            raise ValueError("Path is required")
+
+        if (os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.PATH=path
+        self.LOCK = threading.Lock()
+        self.SINGLE_FLIGHT = SingleFlight()
+        self.RUN_ORDERS: dict[OrderKey, Order] = {}
+        self.CONNECTION = sqlite3.connect(path, check_same_thread=False)
+        with self.LOCK:
+            self.CONNECTION.execute("PRAGMA journal_mode=WAL")
+            self.CONNECTION.execute(
+                "CREATE TABLE IF NOT EXISTS orders ("
+                "exchange TEXT NOT NULL, account_type TEXT NOT NULL, symbol TEXT NOT NULL, order_id TEXT NOT NULL, "
+                "data TEXT NOT NULL, PRIMARY KEY (exchange, account_type, symbol, order_id))"
+            )
+            self.CONNECTION.commit()
+
+    def get(self, key: OrderKey) -> Order:
+        """
+        Get the order from the cache, None if unknown
+        """
+        with self.LOCK:
+            row = self.CONNECTION.execute(
+                "SELECT data FROM orders WHERE exchange = ? AND account_type = ? AND symbol = ? AND order_id = ?", key
+            ).fetchone()
+        if (row is None):
+            return None
+
+        order = json.loads(row[0])
+        order["datetime"] = dt.fromisoformat(order["datetime"])
+        return order
+
+    def put(self, key: OrderKey, order: Order):
+        """
+        Store the order in the cache
+        """
+        data = dict(order)
+        data["datetime"] = order["datetime"].isoformat()
+        with self.LOCK:
+            self.CONNECTION.execute("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?)", (*key, json.dumps(data)))
+            self.CONNECTION.commit()
+
+    def get_run_order(self, key: OrderKey) -> Order:
+        """
+        Get an order fetched earlier in the run that was not terminal, None if unknown
+        """
+        with self.LOCK:
+            return self.RUN_ORDERS.get(key)
+
+    def put_run_order(self, key: OrderKey, order: Order):
+        """
+        Remember an order that is not terminal for the rest of the run
+        """
+        with self.LOCK:
+            self.RUN_ORDERS[key] = order
+
+    def clear_run_orders(self):
+        """
+        Forget the orders remembered for the run, they may have changed by the next run
+        """
+        with self.LOCK:
+            self.RUN_ORDERS.clear()
+
+    def store(self, key: OrderKey, order: Order, terminal: bool):
+        """
+        Store a fetched order, terminal orders in the cache and the others for the run
+        """
+        if (order is None):
+            return
+        if (terminal):
+            self.put(key, order)
+        else:
+            self.put_run_order(key, order)
+
+    def read_through(self, key: OrderKey, fetch: Callable[[], tuple[Order, bool]]) -> Order:
+        """
+        Get the order from the cache or from earlier in the run, or fetch it once across concurrent callers
+        fetch returns the order and whether it reached a terminal status, only terminal orders are stored
+        """
+        order = self.get_run_order(key) or self.get(key)
+        if (order is not None):
+            logger.debug("Order cache hit for [%s]", key)
+            return order
+
+        def fetch_and_store():
+            order, terminal = fetch()
+            self.store(key, order, terminal)
+            return order
+
+        return self.SINGLE_FLIGHT.do(key, fetch_and_store)
+
+    def close(self):
+        """
+        Close the database connection
+        """
+        with self.LOCK:
+            self.CONNECTION.close()
@@ -0,0 +1,193 @@
+import asyncio
+import threading
+import time
+
+from src.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+class TokenBucket:
+    """
+    Thread safe token bucket, refilled continuously at rate tokens per second up to capacity
+    """
+    def __init__(self, rate: float, capacity: float):
+        """
+        Initialize the TokenBucket class
+        """
+        if (rate is None or rate <= 0):
+            raise ValueError("Rate must be a positive number")
+        if (capacity is None or capacity <= 0):
+            raise ValueError("Capacity must be a positive number")
+
+        self.RATE=rate
+        self.CAPACITY=capacity
+        self.TOKENS=capacity
+        self.UPDATED=time.monotonic()
+        self.BLOCKED_UNTIL=0.0
+        self.LOCK=threading.Lock()
+
+    def refill(self, now: float):
+        """
+        Refill the bucket for the time elapsed since the last update, the caller must hold LOCK
+        """
+        self.TOKENS = min(self.CAPACITY, self.TOKENS + (now - self.UPDATED) * self.RATE)
+        self.UPDATED = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Take tokens from the bucket if available, returns 0 on success or the number of seconds to wait before retrying
+        """
+        tokens = min(tokens, self.CAPACITY)
+        with self.LOCK:
+            now = time.monotonic()
+            if (now < self.BLOCKED_UNTIL):
+                return self.BLOCKED_UNTIL - now
+
+            self.refill(now)
+            if (self.TOKENS >= tokens):
+                self.TOKENS -= tokens
+                return 0
+            return (tokens - self.TOKENS) / self.RATE
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Take tokens from the bucket, blocking until they are available, returns the number of seconds waited
+        """
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if (wait <= 0):
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        """
+        Take tokens from the bucket, waiting without blocking the event loop until they are available, returns the number of seconds waited
+        """
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(tokens)
+            if (wait <= 0):
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def observe_used(self, used: float, limit: float = None):
+        """
+        Align the bucket with the usage reported by the upstream for the current window
+        """
+        limit = limit if limit is not None else self.CAPACITY
+        with self.LOCK:
+            self.refill(time.monotonic())
+            self.TOKENS = max(0, min(self.TOKENS, limit - used))
+
+    def block_for(self, seconds: float):
+        """
+        Stop handing out tokens for the next seconds, e.g. when the upstream responds with Retry-After
+        """
+        with self.LOCK:
+            now = time.monotonic()
+            self.BLOCKED_UNTIL = max(self.BLOCKED_UNTIL, now + seconds)
+            self.TOKENS = 0
+            self.UPDATED = now
+
+class QuotaManager:
+    """
+    Process wide API quota manager, holding a token bucket per upstream
+    """
+    # Upstream: (tokens per second, capacity), Binance buckets count request weight
+    DEFAULT_LIMITS = {
+        "binance": (6000 / 60, 6000),       # X-MBX-USED-WEIGHT-1M, 6000 weight per minute
+        "binance-sapi": (12000 / 60, 12000), # X-SAPI-USED-IP-WEIGHT-1M, 12000 weight per minute
+        "mexc": (10, 20),                   # 20 requests per 2 seconds
+        "sheets": (1, 60),                  # 60 requests per minute per user
+        "notion": (3, 3),                   # An average of 3 requests per second
+    }
+    # Fraction of an upstream limit we allow ourselves to use
+    SAFETY_FACTOR = 0.9
+    # Seconds to back off when throttled without a Retry-After header
+    DEFAULT_RETRY_AFTER = 5
+
+    def __init__(self, limits: dict[str, tuple[float, float]] = None):
+        """
+        Initialize the QuotaManager class, limits override DEFAULT_LIMITS per upstream
+        """
+        self.LIMITS = dict(self.DEFAULT_LIMITS)
+        if (limits is not None):
+            self.LIMITS.update(limits)
+        self.BUCKETS: dict[str, TokenBucket] = {}
+        self.LOCK = threading.Lock()
+
+    def get_bucket(self, upstream: str) -> TokenBucket:
+        """
+        Get the token bucket for the upstream, creating it on first use
+        """
+        bucket = self.BUCKETS.get(upstream)
+        if (bucket is not None):
+            return bucket
+
+        with self.LOCK:
+            if (upstream not in self.BUCKETS):
+                if (upstream not in self.LIMITS):
+                    raise ValueError("No quota configured for upstream [" + upstream + "]")
+                rate, capacity = self.LIMITS[upstream]
+                self.BUCKETS[upstream] = TokenBucket(rate * self.SAFETY_FACTOR, capacity * self.SAFETY_FACTOR)
+            return self.BUCKETS[upstream]
+
+    def acquire(self, upstream: str, weight: float = 1):
+        """
+        Acquire quota for a request to the upstream, blocking until it is available
+        """
+        waited = self.get_bucket(upstream).acquire(weight)
+        if (waited > 0):
+            logger.debug("Waited [%.3f] seconds for [%s] quota", waited, upstream)
+
+    async def acquire_async(self, upstream: str, weight: float = 1):
+        """
+        Acquire quota for a request to the upstream, waiting without blocking the event loop
+        """
+        waited = await self.get_bucket(upstream).acquire_async(weight)
+        if (waited > 0):
+            logger.debug("Waited [%.3f] seconds for [%s] quota", waited, upstream)
+
+    def observe_used(self, upstream: str, used: float):
+        """
+        Feed the usage reported by the upstream for the current window
+        """
+        _, capacity = self.LIMITS[upstream]
+        self.get_bucket(upstream).observe_used(used, capacity * self.SAFETY_FACTOR)
+
+    def throttled(self, upstream: str, retry_after=None):
+        """
+        Record that the upstream throttled us, pausing it for retry_after seconds
+        """
+        try:
+            seconds = float(retry_after) if retry_after is not None else self.DEFAULT_RETRY_AFTER
+        except ValueError:
+            seconds = self.DEFAULT_RETRY_AFTER
+        logger.warning("Upstream [" + upstream + "] throttled requests, pausing for [" + str(seconds) + "] seconds")
+        self.get_bucket(upstream).block_for(seconds)
+
+# Process wide quota manager shared by every service
+_QUOTAS: QuotaManager = None
+_QUOTAS_LOCK = threading.Lock()
+
+def configure_quota_manager(limits: dict[str, tuple[float, float]] = None) -> QuotaManager:
+    """
+    Configure the process wide quota manager, replacing any existing one
+    """
+    global _QUOTAS
+    with _QUOTAS_LOCK:
+        _QUOTAS = QuotaManager(limits)
+        return _QUOTAS
+
+def get_quota_manager() -> QuotaManager:
+    """
+    Get the process wide quota manager, creating it with the default limits on first use
+    """
+    global _QUOTAS
+    with _QUOTAS_LOCK:
+        if (_QUOTAS is None):
+            _QUOTAS = QuotaManager()
+        return _QUOTAS
@@ -0,0 +1,282 @@
+import asyncio
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+
+import requests
+
+from src.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+class UpstreamUnavailableError(Exception):
+    """
+    Raised when an upstream is unavailable, the call may succeed on a later run
+    """
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """
+    Raised instead of calling an upstream whose circuit breaker is open
+    """
+    def __init__(self, upstream: str, retry_in: float):
+        super().__init__("Upstream [" + upstream + "] is unavailable, failing fast for [" + str(round(retry_in, 1)) + "] seconds")
+        self.UPSTREAM = upstream
+        self.RETRY_IN = retry_in
+
+class RetriesExhaustedError(UpstreamUnavailableError):
+    """
+    Raised when an upstream kept failing transiently until the call gave up, the last error is chained
+    """
+    def __init__(self, upstream: str, attempts: int, status: int = None):
+        super().__init__("Upstream [" + upstream + "] is unavailable, gave up after [" + str(attempts) + "] attempts" + (" with status [" + str(status) + "]" if status is not None else ""))
+        self.UPSTREAM = upstream
+        self.ATTEMPTS = attempts
+        self.STATUS = status
+
+class CircuitBreaker:
+    """
+    Thread safe circuit breaker of an upstream
+    Opens after failure_threshold consecutive transient failures, failing calls fast for reset_seconds,
+    then lets a single probe call through (half open) which closes it on success or opens it again on failure
+    """
+    def __init__(self, upstream: str, failure_threshold: int, reset_seconds: float):
+        """
+        Initialize the CircuitBreaker class
+        """
+        if (failure_threshold is None or failure_threshold < 1):
+            raise ValueError("Failure threshold must be at least 1")
+        if (reset_seconds is None or reset_seconds < 0):
+            raise ValueError("Reset seconds must not be negative")
+
+        self.UPSTREAM = upstream
+        self.FAILURE_THRESHOLD = failure_threshold
+        self.RESET_SECONDS = reset_seconds
+        self.FAILURES = 0
+        self.OPENED_AT: float = None
+        self.PROBING = False
+        self.LOCK = threading.Lock()
+
+    def allow(self):
+        """
+        Allow a call, raises CircuitOpenError while the breaker is open or another call is probing
+        """
+        with self.LOCK:
+            if (self.OPENED_AT is None):
+                return
+            retry_in = self.OPENED_AT + self.RESET_SECONDS - time.monotonic()
+            if (retry_in > 0 or self.PROBING):
+                raise CircuitOpenError(self.UPSTREAM, max(0.0, retry_in))
+            self.PROBING = True
+            logger.info("Probing upstream [" + self.UPSTREAM + "] after [" + str(self.RESET_SECONDS) + "] seconds open")
+
+    def is_open(self) -> bool:
+        with self.LOCK:
+            return self.OPENED_AT is not None
+
+    def record_success(self):
+        """
+        Record a call the upstream answered, closing the breaker
+        """
+        with self.LOCK:
+            if (self.OPENED_AT is not None):
+                logger.info("Upstream [" + self.UPSTREAM + "] recovered, closing circuit breaker")
+            self.FAILURES = 0
+            self.OPENED_AT = None
+            self.PROBING = False
+
+    def record_failure(self):
+        """
+        Record a transient failure, opening the breaker at the threshold or when the probe failed
+        """
+        with self.LOCK:
+            self.FAILURES += 1
+            if (self.PROBING or (self.OPENED_AT is None and self.FAILURES >= self.FAILURE_THRESHOLD)):
+                logger.warning("Upstream [" + self.UPSTREAM + "] failed [" + str(self.FAILURES) + "] times in a row, failing fast for [" + str(self.RESET_SECONDS) + "] seconds")
+                self.OPENED_AT = time.monotonic()
+                self.PROBING = False
+
+class Resilience:
+    """
+    Retries transient upstream failures with jittered exponential backoff, honouring Retry-After, behind a circuit breaker per upstream
+    Calls that are not idempotent are only retried when the upstream throttled them, as it then rejected them without side effects
+    """
+    DEFAULT_MAX_ATTEMPTS = 4
+    # Seconds of the first backoff, doubling on each attempt up to max_delay
+    DEFAULT_BASE_DELAY = 0.5
+    # Longest wait before a retry, a Retry-After beyond it fails the call instead
+    DEFAULT_MAX_DELAY = 30.0
+    DEFAULT_FAILURE_THRESHOLD = 5
+    DEFAULT_RESET_SECONDS = 30.0
+    # Statuses worth retrying, throttling and server side errors
+    THROTTLE_STATUSES = [418, 429]
+    TRANSIENT_STATUSES = [418, 429, 500, 502, 503, 504]
+
+    def __init__(self, max_attempts: int = None, base_delay: float = None, max_delay: float = None, failure_threshold: int = None, reset_seconds: float = None):
+        """
+        Initialize the Resilience class
+        """
+        self.MAX_ATTEMPTS = max_attempts or self.DEFAULT_MAX_ATTEMPTS
+        self.BASE_DELAY = base_delay if base_delay is not None else self.DEFAULT_BASE_DELAY
+        self.MAX_DELAY = max_delay if max_delay is not None else self.DEFAULT_MAX_DELAY
+        self.FAILURE_THRESHOLD = failure_threshold or self.DEFAULT_FAILURE_THRESHOLD
+        self.RESET_SECONDS = reset_seconds if reset_seconds is not None else self.DEFAULT_RESET_SECONDS
+        self.BREAKERS: dict[str, CircuitBreaker] = {}
+        self.LOCK = threading.Lock()
+
+    def get_breaker(self, upstream: str) -> CircuitBreaker:
+        """
+        Get the circuit breaker of the upstream, creating it on first use
+        """
+        with self.LOCK:
+            breaker = self.BREAKERS.get(upstream)
+            if (breaker is None):
+                breaker = self.BREAKERS[upstream] = CircuitBreaker(upstream, self.FAILURE_THRESHOLD, self.RESET_SECONDS)
+            return breaker
+
+    def call(self, upstream: str, fn, classify, idempotent: bool = True):
+        """
+        Call fn through the upstream's circuit breaker, retrying transient failures
+        classify(result, error) returns the (status, retry_after) of a transient failure, or None when the upstream answered
+        Raises RetriesExhaustedError when giving up on a transient failure, other results and errors are returned or raised as is
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker = self.get_breaker(upstream)
+            breaker.allow()
+            res, err = None, None
+            try:
+                res = fn()
+            except Exception as error:
+                err = error
+            failure = classify(res, err)
+            delay = self.get_retry_delay(upstream, breaker, failure, idempotent, attempt, err)
+            if (delay is None):
+                if (failure is not None):
+                    raise RetriesExhaustedError(upstream, attempt, failure[0]) from err
+                if (err is not None):
+                    raise err
+                return res
+            time.sleep(delay)
+
+    async def call_async(self, upstream: str, fn, classify, idempotent: bool = True):
+        """
+        Call fn through the upstream's circuit breaker from a coroutine, fn() returns an awaitable
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker = self.get_breaker(upstream)
+            breaker.allow()
+            res, err = None, None
+            try:
+                res = await fn()
+            except Exception as error:
+                err = error
+            failure = classify(res, err)
+            delay = self.get_retry_delay(upstream, breaker, failure, idempotent, attempt, err)
+            if (delay is None):
+                if (failure is not None):
+                    raise RetriesExhaustedError(upstream, attempt, failure[0]) from err
+                if (err is not None):
+                    raise err
+                return res
+            await asyncio.sleep(delay)
+
+    def get_retry_delay(self, upstream: str, breaker: CircuitBreaker, failure: tuple, idempotent: bool, attempt: int, err: Exception = None) -> float:
+        """
+        Record the outcome of an attempt with the breaker, returns the seconds to wait before retrying, or None when not retrying
+        """
+        if (failure is None):
+            breaker.record_success()
+            return None
+
+        status, retry_after = failure
+        throttled = status in self.THROTTLE_STATUSES
+        # Throttling is the upstream answering to protect itself, not an outage
+        if (throttled):
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+        reason = "status [" + str(status) + "]" if status is not None else "error [" + str(err) + "]"
+        if (attempt >= self.MAX_ATTEMPTS or (not idempotent and not throttled) or breaker.is_open()):
+            logger.warning("Giving up on [" + upstream + "] call after [" + str(attempt) + "] attempts with " + reason)
+            return None
+
+        delay = self.get_delay(attempt, retry_after)
+        if (delay is None):
+            logger.warning("Giving up on [" + upstream + "] call with " + reason + ", retry after [" + str(retry_after) + "] exceeds [" + str(self.MAX_DELAY) + "] seconds")
+            return None
+        logger.info("Retrying [%s] call in [%.2f] seconds after attempt [%d] failed with %s", upstream, delay, attempt, reason)
+        return delay
+
+    def get_delay(self, attempt: int, retry_after=None) -> float:
+        """
+        Get the seconds to wait after a failed attempt, the Retry-After of the upstream when given, else a full jitter exponential backoff
+        Returns None when the upstream asks to wait longer than MAX_DELAY
+        """
+        seconds = parse_retry_after(retry_after)
+        if (seconds is not None):
+            if (seconds > self.MAX_DELAY):
+                return None
+            # Spread the retries of concurrent callers released at the same time
+            return seconds + random.uniform(0, self.BASE_DELAY)
+        return random.uniform(0, min(self.MAX_DELAY, self.BASE_DELAY * 2 ** (attempt - 1)))
+
+def parse_retry_after(retry_after) -> float:
+    """
+    Parse a Retry-After header, in seconds or as an HTTP date, None when missing or invalid
+    """
+    if (retry_after is None or retry_after == ""):
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(str(retry_after)).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def get_status_failure(status: int, retry_after=None) -> tuple:
+    """
+    Get the (status, retry_after) failure of a response status, None unless the status is transient
+    """
+    if (status in Resilience.TRANSIENT_STATUSES):
+        return status, retry_after
+    return None
+
+def get_response_failure(res, err) -> tuple:
+    """
+    Classify a requests call, transient on a transient status, a timeout or a connection error
+    """
+    if (err is not None):
+        if (isinstance(err, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))):
+            return None, None
+        return None
+    return get_status_failure(res.status_code, res.headers.get("Retry-After"))
+
+# Process wide resilience shared by every service
+_RESILIENCE: Resilience = None
+_RESILIENCE_LOCK = threading.Lock()
+
+def configure_resilience(max_attempts: int = None, base_delay: float = None, max_delay: float = None, failure_threshold: int = None, reset_seconds: float = None) -> Resilience:
+    """
+    Configure the process wide resilience, replacing any existing one
+    """
+    global _RESILIENCE
+    with _RESILIENCE_LOCK:
+        _RESILIENCE = Resilience(max_attempts, base_delay, max_delay, failure_threshold, reset_seconds)
+        return _RESILIENCE
+
+def get_resilience() -> Resilience:
+    """
+    Get the process wide resilience, creating it with the default settings on first use
+    """
+    global _RESILIENCE
+    with _RESILIENCE_LOCK:
+        if (_RESILIENCE is None):
+            _RESILIENCE = Resilience()
+        return _RESILIENCE
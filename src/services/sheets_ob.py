@@ -1,21 +1,27 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import json
 import os.path
+import threading
+import time
+import urllib.parse
 
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+# The Google auth and discovery modules are imported when the service is built, they dominate the import time
 from googleapiclient.errors import HttpError
+import httplib2
 
 from src.helper import dt_to_str
+from src.services.cassette import Cassette
 from src.logger_config import setup_logger
 from src.services.exchange import Order
+from src.services.metrics import Metrics, get_metrics
+from src.services.quota_manager import QuotaManager, get_quota_manager
+from src.services.resilience import Resilience, UpstreamUnavailableError, get_resilience, get_status_failure
 
 logger = setup_logger(__name__)
 
 # If modifying these scopes, delete the file token.json.
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+# Drive metadata is only read for the spreadsheet revision, tokens granted without it fall back to full fetches
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive.metadata.readonly"]
 
 class SheetsOB:
     GS_COLUMN_MAPPING = {
@@ -35,10 +41,22 @@ class SheetsOB:
         "RTPS_REFRESH": 13
     }
     NO_BREAK_STRING = "*=*=*=*=*"
+    # Limits for a single values().batchUpdate request, Google recommends payloads below 2MB
+    BATCH_MAX_RANGES = 500
+    BATCH_MAX_BYTES = 2 * 1024 * 1024
+    # Seconds after which the OB cache is fully re-fetched, even when the spreadsheet revision is unchanged
+    SNAPSHOT_MAX_AGE = 24 * 60 * 60
+    # Requests with side effects on a repeat, only retried when throttled, values updates and clears are idempotent
+    NON_IDEMPOTENT_METHODS = ["sheets.spreadsheets.values.append", "sheets.spreadsheets.batchUpdate"]
     
-    def __init__(self, id, ob_sheet_name, neworders_sheet_name, service_account_file=None, user_token_file=None, user_secret_file=None):
+    def __init__(self, id, ob_sheet_name, neworders_sheet_name, service_account_file=None, user_token_file=None, user_secret_file=None, write_buffer_rows=None, write_buffer_seconds=None, service=None, quotas: QuotaManager = None, snapshot_dir=None, metrics: Metrics = None, cassette: Cassette = None, resilience: Resilience = None, drive_service=None):
         """
         Initialize the SheetsOB class
+        When write_buffer_rows is set, OB row updates are buffered and flushed in bulk once the buffer 
+        holds write_buffer_rows rows or is older than write_buffer_seconds, call flush_ob_rows at the end of a job
+        When snapshot_dir is set, the OB cache is persisted there and warm-started from disk on the next run
+        drive_service reads the spreadsheet revision, built from the credentials unless provided, without it the OB sheet is always fetched in full
+        When cassette is set, the API requests are recorded to it, or replayed from it without credentials
         """
         if (id is None):
             raise ValueError("ID is required")
@@ -46,19 +64,79 @@ class SheetsOB:
             raise ValueError("Order Book Sheet is required")
         if (neworders_sheet_name is None):
             raise ValueError("New Orders Sheet is required")
-        if (service_account_file is None and user_secret_file is None):
+        if (service is None and service_account_file is None and user_secret_file is None and not (cassette is not None and cassette.replaying)):
             raise ValueError("Service account file or user secret file is required")
         
         self.ID=id
         self.OB_SHEET_NAME=ob_sheet_name
         self.NEWORDERS_SHEET_NAME=neworders_sheet_name
         
-        # Get credentials from service account file or user token file
+        # Initialize the service, unless one is provided
+        self.CREDENTIALS = None
+        self.HTTP = None
+        if (service is None and cassette is not None and cassette.replaying):
+            self.HTTP = httplib2.Http()
+            service = self.build_service(None, http=self.HTTP)
+        elif (service is None):
+            self.CREDENTIALS = self.get_credentials(service_account_file, user_token_file, user_secret_file)
+            service = self.build_service(self.CREDENTIALS)
+        self.SERVICE = service
+        # The Drive service is built on first use, alongside a Sheets service built here
+        self.DRIVE_SERVICE = drive_service
+        self.DRIVE_ENABLED = drive_service is not None or self.CREDENTIALS is not None or self.HTTP is not None
+        self.QUOTAS = quotas if quotas is not None else get_quota_manager()
+        self.METRICS = metrics if metrics is not None else get_metrics()
+        self.CASSETTE = cassette
+        self.RESILIENCE = resilience if resilience is not None else get_resilience()
+        
+        # Initialize the cache, with the time and spreadsheet revision of the last full fetch
+        self.CACHE: dict[str, list[list]] = {}
+        self.CACHE_FETCHED: dict[str, float] = {}
+        self.CACHE_REVISION: dict[str, str] = {}
+        self.SNAPSHOT_DIR = snapshot_dir
+        
+        # Initialize the cache indexes, OB reference and RTPS Refresh flag to row numbers, NO account to row number and the breaker row
+        self.OB_REFERENCE_INDEX: dict[str, list[int]] = {}
+        self.OB_REFRESH_INDEX: dict[str, set[int]] = {}
+        self.NO_ACCOUNT_INDEX: dict[str, int] = None
+        self.NO_BREAKER_ROW: int = None
+        
+        # Initialize the OB write buffer, row number -> {column key: value}
+        self.WRITE_BUFFER_ROWS = write_buffer_rows
+        self.WRITE_BUFFER_SECONDS = write_buffer_seconds
+        self.WRITE_BUFFER: dict[int, dict] = {}
+        self.WRITE_BUFFER_STARTED = None
+        self.WRITE_BUFFER_LOCK = threading.Lock()
+    
+    def build_service(self, creds, http=None, api="sheets", version="v4"):
+        """
+        Build the Sheets (or another Google API) service from the discovery document bundled with the client library, never fetching it over the network
+        An http client replaces the credentials, e.g. an unauthenticated one for replays
+        """
+        from googleapiclient.discovery import build
+        
+        start = time.monotonic()
+        service = build(api, version, credentials=creds, http=http, static_discovery=True, cache_discovery=False)
+        logger.debug("Built Google [" + api + "] service in [" + str(round(time.monotonic() - start, 3)) + "] seconds")
+        return service
+    
+    def get_credentials(self, service_account_file, user_token_file, user_secret_file):
+        """
+        Get credentials from the service account file or user token file
+        """
+        from google.auth.transport.requests import Request
+        from google.oauth2 import service_account
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        
         creds = None
         if service_account_file is not None and os.path.exists(service_account_file):
             creds = service_account.Credentials.from_service_account_file(service_account_file)
         if user_token_file is not None and os.path.exists(user_token_file):
-            creds = Credentials.from_authorized_user_file(user_token_file, SCOPES)
+            # The token keeps the scopes it was granted, refreshing it with scopes added since would fail
+            creds = Credentials.from_authorized_user_file(user_token_file)
+            if (not creds.has_scopes(SCOPES)):
+                logger.warning("Token file [" + user_token_file + "] was not granted the scopes [" + ", ".join(SCOPES) + "], the order book is fetched in full on every refresh until it is deleted and signed in again")
         
         # If there are no (valid) credentials available, let the user log in.
         if (not creds or not creds.valid) and user_secret_file is not None and os.path.exists(user_secret_file):
@@ -72,67 +150,330 @@ class SheetsOB:
                 # Save the credentials for the next run
                 with open(user_token_file, "w") as token:
                     token.write(creds.to_json())
-                    
-        # Initialize the service
-        self.SERVICE = build("sheets", "v4", credentials=creds)
+        return creds
+    
+    def refresh_credentials(self, margin=300):
+        """
+        Refresh the credentials if they are invalid or expire within margin seconds, so long running processes never wait on a refresh
+        """
+        creds = self.CREDENTIALS
+        if (creds is None or not hasattr(creds, "refresh")):
+            return
         
-        # Initialize the cache
-        self.CACHE: dict[str, list[list]] = {}
+        expiry = getattr(creds, "expiry", None)
+        # google.auth keeps the expiry as a naive UTC datetime
+        if (creds.valid and expiry is not None and expiry - datetime.now(timezone.utc).replace(tzinfo=None) > timedelta(seconds=margin)):
+            return
+        
+        from google.auth.transport.requests import Request
+        
+        logger.info("Refreshing Google credentials...")
+        creds.refresh(Request())
+        logger.info("Successfully refreshed Google credentials, expiring at [" + str(creds.expiry) + "]")
+    
+    def expire_cache(self):
+        """
+        Bring the cache up to date before a job runs in a long running process
+        Pending OB writes are flushed, the OB sheet is re-fetched if its revision changed and the New Orders sheet is re-fetched on next use
+        """
+        self.flush_ob_rows()
+        self.CACHE.pop(self.NEWORDERS_SHEET_NAME, None)
+        self.NO_ACCOUNT_INDEX = None
+        self.NO_BREAKER_ROW = None
+        if (self.CACHE.get(self.OB_SHEET_NAME)):
+            self.populate_cache(self.OB_SHEET_NAME)
     
-    def populate_cache(self, sheet_name=None):
+    def execute(self, request):
         """
-        Populate the cache for sheet_name
+        Execute a Google Sheets API request within the Sheets quota, retrying transient failures
+        """
+        method_id = getattr(request, "methodId", None) or "sheets"
+        postproc = getattr(request, "postproc", None)
+        return self.RESILIENCE.call("sheets", lambda: self.execute_once(request, method_id, postproc), get_sheets_failure, method_id not in self.NON_IDEMPOTENT_METHODS)
+    
+    def execute_once(self, request, method_id, postproc):
+        """
+        Make an attempt at a Google Sheets API request, postproc is the client's parser of the response
+        """
+        self.QUOTAS.acquire("sheets")
+        with self.METRICS.time_request("sheets", method_id) as timer:
+            # Measure the raw response before the client parses it
+            if (postproc is not None):
+                def measure(resp, content):
+                    timer.set_response(resp.status, len(content or b""), len(request.body or b""))
+                    return postproc(resp, content)
+                request.postproc = measure
+            try:
+                if (self.CASSETTE is not None):
+                    return self.execute_cassette(request, method_id, timer)
+                return request.execute()
+            except HttpError as err:
+                timer.set_response(err.resp.status)
+                if (err.resp.status == 429):
+                    self.QUOTAS.throttled("sheets", err.resp.get("retry-after"))
+                raise
+    
+    def execute_cassette(self, request, method_id, timer):
+        """
+        Execute a request through the cassette, error responses are recorded and raised again on replay
+        """
+        def encode(res, err):
+            if (err is None):
+                return {"status": 200, "body": res}
+            if (isinstance(err, HttpError)):
+                return {"status": err.resp.status, "retry-after": err.resp.get("retry-after"), "content": err.content.decode("utf-8", "replace")}
+            return None
+        
+        def decode(response):
+            if (response["status"] >= 400):
+                headers = {"status": str(response["status"])}
+                if (response.get("retry-after") is not None):
+                    headers["retry-after"] = response["retry-after"]
+                raise HttpError(httplib2.Response(headers), response["content"].encode("utf-8"), uri=request.uri)
+            timer.set_response(response["status"], len(json.dumps(response["body"])), len(request.body or b""))
+            return response["body"]
+        
+        body = request.body.decode("utf-8") if isinstance(request.body, bytes) else request.body
+        # The API host is left out of the key, so replays match recordings made against another endpoint
+        uri = urllib.parse.urlsplit(request.uri)
+        return self.CASSETTE.call("sheets", method_id, {"uri": uri.path + "?" + uri.query, "body": body}, request.execute, encode, decode)
+    
+    def populate_cache(self, sheet_name=None) -> bool:
+        """
+        Populate the cache for sheet_name, returns False when the sheet could not be fetched
+        The OB sheet is warm-started from its snapshot and only fetched again once the spreadsheet revision changed, other sheets are fetched in full
         """
         if (sheet_name is None):
             sheet_name = self.OB_SHEET_NAME
         
         logger.info("Populating Google Sheets cache for sheet [" + sheet_name + "]")
         try:
-            sheet = self.SERVICE.spreadsheets()
-            result = (
-                sheet.values()
-                .get(spreadsheetId=self.ID, range=sheet_name)
-                .execute()
-            )
-            values = result.get("values", [])
+            revision = None
+            if (sheet_name == self.OB_SHEET_NAME):
+                if (sheet_name not in self.CACHE):
+                    self.load_snapshot(sheet_name)
+                # Read before the fetch, so an edit made while fetching is caught by the next check
+                revision = self.get_revision()
+                if (self.is_cache_current(sheet_name, revision)):
+                    logger.info("Sheet [" + sheet_name + "] is unchanged since revision [" + revision + "], keeping [" + str(len(self.CACHE[sheet_name])) + "] cached rows")
+                    return True
+            
+            values = self.fetch_full(sheet_name)
+            self.CACHE_FETCHED[sheet_name] = time.time()
+            self.CACHE_REVISION[sheet_name] = revision
             
             if not values:
                 logger.info("No data found.")
-                return None
+                return True
             
             self.CACHE[sheet_name] = values
+            self.build_indexes(sheet_name)
+            if (sheet_name == self.OB_SHEET_NAME):
+                self.save_snapshot(sheet_name)
             logger.info("Successfully populated Google Sheets cache with [" + str(len(self.CACHE[sheet_name])) + "] rows")
-        except HttpError as err:
+            return True
+        except (HttpError, UpstreamUnavailableError) as err:
             logger.error(err)
+            return False
+    
+    def warm_cache(self, sheet_name=None):
+        """
+        Populate the cache for sheet_name unless it is already cached
+        """
+        if (sheet_name is None):
+            sheet_name = self.OB_SHEET_NAME
+        if (self.CACHE.get(sheet_name) is None):
+            self.populate_cache(sheet_name)
+    
+    def is_cache_current(self, sheet_name, revision) -> bool:
+        """
+        Whether the cached sheet is current at the spreadsheet's current revision, and was fetched recently enough to be trusted
+        Every edit changes the revision, our own writes re-read the rows they wrote and record the new revision instead of leading to a full fetch
+        """
+        if (revision is None or not self.CACHE.get(sheet_name)):
+            return False
+        if (time.time() - self.CACHE_FETCHED.get(sheet_name, 0) >= self.SNAPSHOT_MAX_AGE):
+            return False
+        return revision == self.CACHE_REVISION.get(sheet_name)
+    
+    def get_revision(self) -> str:
+        """
+        Get the revision of the spreadsheet from its Drive version, None when Drive is not available
+        """
+        if (not self.DRIVE_ENABLED):
+            return None
+        
+        try:
+            if (self.DRIVE_SERVICE is None):
+                self.DRIVE_SERVICE = self.build_service(self.CREDENTIALS, http=self.HTTP, api="drive", version="v3")
+            res = self.execute(
+                self.DRIVE_SERVICE.files()
+                .get(fileId=self.ID, fields="version", supportsAllDrives=True)
+            )
+            return res.get("version")
+        except UpstreamUnavailableError as err:
+            logger.warning("Failed to get the spreadsheet revision with error [" + str(err) + "], fetching sheets in full this time")
+            return None
+        except HttpError as err:
+            # e.g. a token granted before the Drive metadata scope was added, recreate token.json to enable the check
+            logger.warning("Failed to get the spreadsheet revision with error [" + str(err) + "], fetching sheets in full from now on")
+            self.DRIVE_ENABLED = False
             return None
     
+    def fetch_full(self, sheet_name) -> list[list]:
+        """
+        Fetch every row of the sheet
+        """
+        sheet = self.SERVICE.spreadsheets()
+        result = self.execute(
+            sheet.values()
+            .get(spreadsheetId=self.ID, range=sheet_name)
+        )
+        return result.get("values", [])
+    
+    def get_snapshot_path(self, sheet_name) -> str:
+        """
+        Get the path of the snapshot file for sheet_name
+        """
+        file_name = "".join(c if c.isalnum() else "_" for c in self.ID + "_" + sheet_name) + ".json"
+        return os.path.join(self.SNAPSHOT_DIR, file_name)
+    
+    def load_snapshot(self, sheet_name):
+        """
+        Load the cache for sheet_name from its snapshot, if any
+        """
+        if (self.SNAPSHOT_DIR is None or not os.path.exists(self.get_snapshot_path(sheet_name))):
+            return
+        
+        try:
+            with open(self.get_snapshot_path(sheet_name)) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.CACHE[sheet_name] = snapshot["values"]
+            self.CACHE_FETCHED[sheet_name] = snapshot["fetched"]
+            self.CACHE_REVISION[sheet_name] = snapshot.get("revision")
+            self.build_indexes(sheet_name)
+            logger.info("Loaded [" + str(len(snapshot["values"])) + "] rows of sheet [" + sheet_name + "] from snapshot")
+        except (OSError, ValueError, KeyError) as err:
+            logger.warning("Failed to load snapshot of sheet [" + sheet_name + "] with error [" + str(err) + "], ignoring...")
+    
+    def save_snapshot(self, sheet_name):
+        """
+        Save the cache for sheet_name to its snapshot
+        """
+        if (self.SNAPSHOT_DIR is None):
+            return
+        
+        try:
+            os.makedirs(self.SNAPSHOT_DIR, exist_ok=True)
+            path = self.get_snapshot_path(sheet_name)
+            with open(path + ".tmp", "w") as snapshot_file:
+                json.dump({"fetched": self.CACHE_FETCHED.get(sheet_name, 0), "revision": self.CACHE_REVISION.get(sheet_name), "values": self.CACHE[sheet_name]}, snapshot_file)
+            os.replace(path + ".tmp", path)
+        except OSError as err:
+            logger.warning("Failed to save snapshot of sheet [" + sheet_name + "] with error [" + str(err) + "], ignoring...")
+    
+    def patch_cache(self, sheet_name, row_number: int, column: int, value):
+        """
+        Patch a cell of the cached sheet after our own write, 1-based row number and 0-based column
+        """
+        rows = self.CACHE.get(sheet_name)
+        if (rows is None):
+            return
+        while len(rows) < row_number:
+            rows.append([])
+        row = rows[row_number - 1]
+        if len(row) <= column:
+            row.extend([""] * (column + 1 - len(row)))
+        
+        if (sheet_name == self.OB_SHEET_NAME and row_number > 1):
+            self.index_ob_row(row_number, row, remove=True)
+            row[column] = "" if value is None else str(value)
+            self.index_ob_row(row_number, row)
+        else:
+            row[column] = "" if value is None else str(value)
+            self.NO_ACCOUNT_INDEX = None
+    
+    def build_indexes(self, sheet_name):
+        """
+        Build the indexes of the cached sheet, the NO index is rebuilt lazily on next use
+        """
+        if (sheet_name == self.OB_SHEET_NAME):
+            self.OB_REFERENCE_INDEX = {}
+            self.OB_REFRESH_INDEX = {}
+            for row_number, row in enumerate(self.CACHE[sheet_name][1:], start=2):
+                self.index_ob_row(row_number, row)
+        else:
+            self.NO_ACCOUNT_INDEX = None
+    
+    def index_ob_row(self, row_number: int, row: list, remove=False):
+        """
+        Add (or remove) the OB row to the reference and RTPS Refresh indexes
+        """
+        reference = row[self.GS_COLUMN_MAPPING["REFERENCE"]] if len(row) > self.GS_COLUMN_MAPPING["REFERENCE"] else ""
+        refresh = row[self.GS_COLUMN_MAPPING["RTPS_REFRESH"]] if len(row) > self.GS_COLUMN_MAPPING["RTPS_REFRESH"] else ""
+        if (remove):
+            if reference in self.OB_REFERENCE_INDEX and row_number in self.OB_REFERENCE_INDEX[reference]:
+                self.OB_REFERENCE_INDEX[reference].remove(row_number)
+            self.OB_REFRESH_INDEX.get(refresh, set()).discard(row_number)
+        else:
+            if reference:
+                self.OB_REFERENCE_INDEX.setdefault(reference, []).append(row_number)
+            self.OB_REFRESH_INDEX.setdefault(refresh, set()).add(row_number)
+    
+    def get_no_index(self) -> tuple[dict[str, int], int]:
+        """
+        Get the NO account to row number index and the breaker row number, building them if needed
+        Accounts are the rows above the breaker row, in sheet order
+        """
+        self.warm_cache(self.NEWORDERS_SHEET_NAME)
+        
+        if (self.NO_ACCOUNT_INDEX is None):
+            self.NO_ACCOUNT_INDEX = {}
+            self.NO_BREAKER_ROW = None
+            for idx, row in enumerate(self.CACHE.get(self.NEWORDERS_SHEET_NAME) or []):
+                if row is not None and len(row) > 0:
+                    if row[0] == self.NO_BREAK_STRING:
+                        self.NO_BREAKER_ROW = idx + 1
+                        break
+                    
+                    if row[0] == "Account" or (len(row) > 1 and row[1] == "Deactivated"):
+                        continue
+                    
+                    self.NO_ACCOUNT_INDEX[row[0]] = idx + 1
+        return self.NO_ACCOUNT_INDEX, self.NO_BREAKER_ROW
+    
     def get_rows_with_order_references(self, order_references):
         """
         Get all rows with order references
         """
         if (order_references is None):
             raise ValueError("Order references are required")
-        logger.info("Getting rows from Google Sheets with order references [" + str(order_references) + "]")
+        logger.info("Getting rows from Google Sheets with [%d] order references", len(order_references))
+        logger.debug("Order references [%s]", order_references)
         
-        if (self.OB_SHEET_NAME not in self.CACHE or self.CACHE[self.OB_SHEET_NAME] is None):
-            self.populate_cache(self.OB_SHEET_NAME)
+        self.warm_cache(self.OB_SHEET_NAME)
             
         # Initialise res with headers
-        res = [self.CACHE[self.OB_SHEET_NAME][0]]
+        cache = self.CACHE[self.OB_SHEET_NAME]
+        res = [list(cache[0])]
         
-        # Filter rows with matching order references
-        for row in self.CACHE[self.OB_SHEET_NAME][1:]:
-            if len(row) > self.GS_COLUMN_MAPPING["REFERENCE"] and row[self.GS_COLUMN_MAPPING["REFERENCE"]] in order_references:
-                res.append(row)
+        # Look up rows with matching order references, in sheet order
+        row_numbers = set()
+        missing = []
+        for order_ref in dict.fromkeys(order_references):
+            if self.OB_REFERENCE_INDEX.get(order_ref):
+                row_numbers.update(self.OB_REFERENCE_INDEX[order_ref])
+            else:
+                missing.append(order_ref)
+        for row_number in sorted(row_numbers):
+            res.append(list(cache[row_number - 1]))
         logger.info("Found [" + str(len(res)) + "] rows with matching order references")
             
-        # Check if there are missing order references    
-        if (len(res) < len(order_references)):
-            logger.warning("Missing [" + str(len(order_references) - len(res)) + "] order references")
-            # Add missing order references with empty values
-            for order_ref in order_references:
-                if not any(row[self.GS_COLUMN_MAPPING["REFERENCE"]] == order_ref for row in res):
-                    res.append(["", "", "", "", "", "", "", "", "", "", "", order_ref, ""])
+        # Add missing order references with empty values
+        if (len(missing) > 0):
+            logger.warning("Missing [" + str(len(missing)) + "] order references")
+            for order_ref in missing:
+                res.append(["", "", "", "", "", "", "", "", "", "", "", order_ref, ""])
         
         # Ensure each row has 13 columns, if not add empty values
         for row in res:
@@ -141,61 +482,244 @@ class SheetsOB:
         
         return res
 
+    def get_ob_pairs(self, account_prefix: str) -> list[str]:
+        """
+        Get the pairs traded in the OB by accounts starting with account_prefix
+        """
+        if (account_prefix is None):
+            raise ValueError("Account prefix is required")
+        
+        self.warm_cache(self.OB_SHEET_NAME)
+        if (self.CACHE.get(self.OB_SHEET_NAME) is None):
+            return []
+        
+        pairs = set()
+        for row in self.CACHE[self.OB_SHEET_NAME][1:]:
+            if len(row) > self.GS_COLUMN_MAPPING["PAIR"] and row[self.GS_COLUMN_MAPPING["ACCOUNT"]].startswith(account_prefix) and row[self.GS_COLUMN_MAPPING["PAIR"]]:
+                pairs.add(row[self.GS_COLUMN_MAPPING["PAIR"]])
+        return sorted(pairs)
+    
     def get_rows_pending_rtps_refresh(self):
         """
         Get rows with TRUE in the `RTPS Refresh` column
         Returns a list of row_number, account, pair, reference
         """
         logger.info("Getting rows from Google Sheets pending RTPS Refresh")
-        self.populate_cache()
-            
-        # Filter rows with value True in the `RTPS Refresh` column
+        # A snapshot that could not be brought up to date may list rows already refreshed
+        if (not self.populate_cache()):
+            return None
+        if (self.CACHE.get(self.OB_SHEET_NAME) is None):
+            return None
+        
+        # Look up rows with value True in the `RTPS Refresh` column
         res = []
-        for idx, row in enumerate(self.CACHE[self.OB_SHEET_NAME][1:], start=2):
-            if len(row) > self.GS_COLUMN_MAPPING["RTPS_REFRESH"] and row[self.GS_COLUMN_MAPPING["RTPS_REFRESH"]] == "TRUE":
-                res.append([idx, row[self.GS_COLUMN_MAPPING["ACCOUNT"]], row[self.GS_COLUMN_MAPPING["PAIR"]], row[self.GS_COLUMN_MAPPING["REFERENCE"]]])
+        for row_number in sorted(self.OB_REFRESH_INDEX.get("TRUE", set())):
+            row = self.CACHE[self.OB_SHEET_NAME][row_number - 1]
+            res.append([row_number, row[self.GS_COLUMN_MAPPING["ACCOUNT"]], row[self.GS_COLUMN_MAPPING["PAIR"]], row[self.GS_COLUMN_MAPPING["REFERENCE"]]])
         
         return res
     
-    def update_ob_row(self, row_number: int, row: list[str]):
+    def update_ob_row(self, row_number: int, row: dict[str, str]):
         """
         Update the Google Sheets row for the OB, updating only the columns with values
+        Buffered when the write buffer is enabled, otherwise written immediately
         """
         if (row_number is None):
             raise ValueError("Row number is required")
         if (row is None or len(row) == 0):
             raise ValueError("Row is required")
         
-        logger.debug("Updating Google Sheets row [" + str(row_number) + "] with values [" + str(row) + "]")
+        logger.debug("Updating Google Sheets row [%d] with values [%s]", row_number, row)
+        
+        if (self.WRITE_BUFFER_ROWS is None):
+            return self.write_ob_rows({row_number: row})
+        
+        with self.WRITE_BUFFER_LOCK:
+            if (len(self.WRITE_BUFFER) == 0):
+                self.WRITE_BUFFER_STARTED = time.monotonic()
+            self.WRITE_BUFFER.setdefault(row_number, {}).update(row)
+            
+            # Flush when the buffer is full or too old
+            buffer_full = len(self.WRITE_BUFFER) >= self.WRITE_BUFFER_ROWS
+            buffer_expired = self.WRITE_BUFFER_SECONDS is not None and time.monotonic() - self.WRITE_BUFFER_STARTED >= self.WRITE_BUFFER_SECONDS
+            if (not buffer_full and not buffer_expired):
+                return None
+            rows = self.take_write_buffer()
+        
+        return self.write_ob_rows(rows)
+    
+    def flush_ob_rows(self):
+        """
+        Flush all buffered OB row updates to Google Sheets
+        """
+        with self.WRITE_BUFFER_LOCK:
+            rows = self.take_write_buffer()
+        
+        if (len(rows) == 0):
+            return None
+        return self.write_ob_rows(rows)
+    
+    def restore_write_buffer(self, value_ranges: list[dict]):
+        """
+        Put the cells of value ranges that failed to be written back in the write buffer, without overwriting newer updates of the same cells
+        """
+        keys = {column: key for key, column in self.GS_COLUMN_MAPPING.items()}
+        with self.WRITE_BUFFER_LOCK:
+            if (len(self.WRITE_BUFFER) == 0):
+                self.WRITE_BUFFER_STARTED = time.monotonic()
+            for row_number, column, value in iter_range_cells(value_ranges):
+                self.WRITE_BUFFER.setdefault(row_number, {}).setdefault(keys[column], value)
+    
+    def take_write_buffer(self) -> dict[int, dict]:
+        """
+        Empty the write buffer, returning its content, the caller must hold WRITE_BUFFER_LOCK
+        """
+        rows = self.WRITE_BUFFER
+        self.WRITE_BUFFER = {}
+        self.WRITE_BUFFER_STARTED = None
+        return rows
+    
+    def build_ob_ranges(self, rows: dict[int, dict]) -> list[dict]:
+        """
+        Build the batchUpdate value ranges for OB rows
+        Contiguous columns of a row merge into one range, and consecutive rows spanning the same columns merge into one block
+        """
+        # Split each row into runs of contiguous columns, [start column, end column, values]
+        segments: list[tuple[int, int, int, list]] = []
+        for row_number in sorted(rows.keys()):
+            columns = sorted(
+                (self.GS_COLUMN_MAPPING[key], value) for key, value in rows[row_number].items() if value is not None
+            )
+            for column, value in columns:
+                if segments and segments[-1][0] == row_number and segments[-1][2] == column - 1:
+                    segments[-1] = (row_number, segments[-1][1], column, segments[-1][3] + [value])
+                else:
+                    segments.append((row_number, column, column, [value]))
+        
+        # Merge segments on consecutive rows with the same column span
+        blocks: list[list] = []
+        open_blocks: dict[tuple[int, int], list] = {}
+        for row_number, start_column, end_column, values in segments:
+            block = open_blocks.get((start_column, end_column))
+            if block is not None and block[1] == row_number - 1:
+                block[1] = row_number
+                block[4].append(values)
+            else:
+                block = [row_number, row_number, start_column, end_column, [values]]
+                open_blocks[(start_column, end_column)] = block
+                blocks.append(block)
         
         data = []
-        for key, value in row.items():
-            if value is not None:
-                column = self.GS_COLUMN_MAPPING[key]
-                range_str = self.OB_SHEET_NAME + '!' + chr(65 + column) + str(row_number) + ':' + chr(65 + column) + str(row_number)
-                data.append({
-                    "range": range_str,
-                    "majorDimension": "ROWS",
-                    "values": [[value]],
-                })
-
+        for start_row, end_row, start_column, end_column, values in blocks:
+            range_str = self.OB_SHEET_NAME + '!' + chr(65 + start_column) + str(start_row) + ':' + chr(65 + end_column) + str(end_row)
+            data.append({
+                "range": range_str,
+                "majorDimension": "ROWS",
+                "values": values,
+            })
+        return data
+    
+    def write_ob_rows(self, rows: dict[int, dict]):
+        """
+        Write OB rows to Google Sheets in as few batchUpdate requests as the payload limits allow
+        """
+        data = self.build_ob_ranges(rows)
+        
+        # Split the ranges into batches within the request limits
+        batches = [[]]
+        batch_bytes = 0
+        for value_range in data:
+            range_bytes = len(json.dumps(value_range))
+            if len(batches[-1]) >= self.BATCH_MAX_RANGES or (batches[-1] and batch_bytes + range_bytes > self.BATCH_MAX_BYTES):
+                batches.append([])
+                batch_bytes = 0
+            batches[-1].append(value_range)
+            batch_bytes += range_bytes
+        
+        # Our writes only keep the cache current when nobody else edited the sheet since it was fetched
+        revision = self.get_revision() if self.CACHE.get(self.OB_SHEET_NAME) else None
+        cache_current = self.is_cache_current(self.OB_SHEET_NAME, revision)
+        
+        failed = 0
+        written_rows = set()
+        for batch in batches:
+            if (len(batch) == 0):
+                continue
+            try:
+                sheet = self.SERVICE.spreadsheets()
+                self.execute(
+                    sheet.values()
+                    .batchUpdate(
+                        spreadsheetId=self.ID,
+                        body={
+                            "valueInputOption": "USER_ENTERED",
+                            "data": batch,
+                        }
+                    )
+                )
+            except (HttpError, UpstreamUnavailableError) as err:
+                logger.error(err)
+                failed += 1
+                # Buffer the cells again, so they are written by the next flush or stay pending for the next run
+                self.restore_write_buffer(batch)
+                continue
+            
+            # Patch the cached cells of the batch, a failed batch leaves the sheet and the cache as they were
+            for row_number, column, value in iter_range_cells(batch):
+                self.patch_cache(self.OB_SHEET_NAME, row_number, column, value)
+                written_rows.add(row_number)
+        
+        if (cache_current and written_rows):
+            self.refresh_ob_rows(written_rows)
+        
+        if (failed > 0):
+            logger.error("Failed [" + str(failed) + "] of [" + str(len(batches)) + "] requests updating [" + str(len(rows)) + "] Google Sheets rows")
+            return None
+        logger.info("Successfully updated [" + str(len(rows)) + "] Google Sheets rows with [" + str(len(data)) + "] ranges in [" + str(len(batches)) + "] requests")
+    
+    def refresh_ob_rows(self, row_numbers: set[int]):
+        """
+        Re-read the OB rows we wrote, for the values the sheet computes from them, and keep the cache current at the new revision
+        Only the written rows are fetched instead of the whole sheet, the revision is read first so an edit made meanwhile is caught by the next check
+        """
+        revision = self.get_revision()
+        if (revision is None):
+            return
+        
+        # Contiguous row numbers are read as one range
+        blocks: list[list[int]] = []
+        for row_number in sorted(row_numbers):
+            if blocks and blocks[-1][1] == row_number - 1:
+                blocks[-1][1] = row_number
+            else:
+                blocks.append([row_number, row_number])
+        
         try:
             sheet = self.SERVICE.spreadsheets()
-            (
+            res = self.execute(
                 sheet.values()
-                .batchUpdate(
+                .batchGet(
                     spreadsheetId=self.ID,
-                    body={
-                        "valueInputOption": "USER_ENTERED",
-                        "data": data,
-                    }
+                    ranges=[self.OB_SHEET_NAME + "!" + str(start_row) + ":" + str(end_row) for start_row, end_row in blocks]
                 )
-                .execute()
             )
-            logger.info("Successfully updated Google Sheets row [" + str(row_number) + "]")
-        except HttpError as err:
-            logger.error(err)
-            return None
+        except (HttpError, UpstreamUnavailableError) as err:
+            logger.warning("Failed to re-read written rows with error [" + str(err) + "], fetching the sheet in full on the next refresh")
+            return
+        
+        rows = self.CACHE[self.OB_SHEET_NAME]
+        for (start_row, end_row), value_range in zip(blocks, res.get("valueRanges", [])):
+            values = value_range.get("values", [])
+            for offset, row_number in enumerate(range(start_row, end_row + 1)):
+                while len(rows) < row_number:
+                    rows.append([])
+                self.index_ob_row(row_number, rows[row_number - 1], remove=True)
+                rows[row_number - 1] = list(values[offset]) if offset < len(values) else []
+                self.index_ob_row(row_number, rows[row_number - 1])
+        
+        self.CACHE_REVISION[self.OB_SHEET_NAME] = revision
+        self.save_snapshot(self.OB_SHEET_NAME)
+        logger.info("Re-read [" + str(len(row_numbers)) + "] written rows of sheet [" + self.OB_SHEET_NAME + "], cache current at revision [" + revision + "]")
     
     def update_new_orders(self, account_orders: dict[str, list[Order]]):
         """
@@ -206,25 +730,17 @@ class SheetsOB:
         
         logger.info(f"Updating Google Sheets with [{sum([len(v) for v in account_orders.values()])}] rows of new orders")
         
-        # Check if the cache is populated, this should not be necessary
-        if (self.NEWORDERS_SHEET_NAME not in self.CACHE or self.CACHE[self.NEWORDERS_SHEET_NAME] is None):
-            self.populate_cache(self.NEWORDERS_SHEET_NAME)
-        
         # Find the NO_BREAK_STRING row
-        no_break_row = None
-        for idx, row in enumerate(self.CACHE[self.NEWORDERS_SHEET_NAME]):
-            if row is not None and len(row) > 0:
-                if row[0] == self.NO_BREAK_STRING:
-                    no_break_row = idx + 1
-                    break
-                
+        _, no_break_row = self.get_no_index()
         if (no_break_row is None):
             logger.error("No breaker row found in Google Sheets! Not updating new orders")
             return None
         
         # Clear the New Orders sheet from the breaker row
         row_number = no_break_row + 1
-        self.clear_no_rows_from(row_number)
+        if (not self.clear_no_rows_from(row_number)):
+            logger.error("Failed to clear the New Orders sheet! Not updating new orders")
+            return None
         
         # Construct the new orders list
         data = [["Last Updated", "Account", "Symbol", "Side", "Average", "Executed", "Fee", "Fee Currency", "Order ID"]]
@@ -261,7 +777,7 @@ class SheetsOB:
 
         try:
             sheet = self.SERVICE.spreadsheets()
-            (
+            self.execute(
                 sheet.values()
                 .update(
                     spreadsheetId=self.ID,
@@ -269,10 +785,14 @@ class SheetsOB:
                     valueInputOption="USER_ENTERED",
                     body={"values": orders}
                 )
-                .execute()
             )
             logger.debug("Successfully added orders to Google Sheets")
-        except HttpError as err:
+            
+            # Patch the cached rows
+            for idx, order in enumerate(orders):
+                for column, value in enumerate(order):
+                    self.patch_cache(self.NEWORDERS_SHEET_NAME, start_row_number + idx, column, value)
+        except (HttpError, UpstreamUnavailableError) as err:
             logger.error(err)
             return None
     
@@ -282,20 +802,15 @@ class SheetsOB:
         """
         logger.info("Getting last updated times from Google Sheets")
         
-        if (self.NEWORDERS_SHEET_NAME not in self.CACHE or self.CACHE[self.NEWORDERS_SHEET_NAME] is None):
-            self.populate_cache(self.NEWORDERS_SHEET_NAME)
+        accounts, no_break_row = self.get_no_index()
+        if (no_break_row is None):
+            return None
         
         res = {}
-        for row in self.CACHE[self.NEWORDERS_SHEET_NAME]:
-            if row is not None and len(row) > 0:
-                if row[0] == self.NO_BREAK_STRING:
-                    return res
-                
-                if row[0] == "Account" or (len(row) > 1 and row[1] == "Deactivated"):
-                    continue
-                
-                print (row)
-                res[row[0]] = row[1] if len(row) > 1 and row[1] != '' else None
+        for account, row_number in accounts.items():
+            row = self.CACHE[self.NEWORDERS_SHEET_NAME][row_number - 1]
+            res[account] = row[1] if len(row) > 1 and row[1] != '' else None
+        return res
     
     def update_no_last_updated(self, account: str, last_updated: datetime):
         """
@@ -306,39 +821,29 @@ class SheetsOB:
         if (last_updated is None):
             raise ValueError("Last updated time is required")
         
-        if (self.NEWORDERS_SHEET_NAME not in self.CACHE or self.CACHE[self.NEWORDERS_SHEET_NAME] is None):
-            self.populate_cache(self.NEWORDERS_SHEET_NAME)
-        
         logger.info("Updating last updated time for account [" + account + "] to [" + dt_to_str(last_updated) + "]")
         
-        for idx, row in enumerate(self.CACHE[self.NEWORDERS_SHEET_NAME]):
-            if row is not None and len(row) > 0:
-                if row[0] == self.NO_BREAK_STRING:
-                    raise ValueError("No breaker row found before account [" + account + "] row")
-                
-                if row[0] == "Account" or (len(row) > 1 and row[1] == "Deactivated"):
-                    continue
-                
-                if row[0] == account:
-                    try: 
-                        sheet = self.SERVICE.spreadsheets()
-                        (
-                            sheet.values()
-                            .update(
-                                spreadsheetId=self.ID,
-                                range=self.NEWORDERS_SHEET_NAME + "!B" + str(idx+1),
-                                valueInputOption="USER_ENTERED",
-                                body={"values": [[dt_to_str(last_updated)]]}
-                            )
-                            .execute()
-                        )
-                        logger.debug("Successfully updated last updated time for account [" + account + "]")
-                        return
-                    except HttpError as err:
-                        logger.error(err)
-                        return None
-        
-        raise ValueError("Account [" + account + "] not found in Google Sheets")
+        accounts, _ = self.get_no_index()
+        if (account not in accounts):
+            raise ValueError("Account [" + account + "] not found in Google Sheets")
+        row_number = accounts[account]
+        
+        try: 
+            sheet = self.SERVICE.spreadsheets()
+            self.execute(
+                sheet.values()
+                .update(
+                    spreadsheetId=self.ID,
+                    range=self.NEWORDERS_SHEET_NAME + "!B" + str(row_number),
+                    valueInputOption="USER_ENTERED",
+                    body={"values": [[dt_to_str(last_updated)]]}
+                )
+            )
+            self.patch_cache(self.NEWORDERS_SHEET_NAME, row_number, 1, dt_to_str(last_updated))
+            logger.debug("Successfully updated last updated time for account [" + account + "]")
+        except (HttpError, UpstreamUnavailableError) as err:
+            logger.error(err)
+            return None
     
     def clear_no_from_breaker(self):
         """
@@ -346,39 +851,67 @@ class SheetsOB:
         """
         logger.info("Clearing New Orders sheet")
         
-        # Check if the cache is populated, this should not be necessary
-        if (self.NEWORDERS_SHEET_NAME not in self.CACHE or self.CACHE[self.NEWORDERS_SHEET_NAME] is None):
-            self.populate_cache(self.NEWORDERS_SHEET_NAME)
-        
-        # Clear the NO_BREAK_STRING from the breaker row
-        for idx, row in enumerate(self.CACHE[self.NEWORDERS_SHEET_NAME]):
-            if row is not None and len(row) > 0:
-                if row[0] == self.NO_BREAK_STRING:
-                    self.clear_no_rows_from(idx+3)
+        # Clear from the row after the breaker row
+        _, no_break_row = self.get_no_index()
+        if (no_break_row is not None):
+            self.clear_no_rows_from(no_break_row + 2)
     
-    def clear_no_rows_from(self, row_number):
+    def clear_no_rows_from(self, row_number) -> bool:
         """
-        Clear all rows on New Orders Sheet from the row_number
+        Clear all rows on New Orders Sheet from the row_number, returns False when the clear failed
         """
         if (row_number is None):
             raise ValueError("Row number is required")
         
         # Get the last column and row
         last_row = len(self.CACHE[self.NEWORDERS_SHEET_NAME])
+        if (last_row < row_number):
+            logger.debug("No New Orders sheet rows to clear from row [" + str(row_number) + "]")
+            return True
         last_col = chr(65 + len(self.CACHE[self.NEWORDERS_SHEET_NAME][last_row-1]))
         range = self.NEWORDERS_SHEET_NAME + "!A" + str(row_number) + ":" + last_col + str(last_row)
         
         logger.info("Clearing New Orders sheet cells range [" + range + "]")
         
         # Clear all rows from the row_number
-        sheet = self.SERVICE.spreadsheets()
-        (
-            sheet.values()
-            .clear(
-                spreadsheetId=self.ID,
-                range=range,
-                body={}
+        try:
+            sheet = self.SERVICE.spreadsheets()
+            self.execute(
+                sheet.values()
+                .clear(
+                    spreadsheetId=self.ID,
+                    range=range,
+                    body={}
+                )
             )
-            .execute()
-        )
-        
\ No newline at end of file
+        except (HttpError, UpstreamUnavailableError) as err:
+            logger.error(err)
+            return False
+        
+        # Patch the cached rows
+        del self.CACHE[self.NEWORDERS_SHEET_NAME][row_number - 1:]
+        self.NO_ACCOUNT_INDEX = None
+        return True
+        
+
+def iter_range_cells(value_ranges: list[dict]):
+    """
+    Iterate over the (1-based row number, 0-based column, value) cells of [Sheet!D5:F6] value ranges
+    """
+    for value_range in value_ranges:
+        start_cell = value_range["range"].rpartition("!")[2].split(":")[0]
+        column = ord("".join(c for c in start_cell if c.isalpha())) - 65
+        row_number = int("".join(c for c in start_cell if c.isdigit()))
+        for row_offset, values in enumerate(value_range["values"]):
+            for column_offset, value in enumerate(values):
+                yield row_number + row_offset, column + column_offset, value
+
+def get_sheets_failure(res, err) -> tuple:
+    """
+    Classify a Google Sheets API request, transient on a transient status, a timeout or a connection error
+    """
+    if (isinstance(err, HttpError)):
+        return get_status_failure(err.resp.status, err.resp.get("retry-after"))
+    if (isinstance(err, (OSError, httplib2.HttpLib2Error))):
+        return None, None
+    return None
@@ -0,0 +1,25 @@
+from benchmarks.run import build_dataset, run_benchmark
+from benchmarks.stand_ins import parse_range, percentile
+
+class TestBenchmarks:
+    def setup_method(self, method):
+        self.options = {"ob_rows": 300, "pending_share": 0.2, "new_orders": 30, "journal_entries": 6, "refs_per_entry": 4, "latency": 0.0}
+
+    def test_run_benchmark_against_stand_ins(self):
+        results = {result["job"]: result for result in run_benchmark(**self.options)}
+        pending = build_dataset(300, 0.2, 30, 6, 4)["pending"]
+
+        assert list(results.keys()) == ["NewOrders", "OrderBook", "JournalOrders", "JournalOrders (sync)"]
+        assert results["NewOrders"]["rows"] == 30
+        assert results["OrderBook"]["rows"] == pending
+        assert results["JournalOrders"]["rows"] == 6
+        assert results["JournalOrders (sync)"]["rows"] == 6
+        # Rows are resolved in batches per account and pair, not one request each
+        assert results["OrderBook"]["upstreams"]["binance"]["requests"] < pending
+        assert all(stats["errors"] == 0 for result in results.values() for stats in result["upstreams"].values())
+
+    def test_parse_range_and_percentile(self):
+        assert parse_range("OB!AA5:AB6") == ("OB", 4, 26, 5, 27)
+        assert parse_range("OB!5:7") == ("OB", 4, 0, 6, None)
+        assert percentile([0.1, 0.2, 0.3, 0.4], 0.5) == 0.2
+        assert percentile([], 0.99) == 0.0
@@ -1,8 +1,10 @@
+import json
 import os
 import pytest
 
 from dotenv import load_dotenv
 from src.services.binance_exchange import BinanceExchange
+from src.services.quota_manager import QuotaManager
 
 load_dotenv()
 
@@ -37,4 +39,105 @@ class TestBinance:
         
         # Uncomment the following line to print the response
         # print(res)
-        # assert False
\ No newline at end of file
+        # assert False
+
+class FakeResponse:
+    def __init__(self, body, status_code=200, headers=None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    @property
+    def content(self):
+        return json.dumps(self.body).encode("utf-8")
+
+    def json(self):
+        return self.body
+
+class FakeBinanceTransport:
+    """
+    Stand-in for the HttpTransport, serving canned allOrders pages per symbol
+    """
+    def __init__(self, orders_per_symbol):
+        self.orders_per_symbol = orders_per_symbol
+        self.calls = []
+        self.listen_keys = 0
+
+    def request(self, method, url, headers=None, params=None, json=None, timeout=None):
+        self.calls.append((url, dict(params or {})))
+        if url.endswith("/userDataStream"):
+            if method == "POST":
+                self.listen_keys += 1
+                return FakeResponse({"listenKey": "key-" + str(self.listen_keys)})
+            return FakeResponse({})
+        if url.endswith("/api/v3/account"):
+            return FakeResponse({"balances": [
+                {"asset": "BTC", "free": "0.1", "locked": "0"},
+                {"asset": "USDT", "free": "100", "locked": "0"},
+                {"asset": "DOGE", "free": "0", "locked": "0"},
+            ]})
+        if url.endswith("/allOrders"):
+            if params["symbol"] not in self.orders_per_symbol:
+                return FakeResponse({"code": -1121, "msg": "Invalid symbol."}, 400)
+            orders = self.orders_per_symbol[params["symbol"]]
+            if "orderId" in params:
+                orders = [order for order in orders if order["orderId"] >= params["orderId"]]
+            return FakeResponse(orders[:params["limit"]], headers={"X-MBX-USED-WEIGHT-1M": "20"})
+        return FakeResponse({"code": -1, "msg": "Unknown endpoint"}, 404)
+
+def api_order(order_id, symbol, update_time, status="FILLED"):
+    return {
+        "orderId": order_id,
+        "symbol": symbol,
+        "status": status,
+        "side": "BUY",
+        "updateTime": update_time,
+        "executedQty": "1" if status != "CANCELED" else "0",
+        "cummulativeQuoteQty": "10",
+    }
+
+class TestBinanceOffline:
+    def setup_method(self, method):
+        self.transport = FakeBinanceTransport({
+            "BTCUSDT": [api_order(1, "BTCUSDT", 1000), api_order(2, "BTCUSDT", 3000), api_order(3, "BTCUSDT", 3500, "CANCELED")],
+            "ETHUSDT": [api_order(10, "ETHUSDT", 2000), api_order(11, "ETHUSDT", 4000, "NEW")],
+        })
+        self.quotas = QuotaManager()
+        self.binance = BinanceExchange("Binance", "key", "secret", self.transport, self.quotas, symbols=["SOL/USDT"])
+
+    def test_get_all_spot_orders_from(self):
+        self.binance.set_candidate_symbols(["ETH/USDT"])
+        orders = self.binance.get_all_spot_orders_from(0)
+
+        assert [order["order_id"] for order in orders] == ["1", "10", "2"]
+        assert orders[1]["symbol"] == "ETH/USDT"
+        queried = sorted(params["symbol"] for url, params in self.transport.calls if url.endswith("/allOrders"))
+        assert queried == ["BTCUSDT", "ETHUSDT", "SOLUSDT"]
+
+    def test_parse_order_formats_unknown_symbol_as_pair(self):
+        assert self.binance.parse_order(api_order(1, "ETHUSDT", 1000))["symbol"] == "ETH/USDT"
+        assert self.binance.parse_order(api_order(1, "ETHUSDT", 1000), "ETH/USDT")["symbol"] == "ETH/USDT"
+
+    def test_get_all_orders_for_symbol_follows_cursor(self):
+        self.binance.ALL_ORDERS_LIMIT = 2
+        orders = self.binance.get_all_orders_for_symbol("/api/v3/allOrders", "Binance Spot", "BTC/USDT", 0)
+
+        assert [order["order_id"] for order in orders] == ["1", "2"]
+        assert len([call for call in self.transport.calls if call[1]["symbol"] == "BTCUSDT"]) == 2
+
+    def test_query_spot_orders_batch_follows_cursor(self):
+        self.binance.ALL_ORDERS_LIMIT = 1
+        self.binance.ENDPOINT_WEIGHTS = dict(self.binance.ENDPOINT_WEIGHTS, **{"/api/v3/order": 20})
+        orders = self.binance.query_spot_orders_batch("BTC/USDT", ["1", "2", "3", "4"])
+
+        # The cancelled order without an executed quantity and the unknown order are left to the individual query
+        assert sorted(orders.keys()) == ["1", "2"]
+        assert orders["2"]["symbol"] == "BTC/USDT"
+        assert [params["orderId"] for url, params in self.transport.calls] == [1, 2, 3, 4]
+
+    def test_query_spot_orders_batch_caps_pages_at_individual_weight(self):
+        self.binance.ALL_ORDERS_LIMIT = 1
+        orders = self.binance.query_spot_orders_batch("BTC/USDT", ["1", "2"])
+
+        assert list(orders.keys()) == ["1"]
+        assert len(self.transport.calls) == 1
@@ -0,0 +1,156 @@
+import base64
+import hashlib
+import json
+import socket
+import threading
+import time
+
+from src.services.binance_exchange import BinanceExchange
+from src.services.binance_user_stream import BinanceUserStream
+from src.services.quota_manager import QuotaManager
+from tests.test_binance import FakeBinanceTransport, api_order
+
+class LocalWebSocketServer:
+    """
+    Minimal WebSocket stand-in for the Binance stream, pushing text frames to the connected clients
+    """
+    GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen()
+        self.url = "ws://127.0.0.1:" + str(self.server.getsockname()[1]) + "/ws/"
+        self.paths = []
+        self.connections = []
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            request = b""
+            while b"\r\n\r\n" not in request:
+                request += connection.recv(1024)
+            lines = request.decode().split("\r\n")
+            key = [line.split(":", 1)[1].strip() for line in lines if line.lower().startswith("sec-websocket-key")][0]
+            accept = base64.b64encode(hashlib.sha1((key + self.GUID).encode()).digest()).decode()
+            connection.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: " + accept + "\r\n\r\n").encode())
+            self.paths.append(lines[0].split(" ")[1])
+            self.connections.append(connection)
+            threading.Thread(target=self.read, args=(connection,), daemon=True).start()
+
+    def read(self, connection):
+        # Answer the client close frame, ignoring everything else
+        try:
+            while True:
+                header = connection.recv(2)
+                if len(header) < 2:
+                    return
+                length = header[1] & 0x7f
+                if length == 126:
+                    length = int.from_bytes(connection.recv(2), "big")
+                connection.recv(4 + length)
+                if header[0] & 0x0f == 8:
+                    connection.sendall(b"\x88\x00")
+                    connection.close()
+                    return
+        except OSError:
+            return
+
+    def send(self, event):
+        payload = json.dumps(event).encode()
+        frame = b"\x81" + (bytes([len(payload)]) if len(payload) < 126 else b"\x7e" + len(payload).to_bytes(2, "big"))
+        self.connections[-1].sendall(frame + payload)
+
+    def ping(self):
+        self.connections[-1].sendall(b"\x89\x00")
+
+    def drop(self):
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+                connection.close()
+            except OSError:
+                pass
+
+    def close(self):
+        self.drop()
+        self.server.close()
+
+def execution_report(order_id, symbol, status, transaction_time):
+    return {"e": "executionReport", "E": transaction_time, "s": symbol, "S": "BUY", "X": status, "i": order_id, "z": "2", "Z": "20", "T": transaction_time}
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+class TestBinanceUserStream:
+    def setup_method(self, method):
+        self.server = LocalWebSocketServer()
+        self.transport = FakeBinanceTransport({})
+        self.binance = BinanceExchange("Binance", "key", "secret", self.transport, QuotaManager())
+        self.stream = BinanceUserStream(self.binance, self.server.url, account_types=["Spot"])
+        self.stream.RECONNECT_SECONDS = 0.05
+        self.stream.RECV_TIMEOUT = 0.1
+        self.binance.USER_STREAM = self.stream
+
+    def teardown_method(self, method):
+        self.stream.stop()
+        self.server.close()
+
+    def test_stream_buffers_orders_and_fills_gap_on_reconnect(self):
+        self.stream.start()
+        wait_for(lambda: self.stream.COVERED_FROM["Spot"] is not None)
+        covered_from = self.stream.COVERED_FROM["Spot"]
+        assert self.server.paths == ["/ws/key-1"]
+        # Not covered before the stream connected, the caller polls instead
+        assert self.stream.get_orders_from("Spot", covered_from - 1) is None
+
+        now = int(time.time() * 1000)
+        self.server.send(execution_report(1, "BTCUSDT", "NEW", now))
+        self.server.send(execution_report(2, "ETHUSDT", "FILLED", now + 1))
+        wait_for(lambda: len(self.stream.get_orders_from("Spot", covered_from)) == 1)
+        order = self.stream.get_orders_from("Spot", covered_from)[0]
+        assert order["order_id"] == "2"
+        assert order["symbol"] == "ETH/USDT"
+        assert order["average"] == 10
+
+        # An order filled while the stream is down is recovered over REST on reconnect
+        self.transport.orders_per_symbol["BTCUSDT"] = [api_order(3, "BTCUSDT", now + 2)]
+        self.binance.set_candidate_symbols(["BTC/USDT"])
+        self.server.drop()
+        wait_for(lambda: len(self.server.paths) == 2 and self.stream.COVERED_FROM["Spot"] is not None)
+
+        assert self.server.paths[1] == "/ws/key-2"
+        assert self.stream.COVERED_FROM["Spot"] <= covered_from
+        assert [order["order_id"] for order in self.binance.get_all_spot_orders_from(covered_from)] == ["2", "3"]
+
+    def test_stream_reconnects_after_silence(self):
+        self.stream.SILENCE_SECONDS = 0.5
+        self.stream.start()
+        wait_for(lambda: self.stream.COVERED_FROM["Spot"] is not None)
+        last_seen = self.stream.LAST_SEEN["Spot"]
+
+        # Server pings keep the connection alive without events
+        for _ in range(8):
+            self.server.ping()
+            time.sleep(0.1)
+        assert len(self.server.paths) == 1
+        assert self.stream.LAST_SEEN["Spot"] > last_seen
+
+        # A connection gone silent is reopened, timeouts alone do not count as healthy
+        last_seen = self.stream.LAST_SEEN["Spot"]
+        wait_for(lambda: len(self.server.paths) == 2)
+        wait_for(lambda: self.stream.COVERED_FROM["Spot"] is not None)
+        assert self.stream.COVERED_FROM["Spot"] <= last_seen
+
+    def test_get_all_spot_orders_from_polls_without_stream_coverage(self):
+        self.transport.orders_per_symbol["BTCUSDT"] = [api_order(1, "BTCUSDT", 1000)]
+        self.binance.set_candidate_symbols(["BTC/USDT"])
+
+        assert [order["order_id"] for order in self.binance.get_all_spot_orders_from(0)] == ["1"]
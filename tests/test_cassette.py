@@ -0,0 +1,96 @@
+import asyncio
+import gzip
+import time
+
+import pytest
+
+from src.services.binance_exchange import BinanceExchange
+from src.services.cassette import Cassette, CassetteTransport
+from src.services.quota_manager import QuotaManager
+from tests.test_binance import FakeBinanceTransport, api_order
+
+class TestCassette:
+    def setup_method(self, method):
+        self.orders = {"BTCUSDT": [api_order(1, "BTCUSDT", 1000), api_order(2, "BTCUSDT", 2000)]}
+
+    def record_binance(self, path):
+        cassette = Cassette(path, "record", secrets=["binance-key", "binance-secret"])
+        transport = CassetteTransport(FakeBinanceTransport(self.orders), cassette)
+        binance = BinanceExchange("Binance", "binance-key", "binance-secret", transport, QuotaManager())
+        res = binance.get_all_orders_for_symbol("/api/v3/allOrders", "Binance Spot", "BTC/USDT", 0)
+        listen_key = binance.user_stream_request("POST", "/api/v3/userDataStream")["listenKey"]
+        cassette.save()
+        return res, listen_key
+
+    def test_replay_binance_without_network(self, tmp_path):
+        path = str(tmp_path / "run.cassette.gz")
+        recorded, _ = self.record_binance(path)
+
+        cassette = Cassette(path, "replay", speed=0)
+        binance = BinanceExchange("Binance", "other-key", "other-secret", CassetteTransport(None, cassette), QuotaManager())
+        replayed = binance.get_all_orders_for_symbol("/api/v3/allOrders", "Binance Spot", "BTC/USDT", 0)
+
+        assert [order["order_id"] for order in replayed] == [order["order_id"] for order in recorded]
+        with pytest.raises(LookupError):
+            binance.get_all_orders_for_symbol("/api/v3/allOrders", "Binance Spot", "ETH/USDT", 0)
+
+    def test_credentials_are_redacted(self, tmp_path):
+        path = str(tmp_path / "run.cassette.gz")
+        _, listen_key = self.record_binance(path)
+
+        with gzip.open(path, "rt") as file:
+            content = file.read()
+        assert "binance-key" not in content
+        assert "binance-secret" not in content
+        assert listen_key not in content
+        assert "timestamp" not in content
+
+    def test_replay_speed(self, tmp_path):
+        path = str(tmp_path / "slow.cassette.gz")
+        cassette = Cassette(path, "record")
+        identity = lambda res, err: {"body": res}
+        cassette.call("test", "slow", {}, lambda: time.sleep(0.1) or "done", identity, None)
+        cassette.save()
+
+        for speed, bounds in [(1, (0.09, 1)), (0, (0, 0.05))]:
+            cassette = Cassette(path, "replay", speed=speed)
+            start = time.perf_counter()
+            assert cassette.call("test", "slow", {}, None, None, lambda response: response["body"]) == "done"
+            assert bounds[0] <= time.perf_counter() - start < bounds[1]
+
+    def test_replay_notion_errors(self, tmp_path):
+        from notion_client import APIResponseError
+        from src.services.notion_journal import NotionJournal
+
+        path = str(tmp_path / "notion.cassette.gz")
+        cassette = Cassette(path, "record", secrets=["notion-token"])
+        notion = NotionJournal("notion-token", "database", QuotaManager(), cassette=cassette)
+        notion.CLIENT = FakeNotionClient()
+        assert notion.call("pages.update", page_id="page-1", properties={}) == {"id": "page-1"}
+        with pytest.raises(APIResponseError):
+            notion.call("pages.update", page_id="missing", properties={})
+        cassette.save()
+
+        cassette = Cassette(path, "replay", speed=0)
+        notion = NotionJournal("replay", "database", QuotaManager(), cassette=cassette)
+        notion.open_async_client()
+        assert asyncio.run(notion.call_async("pages.update", page_id="page-1", properties={})) == {"id": "page-1"}
+        with pytest.raises(APIResponseError) as err:
+            notion.call("pages.update", page_id="missing", properties={})
+        assert err.value.status == 404
+
+class FakeNotionClient:
+    """
+    Stand-in for the Notion client, failing on unknown pages
+    """
+    def __init__(self):
+        self.pages = self
+
+    def update(self, page_id, properties):
+        if page_id == "missing":
+            import httpx
+            from notion_client import APIResponseError
+            from notion_client.errors import APIErrorCode
+
+            raise APIResponseError(httpx.Response(404, text="{}"), "Page not found", APIErrorCode.ObjectNotFound)
+        return {"id": page_id}
@@ -0,0 +1,41 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.services.http_transport import HttpTransport
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = json.dumps({"path": self.path}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestHttpTransport:
+    def setup_method(self, method):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:" + str(self.server.server_port)
+        self.transport = HttpTransport(pool_maxsize=2)
+
+    def teardown_method(self, method):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        for idx in range(5):
+            res = self.transport.request("GET", self.url + "/order", params={"id": idx})
+            assert res.json()["path"] == "/order?id=" + str(idx)
+
+        stats = self.transport.get_stats()["127.0.0.1:" + str(self.server.server_port)]
+        assert stats["requests"] == 5
+        assert stats["connections"] == 1
+        assert stats["reused"] == 4
@@ -0,0 +1,137 @@
+import asyncio
+
+import httpx
+from notion_client import APIResponseError
+from notion_client.errors import APIErrorCode
+
+from src.jobs.journal_orders import JournalOrders
+from src.services.notion_journal import EntryPatch, NotionJournal
+from src.services.quota_manager import QuotaManager
+from src.services.resilience import RetriesExhaustedError
+
+HEADER = ["Date", "Account", "Pair", "Side", "Average", "Executed", "Effect", "Total (inc. Fees)", "Fee", "Fee Currency", "Ref", "Notes", "Status"]
+
+class FakeSheets:
+    def __init__(self):
+        self.warmed = False
+
+    def warm_cache(self):
+        self.warmed = True
+
+    def get_rows_with_order_references(self, order_references):
+        return [list(HEADER)] + [["", "", "", "", "", "", "1.0", "2.0", "", "", ref, "", ""] for ref in order_references]
+
+class FakeNotion(NotionJournal):
+    """
+    NotionJournal answering its calls in memory after latency seconds, counting the calls in flight
+    """
+    def __init__(self, latency=0.0):
+        super().__init__("token", "database", QuotaManager({"notion": (1000, 1000)}))
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.tags = {}
+        self.patches = {}
+        self.calls = []
+        self.client_open = False
+
+    def open_async_client(self):
+        self.client_open = True
+        self.ASYNC_CLIENT = self
+
+    async def close_async_client(self):
+        self.client_open = False
+        self.ASYNC_CLIENT = None
+
+    async def wait(self):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.latency)
+        self.in_flight -= 1
+
+    def call(self, endpoint, **kwargs):
+        self.calls.append((endpoint, kwargs.get("block_id")))
+        if (endpoint == "blocks.children.list"):
+            raise APIResponseError(httpx.Response(404, text="{}"), "Block not found", APIErrorCode.ObjectNotFound)
+        return asyncio.run(self.call_async(endpoint, **kwargs))
+
+    async def call_async(self, endpoint, **kwargs):
+        await self.wait()
+        if (endpoint == "blocks.children.append"):
+            if (kwargs["block_id"] == "bad"):
+                raise ValueError("Invalid orders")
+            if (kwargs["block_id"] == "down"):
+                raise RetriesExhaustedError("notion", 4, 502)
+            return {"results": [{"id": "table-" + kwargs["block_id"]}]}
+        if (endpoint == "pages.update"):
+            if ("unknown-error" in [tag["name"] for tag in kwargs["properties"].get(self.NP_TAGS, {}).get("multi_select", [])]):
+                self.tags[kwargs["page_id"]] = "unknown-error"
+            else:
+                self.patches[kwargs["page_id"]] = kwargs["properties"]
+        return {}
+
+    async def iter_refresh_orders_async(self):
+        # Two pages of entries, both queried before the first entry is yielded
+        entries = []
+        for page in [range(0, 4), range(4, 8)]:
+            await self.wait()
+            entries += [{"id": str(idx), "order-references": [str(idx)], "table-block-id": None, "action-tags": []} for idx in page]
+        entries.append({"id": "bad", "order-references": ["bad"], "table-block-id": None, "action-tags": []})
+        for entry in entries:
+            yield entry
+
+class TestJournalOrders:
+    def setup_method(self, method):
+        self.notion = FakeNotion(latency=0.05)
+        self.sheets = FakeSheets()
+
+    def test_run_async_processes_entries_concurrently(self):
+        JournalOrders(self.notion, self.sheets, concurrency=4).run()
+
+        assert self.sheets.warmed
+        assert not self.notion.client_open
+        # Entries are processed concurrently, at most 4 in flight
+        assert 1 < self.notion.max_in_flight <= 4
+        assert all(self.notion.patches[str(idx)][NotionJournal.NP_ORDERS_TABLE_ID]["rich_text"][0]["text"]["content"] == "table-" + str(idx) for idx in range(8))
+        # A failing entry is tagged without affecting the others
+        assert self.notion.tags["bad"] == "unknown-error"
+
+    def test_process_entry_recreates_table_when_sync_fails(self):
+        entry = {"id": "1", "order-references": ["1"], "table-block-id": "stale", "action-tags": [{"name": "refresh-orders"}]}
+        JournalOrders(self.notion, self.sheets).process_entry(entry)
+
+        # The failed call is raised inside the entry operation, which deletes and recreates the table
+        assert [endpoint for endpoint, _ in self.notion.calls] == ["blocks.children.list", "blocks.delete", "blocks.children.append", "pages.update"]
+        assert self.notion.patches["1"][NotionJournal.NP_ORDERS_TABLE_ID]["rich_text"][0]["text"]["content"] == "table-1"
+
+    def test_process_entries_leaves_entries_pending_while_upstream_down(self):
+        entries = [{"id": id, "order-references": ["1"], "table-block-id": None, "action-tags": []} for id in ["bad", "down"]]
+        JournalOrders(self.notion, self.sheets).process_entries(entries)
+
+        # Only the failing entry is tagged, the other is left for the next run
+        assert self.notion.tags == {"bad": "unknown-error"}
+        assert "down" not in self.notion.patches
+
+    def test_append_net_row(self):
+        orders = self.sheets.get_rows_with_order_references(["1", "2"])
+        orders[2][6] = ""
+
+        missing = JournalOrders(self.notion, self.sheets).append_net_row(orders)
+
+        assert missing
+        assert orders[-1][5:8] == ["Net:", "1.0", "2.0"]
+
+    def test_update_tags_keeps_other_tags(self):
+        patch = EntryPatch("entry", [{"id": "1", "name": "refresh-orders"}, {"id": "2", "name": "long-term"}, {"id": "3", "name": "missing-orders"}])
+        JournalOrders(self.notion, self.sheets).update_tags(patch, missing=False)
+        patch.set_table_block_id("table")
+
+        properties = patch.get_properties()
+        assert properties[NotionJournal.NP_TAGS]["multi_select"] == [{"name": "long-term"}]
+        assert properties[NotionJournal.NP_ORDERS_TABLE_ID]["rich_text"][0]["text"]["content"] == "table"
+
+    def test_unchanged_patch_is_empty(self):
+        patch = EntryPatch("entry", [{"name": "long-term"}])
+        JournalOrders(self.notion, self.sheets).update_tags(patch, missing=False)
+
+        assert patch.get_properties() == {}
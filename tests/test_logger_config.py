@@ -0,0 +1,54 @@
+import io
+import json
+import logging
+
+from src.logger_config import JsonFormatter, LoggingConfig, configure_logging, parse_levels, setup_logger
+
+class CountingArgument:
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "argument"
+
+class TestLoggerConfig:
+    def teardown_method(self, method):
+        configure_logging("DEBUG", {}, "text")
+
+    def test_per_module_levels(self):
+        config = LoggingConfig("INFO", parse_levels("src.services=WARNING, src.services.binance_exchange=DEBUG"))
+        try:
+            assert config.get_level("src.jobs.order_book") == logging.INFO
+            assert config.get_level("src.services.sheets_ob") == logging.WARNING
+            assert config.get_level("src.services.binance_exchange") == logging.DEBUG
+            assert config.get_level("src.servicesx") == logging.INFO
+        finally:
+            config.stop()
+
+    def test_arguments_formatted_only_when_emitted(self):
+        configure_logging("INFO", {"tests.lazy.debug": "DEBUG"})
+        argument = CountingArgument()
+        setup_logger("tests.lazy").debug("Params [%s]", argument)
+        assert argument.formatted == 0
+
+        setup_logger("tests.lazy.debug").debug("Params [%s]", argument)
+        assert argument.formatted >= 1
+
+    def test_json_lines_with_structured_fields(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        logger = logging.getLogger("tests.json")
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            logger.warning("Fetched [%d] rows", 3, extra={"sheet": "OB"})
+        finally:
+            logger.removeHandler(handler)
+
+        entry = json.loads(stream.getvalue())
+        assert entry["level"] == "WARNING"
+        assert entry["logger"] == "tests.json"
+        assert entry["message"] == "Fetched [3] rows"
+        assert entry["sheet"] == "OB"
@@ -0,0 +1,51 @@
+import urllib.request
+
+from src.services.binance_exchange import BinanceExchange
+from src.services.metrics import Metrics
+from src.services.quota_manager import QuotaManager
+from tests.test_binance import FakeBinanceTransport, api_order
+
+class TestMetrics:
+    def setup_method(self, method):
+        self.metrics = Metrics()
+
+    def test_render_prometheus_text(self):
+        self.metrics.observe_request("binance", "/api/v3/order", 0.03, status=200, bytes_received=120)
+        self.metrics.observe_request("binance", "/api/v3/order", 0.2, status=429)
+        self.metrics.observe_job("OrderBook", 1.5)
+        self.metrics.add_job_rows("OrderBook", 12)
+        text = self.metrics.render()
+
+        assert "# TYPE rtp_squire_request_duration_seconds histogram" in text
+        assert 'rtp_squire_request_duration_seconds_bucket{endpoint="/api/v3/order",upstream="binance",le="0.05"} 1' in text
+        assert 'rtp_squire_request_duration_seconds_bucket{endpoint="/api/v3/order",upstream="binance",le="+Inf"} 2' in text
+        assert 'rtp_squire_requests_total{endpoint="/api/v3/order",upstream="binance"} 2' in text
+        assert 'rtp_squire_request_errors_total{endpoint="/api/v3/order",upstream="binance"} 1' in text
+        assert 'rtp_squire_request_throttles_total{endpoint="/api/v3/order",upstream="binance"} 1' in text
+        assert 'rtp_squire_request_bytes_total{direction="received",endpoint="/api/v3/order",upstream="binance"} 120' in text
+        assert 'rtp_squire_job_runs_total{job="OrderBook",outcome="completed"} 1' in text
+        assert 'rtp_squire_job_rows_total{job="OrderBook"} 12' in text
+
+    def test_exchange_requests_are_instrumented(self):
+        transport = FakeBinanceTransport({"BTCUSDT": [api_order(1, "BTCUSDT", 1000)]})
+        binance = BinanceExchange("Binance", "key", "secret", transport, QuotaManager(), metrics=self.metrics)
+        binance.get_all_orders_for_symbol("/api/v3/allOrders", "Binance Spot", "BTC/USDT", 0)
+        binance.get_all_orders_for_symbol("/api/v3/allOrders", "Binance Spot", "ETH/USDT", 0)
+        text = self.metrics.render()
+
+        assert 'rtp_squire_requests_total{endpoint="/api/v3/allOrders",upstream="binance"} 2' in text
+        assert 'rtp_squire_request_errors_total{endpoint="/api/v3/allOrders",upstream="binance"} 1' in text
+
+    def test_textfile_and_http_endpoint(self, tmp_path):
+        self.metrics.observe_job("NewOrders", 0.5, failed=True)
+        path = str(tmp_path / "metrics" / "rtp_squire.prom")
+        self.metrics.write_textfile(path)
+        with open(path) as file:
+            assert 'rtp_squire_job_runs_total{job="NewOrders",outcome="failed"} 1' in file.read()
+
+        server = self.metrics.start_http_server(0)
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:" + str(server.server_address[1]) + "/metrics") as res:
+                assert res.read().decode("utf-8") == self.metrics.render()
+        finally:
+            self.metrics.stop_http_server()
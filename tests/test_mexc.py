@@ -1,8 +1,10 @@
+import json
 import os
 import pytest
 
 from dotenv import load_dotenv
 from src.services.mexc_exchange import MexcExchange
+from src.services.quota_manager import QuotaManager
 
 load_dotenv()
 
@@ -43,4 +45,78 @@ class TestMexc:
     def test_get_all_leverage_orders_from(self):
         res = self.mexc.get_all_leverage_orders_from(1716829200000)
         print(res)
-        assert False
\ No newline at end of file
+        assert False
+
+class FakeResponse:
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+        self.headers = {}
+
+    @property
+    def content(self):
+        return json.dumps(self.body).encode("utf-8")
+
+    def json(self):
+        return self.body
+
+class FakeMexcTransport:
+    """
+    Stand-in for the HttpTransport, serving futures history pages newest first
+    """
+    def __init__(self, orders):
+        self.orders = sorted(orders, key=lambda order: order["createTime"], reverse=True)
+        self.pages = []
+        self.batches = []
+
+    def request(self, method, url, headers=None, params=None, json=None, timeout=None):
+        if url.endswith("/batch_query"):
+            order_ids = params["order_ids"].split(",")
+            self.batches.append(order_ids)
+            return FakeResponse({"success": True, "code": 0, "data": [order for order in self.orders if order["orderId"] in order_ids]})
+        page_num, page_size = params["page_num"], params["page_size"]
+        self.pages.append(page_num)
+        page = self.orders[(page_num - 1) * page_size:page_num * page_size]
+        return FakeResponse({"success": True, "code": 0, "data": page})
+
+def api_order(order_id, create_time, state=3):
+    return {
+        "orderId": str(order_id),
+        "symbol": "BTC_USDT",
+        "side": 1,
+        "price": 100.0,
+        "vol": 1.0,
+        "takerFee": 0.1,
+        "makerFee": 0.0,
+        "feeCurrency": "USDT",
+        "state": state,
+        "createTime": create_time,
+        "updateTime": create_time,
+    }
+
+class TestMexcOffline:
+    def setup_method(self, method):
+        orders = [api_order(idx, 1000 + idx, 4 if idx % 10 == 0 else 3) for idx in range(250)]
+        self.transport = FakeMexcTransport(orders)
+        self.mexc = MexcExchange("MEXC", "key", "secret", self.transport, QuotaManager({"mexc": (1000, 1000)}))
+
+    def test_get_all_leverage_orders_from_walks_pages(self):
+        orders = self.mexc.get_all_leverage_orders_from(0)
+
+        assert len(orders) == 250 - 25
+        assert self.transport.pages == [1, 2, 3]
+        assert orders[0]["order_id"] == "249"
+
+    def test_get_all_leverage_orders_from_stops_before_start_time(self):
+        orders = self.mexc.get_all_leverage_orders_from(1000 + 180)
+
+        assert len(orders) == 70 - 7
+        assert self.transport.pages == [1]
+
+    def test_query_leverage_orders_batch_splits_requests(self):
+        self.mexc.BATCH_QUERY_MAX_IDS = 2
+        orders = self.mexc.query_leverage_orders_batch("BTC/USDT", ["5", "6", "7", "unknown"])
+
+        assert sorted(orders.keys()) == ["5", "6", "7"]
+        assert orders["6"]["executed"] == 1.0
+        assert self.transport.batches == [["5", "6"], ["7", "unknown"]]
@@ -0,0 +1,74 @@
+import threading
+import time
+from datetime import datetime as dt
+
+from src.jobs.new_orders import NewOrders
+from src.services.exchange import Exchange
+
+class FakeSheets:
+    def __init__(self, last_updated):
+        self.last_updated = last_updated
+        self.new_orders = None
+        self.updated_accounts = []
+
+    def get_no_last_updated(self):
+        return self.last_updated
+
+    def get_ob_pairs(self, account_prefix):
+        return ["BTC/USDT"]
+
+    def update_new_orders(self, account_orders):
+        self.new_orders = account_orders
+
+    def update_no_last_updated(self, account, last_updated):
+        self.updated_accounts.append(account)
+
+class InFlight:
+    def __init__(self):
+        self.count = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+class FakeExchange(Exchange):
+    def __init__(self, latency, in_flight, fail=False):
+        self.latency = latency
+        self.in_flight = in_flight
+        self.fail = fail
+
+    def get_all_spot_orders_from(self, start_time):
+        with self.in_flight.lock:
+            self.in_flight.count += 1
+            self.in_flight.max = max(self.in_flight.max, self.in_flight.count)
+        time.sleep(self.latency)
+        with self.in_flight.lock:
+            self.in_flight.count -= 1
+        if self.fail:
+            raise ValueError("Exchange unavailable")
+        return [{"order_id": "1", "datetime": dt.fromtimestamp(start_time / 1000), "symbol": "BTC/USDT", "side": "Buy", "average": 1.0, "executed": 1.0}]
+
+    get_all_leverage_orders_from = get_all_spot_orders_from
+
+class TestNewOrders:
+    def setup_method(self, method):
+        self.sheets = FakeSheets({
+            "Binance Main Spot": "27/05/2024 00:00:00",
+            "Binance Main Margin": None,
+            "Binance Alt Spot": "27/05/2024 00:00:00",
+            "MEXC Main Futures": "27/05/2024 00:00:00",
+        })
+        self.in_flight = InFlight()
+        self.exchanges = {
+            "Binance Main": FakeExchange(0.2, self.in_flight),
+            "Binance Alt": FakeExchange(0.2, self.in_flight, fail=True),
+            "MEXC Main": FakeExchange(0.1, self.in_flight),
+        }
+
+    def test_run_queries_accounts_concurrently(self):
+        NewOrders(self.sheets, self.exchanges).run()
+
+        # Accounts are queried at the same time rather than one after the other
+        assert self.in_flight.max > 1
+        # A failing account is skipped without affecting the others
+        assert list(self.sheets.new_orders.keys()) == ["Binance Main Spot", "Binance Main Margin", "MEXC Main Futures"]
+        assert self.sheets.new_orders["Binance Main Spot"][0]["datetime"] == dt(2024, 5, 27)
+        assert self.sheets.updated_accounts == ["Binance Main Margin"]
@@ -4,6 +4,7 @@ import pytest
 
 from dotenv import load_dotenv
 from src.services.notion_journal import NotionJournal
+from src.services.quota_manager import QuotaManager
 
 load_dotenv()
 
@@ -32,4 +33,128 @@ class TestNotionAPI:
     def test_delete_block(self):
         response = self.notion.delete_block("-")
         print(response)
-        assert False
\ No newline at end of file
+        assert False
+
+class FakeEndpoint:
+    def __init__(self, calls, name, responses=None):
+        self.calls = calls
+        self.name = name
+        self.responses = responses if responses is not None else {}
+
+    def __getattr__(self, name):
+        return FakeEndpoint(self.calls, self.name + "." + name, self.responses)
+
+    def __call__(self, **kwargs):
+        self.calls.append((self.name, kwargs))
+        responses = self.responses.get(self.name)
+        if responses:
+            return responses.pop(0)
+        return {"results": [{"id": "block-1"}]}
+
+class TestNotionJournalOffline:
+    def setup_method(self, method):
+        self.notion = NotionJournal("token", "database", QuotaManager({"notion": (1000, 1000)}))
+        self.calls = []
+        self.responses = {}
+        self.notion.CLIENT = FakeEndpoint(self.calls, "client", self.responses)
+
+    def test_run_operation_drives_sync_client(self):
+        block_id = self.notion.create_orders_table_block("entry", [["cell"] * 13])
+
+        assert block_id == "block-1"
+        assert self.calls[0][0] == "client.blocks.children.append"
+        assert self.calls[0][1]["block_id"] == "entry"
+
+    def existing_rows(self, orders):
+        rows = self.notion.generate_orders_table_block_children(orders)
+        for idx, row in enumerate(rows):
+            row["id"] = "row-" + str(idx)
+            row["table_row"]["cells"] = [[{"type": "text", "plain_text": cell[0]["text"]["content"]}] for cell in row["table_row"]["cells"]]
+        return rows
+
+    def test_sync_orders_table_block_writes_only_changes(self):
+        existing = [[str(idx)] * 13 for idx in range(150)]
+        self.responses["client.blocks.children.list"] = [
+            {"results": self.existing_rows(existing)[:100], "has_more": True, "next_cursor": "cursor"},
+            {"results": self.existing_rows(existing)[100:], "has_more": False},
+        ]
+        orders = [list(row) for row in existing[:120]]
+        orders[5][7] = "changed"
+        orders.append(["new"] * 13)
+
+        assert self.notion.sync_orders_table_block("table", orders)
+
+        endpoints = [endpoint for endpoint, _ in self.calls]
+        assert self.calls[1][1]["start_cursor"] == "cursor"
+        assert endpoints.count("client.blocks.update") == 2
+        assert self.calls[2][1]["block_id"] == "row-5"
+        assert self.calls[3][1]["block_id"] == "row-120"
+        assert endpoints.count("client.blocks.children.append") == 0
+        assert endpoints.count("client.blocks.delete") == 29
+
+    def test_sync_orders_table_block_rejects_other_layouts(self):
+        self.responses["client.blocks.children.list"] = [
+            {"results": self.existing_rows([["1"] * 13])[:1], "has_more": False},
+        ]
+        self.responses["client.blocks.children.list"][0]["results"][0]["table_row"]["cells"].pop()
+
+        assert not self.notion.sync_orders_table_block("table", [["1"] * 13])
+        assert len(self.calls) == 1
+
+    def test_iter_refresh_orders_queries_every_page_first(self):
+        def page(ids, cursor):
+            return {
+                "results": [{
+                    "id": id,
+                    "properties": {
+                        NotionJournal.NP_ORDER_REFERENCES: {"rich_text": [{"plain_text": "1,2,"}]},
+                        NotionJournal.NP_ORDERS_TABLE_ID: {"rich_text": []},
+                        NotionJournal.NP_TAGS: {"multi_select": [{"name": "refresh-orders"}]}
+                    }
+                } for id in ids],
+                "has_more": cursor is not None,
+                "next_cursor": cursor
+            }
+        self.responses["client.databases.query"] = [page(["a", "b"], "cursor"), page(["c"], None)]
+
+        entries = self.notion.iter_refresh_orders()
+        assert next(entries)["id"] == "a"
+        # Every page is requested before an entry is processed and drops out of the filtered results
+        assert len(self.calls) == 2
+
+        entries = list(entries)
+        assert [entry["id"] for entry in entries] == ["b", "c"]
+        assert entries[0]["order-references"] == ["1", "2"]
+        assert entries[0]["table-block-id"] is None
+        assert self.calls[1][1]["start_cursor"] == "cursor"
+
+    def test_create_orders_table_block_in_chunks(self):
+        orders = [["27/05/2024", "Binance Main Spot", "BTC/USDT", "Buy", str(idx)] for idx in range(250)]
+
+        assert self.notion.create_orders_table_block("entry", orders) == "block-1"
+
+        assert [endpoint for endpoint, _ in self.calls] == ["client.blocks.children.append"] * 3
+        table = self.calls[0][1]["children"][0]["table"]
+        assert table["table_width"] == 13
+        assert len(table["children"]) == 100
+        assert self.calls[1][1]["block_id"] == "block-1"
+        assert [len(request["children"]) for _, request in self.calls[1:]] == [100, 50]
+        # Short rows are padded to the table width
+        row = self.calls[2][1]["children"][-1]["table_row"]
+        assert self.notion.get_cells_text(row["cells"]) == ["27/05/2024", "Binance Main Spot", "BTC/USDT", "Buy", "249"] + [""] * 8
+
+    def test_create_orders_table_block_deletes_partial_table(self):
+        orders = [["27/05/2024", "Binance Main Spot", "BTC/USDT", "Buy", str(idx)] for idx in range(150)]
+        calls = []
+        def call(endpoint, **request):
+            calls.append((endpoint, request))
+            if (endpoint == "blocks.children.append" and request["block_id"] == "block-1"):
+                raise ValueError("Append failed")
+            return {"results": [{"id": "block-1"}]}
+        self.notion.call = call
+
+        with pytest.raises(ValueError):
+            self.notion.create_orders_table_block("entry", orders)
+
+        assert [endpoint for endpoint, _ in calls] == ["blocks.children.append", "blocks.children.append", "blocks.delete"]
+        assert calls[-1][1] == {"block_id": "block-1"}
@@ -0,0 +1,144 @@
+import threading
+import time
+from datetime import datetime as dt
+
+from src.jobs.order_book import OrderBook
+from src.services.resilience import CircuitOpenError, RetriesExhaustedError
+
+class FakeSheets:
+    def __init__(self, fail_flush=False):
+        self.updates = {}
+        self.lock = threading.Lock()
+        self.fail_flush = fail_flush
+        self.flushed = False
+
+    def update_ob_row(self, row_number, row):
+        with self.lock:
+            self.updates[row_number] = row
+
+    def flush_ob_rows(self):
+        self.flushed = True
+        if self.fail_flush:
+            raise ValueError("Sheets unavailable")
+
+class FakeExchange:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def query_spot_order(self, symbol, orderId):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+        if orderId == "bad":
+            raise ValueError("Order not found")
+        if orderId == "down":
+            raise CircuitOpenError("mexc", 30)
+        if orderId == "flaky":
+            raise RetriesExhaustedError("binance", 4, 503)
+        return {
+            "order_id": orderId,
+            "datetime": dt(2024, 5, 27),
+            "symbol": symbol,
+            "side": "Buy",
+            "average": 1.0,
+            "executed": 2.0,
+            "fee": None,
+            "fee_currency": None
+        }
+
+    query_leverage_order = query_spot_order
+
+class FakeBatchExchange(FakeExchange):
+    BATCH_ACCOUNT_TYPES = ["Spot"]
+
+    def __init__(self, fail_batch=False):
+        super().__init__()
+        self.fail_batch = fail_batch
+        self.batches = []
+
+    def query_spot_orders_batch(self, symbol, order_ids):
+        self.batches.append((symbol, list(order_ids)))
+        if self.fail_batch:
+            raise ValueError("Batch unavailable")
+        # Orders ending with 9 are not found by the batch
+        return {order_id: self.query_spot_order(symbol, order_id) for order_id in order_ids if not order_id.endswith("9")}
+
+class TestOrderBook:
+    def setup_method(self, method):
+        self.sheets = FakeSheets()
+        self.exchanges = {
+            "Binance": FakeExchange(latency=0.05),
+            "MEXC": FakeExchange(latency=0.05),
+        }
+
+    def test_process_rows_pipeline(self):
+        order_book = OrderBook(self.sheets, self.exchanges, {"default": 4})
+        rows = [[idx, "Binance Main Spot", "BTC/USDT", str(idx)] for idx in range(2, 10)]
+        rows += [[idx, "MEXC Main Futures", "BTC/USDT", str(idx)] for idx in range(10, 18)]
+        rows.append([18, "MEXC Main Futures", "BTC/USDT", "bad"])
+        rows.append([19, "Kraken Main Spot", "BTC/USDT", "1"])
+
+        order_book.process_rows_pipeline(rows)
+
+        assert len(self.sheets.updates) == len(rows)
+        assert self.sheets.updates[2]["RTPS_REFRESH"] == "COMPLETED"
+        assert self.sheets.updates[18]["RTPS_REFRESH"].startswith("FAILED")
+        assert self.sheets.updates[19]["RTPS_REFRESH"].startswith("FAILED")
+        # Each exchange's rows are fetched concurrently, by at most its 4 workers
+        for exchange in self.exchanges.values():
+            assert 1 < exchange.max_in_flight <= 4
+
+    def test_process_rows_pipeline_survives_failed_flush(self, caplog):
+        self.sheets = FakeSheets(fail_flush=True)
+        rows = [[idx, "Binance Main Spot", "BTC/USDT", str(idx)] for idx in range(2, 4)]
+        OrderBook(self.sheets, self.exchanges, {"default": 2}).process_rows_pipeline(rows)
+
+        assert self.sheets.flushed
+        assert "Failed to write buffered row updates with error [Sheets unavailable]" in caplog.text
+
+    def test_process_rows_sequential_matches_pipeline(self):
+        rows = [[idx, "Binance Main Spot", "BTC/USDT", str(idx)] for idx in range(2, 6)]
+        OrderBook(self.sheets, self.exchanges).process_rows(rows)
+        sequential = dict(self.sheets.updates)
+
+        self.sheets.updates = {}
+        OrderBook(self.sheets, self.exchanges, {"Binance": 2}).process_rows_pipeline(rows)
+
+        assert sequential == self.sheets.updates
+
+    def test_process_rows_resolves_pairs_in_batches(self):
+        exchange = FakeBatchExchange()
+        rows = [[idx, "Binance Main Spot", "BTC/USDT", str(idx)] for idx in range(2, 10)]
+        rows += [[idx, "Binance Main Spot", "ETH/USDT", str(idx)] for idx in range(10, 12)]
+        rows.append([12, "Binance Main Margin", "BTC/USDT", "12"])
+        OrderBook(self.sheets, {"Binance": exchange}).process_rows(rows)
+
+        assert len(self.sheets.updates) == len(rows)
+        assert exchange.batches == [("BTC/USDT", [str(idx) for idx in range(2, 10)]), ("ETH/USDT", ["10", "11"])]
+        # 9 orders found by the batches, then the order missing from a batch and the margin row individually
+        assert exchange.calls == 9 + 2
+
+    def test_process_rows_pipeline_falls_back_when_batch_fails(self):
+        exchange = FakeBatchExchange(fail_batch=True)
+        rows = [[idx, "Binance Main Spot", "BTC/USDT", str(idx)] for idx in range(2, 6)]
+        OrderBook(self.sheets, {"Binance": exchange}, {"default": 2}).process_rows_pipeline(rows)
+
+        assert all(row["RTPS_REFRESH"] == "COMPLETED" for row in self.sheets.updates.values())
+        assert len(exchange.batches) == 1
+        assert exchange.calls == 4
+
+    def test_process_rows_leaves_rows_pending_while_upstream_down(self):
+        rows = [[2, "Binance Main Spot", "BTC/USDT", "2"], [3, "MEXC Main Futures", "BTC/USDT", "down"], [4, "Binance Main Spot", "BTC/USDT", "flaky"]]
+        OrderBook(self.sheets, self.exchanges).process_rows(rows)
+
+        assert self.sheets.updates[2]["RTPS_REFRESH"] == "COMPLETED"
+        assert 3 not in self.sheets.updates
+        assert 4 not in self.sheets.updates
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime as dt
+
+from src.services.order_cache import OrderCache, SingleFlight
+
+def sample_order(order_id):
+    return {
+        "order_id": order_id,
+        "datetime": dt(2024, 5, 27, 12, 30),
+        "symbol": "BTC/USDT",
+        "side": "Buy",
+        "average": 1.5,
+        "executed": 2.0,
+        "fee": None,
+        "fee_currency": None
+    }
+
+class TestOrderCache:
+    def setup_method(self, method):
+        self.path = os.path.join(tempfile.mkdtemp(), "orders.sqlite3")
+        self.cache = OrderCache(self.path)
+
+    def teardown_method(self, method):
+        self.cache.close()
+
+    def test_terminal_orders_persist(self):
+        key = ("Binance", "Spot", "BTCUSDT", "1")
+        calls = []
+        fetch = lambda: (calls.append(1), (sample_order("1"), True))[1]
+
+        assert self.cache.read_through(key, fetch) == sample_order("1")
+        assert self.cache.read_through(key, fetch) == sample_order("1")
+        assert len(calls) == 1
+
+        reopened = OrderCache(self.path)
+        assert reopened.get(key) == sample_order("1")
+        reopened.close()
+
+    def test_non_terminal_orders_are_not_stored(self):
+        key = ("Binance", "Spot", "BTCUSDT", "2")
+        self.cache.read_through(key, lambda: (sample_order("2"), False))
+        assert self.cache.get(key) is None
+
+    def test_single_flight_shares_concurrent_calls(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.05)
+            return "order"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(single_flight.do("key", fetch))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == ["order"] * 5
+        assert len(calls) == 1
+
+    def test_non_terminal_orders_are_fetched_once_per_run(self):
+        key = ("MEXC", "Futures", "BTC_USDT", "3")
+        calls = []
+        fetch = lambda: (calls.append(1), (sample_order("3"), False))[1]
+
+        # Duplicate references processed one after another share the first fetch
+        assert self.cache.read_through(key, fetch) == sample_order("3")
+        assert self.cache.read_through(key, fetch) == sample_order("3")
+        assert len(calls) == 1
+
+        # The next run fetches it again, it may have changed
+        self.cache.clear_run_orders()
+        self.cache.read_through(key, fetch)
+        assert len(calls) == 2
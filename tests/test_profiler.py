@@ -0,0 +1,65 @@
+import os
+import time
+import tracemalloc
+
+import pytest
+
+from src.profiler import Profiler
+
+def busy_job():
+    # Some CPU, some allocations and some waiting
+    total = sum(idx * idx for idx in range(200000))
+    blocks = [bytearray(1024) for _ in range(2000)]
+    time.sleep(0.1)
+    return total, blocks
+
+class TestProfiler:
+    def setup_method(self, method):
+        self.profiler_top = 10
+
+    def test_run_writes_report(self, tmp_path):
+        total, blocks = Profiler(str(tmp_path), self.profiler_top).run("BusyJob", busy_job)
+
+        assert total > 0 and len(blocks) == 2000
+        names = sorted(os.listdir(tmp_path))
+        assert [name.split(".")[-1] for name in names] == ["prof", "txt"]
+        with open(tmp_path / names[1]) as file:
+            report = file.read()
+        assert report.startswith("Profile of [BusyJob]")
+        # The sleep is accounted as waiting rather than CPU
+        waiting = float(report.split("Waiting    [")[1].split("s]")[0])
+        assert waiting >= 0.09
+        assert "test_profiler.py:11" in report
+        assert "busy_job" in report
+
+    def test_run_reports_failures(self, tmp_path):
+        def failing_job():
+            raise ValueError("Exchange unavailable")
+
+        with pytest.raises(ValueError):
+            Profiler(str(tmp_path), self.profiler_top).run("FailingJob", failing_job)
+
+        report_name = [name for name in os.listdir(tmp_path) if name.endswith(".txt")][0]
+        with open(tmp_path / report_name) as file:
+            assert "failed with error [Exchange unavailable]" in file.readline()
+
+    def test_run_keeps_a_report_per_run(self, tmp_path):
+        profiler = Profiler(str(tmp_path), self.profiler_top)
+        for _ in range(3):
+            profiler.run("QuickJob", lambda: None)
+
+        assert len([name for name in os.listdir(tmp_path) if name.endswith(".txt")]) == 3
+
+    def test_run_reports_the_peak_of_the_run(self, tmp_path):
+        tracemalloc.start()
+        try:
+            blocks = bytearray(8 * 1024 * 1024)
+            del blocks
+            Profiler(str(tmp_path), self.profiler_top).run("QuickJob", lambda: None)
+        finally:
+            tracemalloc.stop()
+
+        report_name = [name for name in os.listdir(tmp_path) if name.endswith(".txt")][0]
+        with open(tmp_path / report_name) as file:
+            peak = file.read().split("Peak traced memory [")[1].split("]")[0]
+        assert not peak.endswith("MiB")
@@ -0,0 +1,33 @@
+import time
+import pytest
+
+from src.services.quota_manager import QuotaManager, TokenBucket
+
+class TestQuotaManager:
+    def setup_method(self, method):
+        self.quotas = QuotaManager({"test": (100, 10)})
+
+    def test_token_bucket_waits_for_refill(self):
+        bucket = TokenBucket(rate=50, capacity=5)
+        for _ in range(5):
+            assert bucket.try_acquire() == 0
+        assert bucket.try_acquire() > 0
+
+        start = time.monotonic()
+        bucket.acquire(2)
+        assert time.monotonic() - start >= 0.03
+
+    def test_observe_used_drains_bucket(self):
+        bucket = self.quotas.get_bucket("test")
+        self.quotas.observe_used("test", 10)
+        assert bucket.try_acquire() > 0
+
+    def test_throttled_blocks_until_retry_after(self):
+        self.quotas.throttled("test", "0.05")
+        start = time.monotonic()
+        self.quotas.acquire("test")
+        assert time.monotonic() - start >= 0.05
+
+    def test_unknown_upstream(self):
+        with pytest.raises(ValueError):
+            self.quotas.acquire("unknown")
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+import requests
+
+from src.services.binance_exchange import BinanceExchange
+from src.services.quota_manager import QuotaManager
+from src.services.resilience import CircuitOpenError, Resilience, RetriesExhaustedError, UpstreamUnavailableError, get_response_failure, parse_retry_after
+from tests.test_binance import FakeResponse
+
+class FlakyTransport:
+    """
+    Stand-in for the HttpTransport, answering with the given statuses or errors in turn then with 200
+    """
+    def __init__(self, failures, headers=None):
+        self.failures = list(failures)
+        self.headers = headers or {}
+        self.calls = []
+
+    def request(self, method, url, headers=None, params=None, json=None, timeout=None):
+        self.calls.append(dict(params or {}))
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return FakeResponse({"code": -1}, failure, self.headers)
+        return FakeResponse({"balances": []})
+
+class TestResilience:
+    def setup_method(self, method):
+        self.resilience = Resilience(max_attempts=4, base_delay=0, max_delay=1, failure_threshold=3, reset_seconds=0.2)
+
+    def test_retries_transient_failures(self):
+        transport = FlakyTransport([503, requests.exceptions.ConnectionError("reset")])
+        binance = BinanceExchange("Binance", "key", "secret", transport, QuotaManager(), resilience=self.resilience)
+
+        assert binance.request("GET", "/api/v3/account", {}) == {"balances": []}
+        assert len(transport.calls) == 3
+        # Each attempt is signed again with a fresh timestamp, never signing the previous signature
+        for call in transport.calls:
+            assert call["signature"] == binance.get_signature({name: value for name, value in call.items() if name != "signature"})
+
+    def test_gives_up_on_client_errors_and_long_retry_after(self):
+        transport = FlakyTransport([400])
+        res = self.resilience.call("binance", lambda: transport.request("GET", "/"), get_response_failure)
+        assert res.status_code == 400
+        assert len(transport.calls) == 1
+
+        transport = FlakyTransport([429], {"Retry-After": "120"})
+        with pytest.raises(RetriesExhaustedError) as err:
+            self.resilience.call("binance", lambda: transport.request("GET", "/"), get_response_failure)
+        assert err.value.STATUS == 429
+        assert len(transport.calls) == 1
+
+    def test_honours_retry_after(self):
+        transport = FlakyTransport([429], {"Retry-After": "0.2"})
+        start = time.perf_counter()
+        res = self.resilience.call("binance", lambda: transport.request("GET", "/"), get_response_failure)
+        assert res.status_code == 200
+        assert time.perf_counter() - start >= 0.2
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+
+    def test_non_idempotent_calls_only_retried_when_throttled(self):
+        transport = FlakyTransport([500])
+        with pytest.raises(RetriesExhaustedError):
+            self.resilience.call("binance", lambda: transport.request("POST", "/"), get_response_failure, idempotent=False)
+        assert len(transport.calls) == 1
+
+        transport = FlakyTransport([429], {"Retry-After": "0"})
+        res = self.resilience.call("binance", lambda: transport.request("POST", "/"), get_response_failure, idempotent=False)
+        assert res.status_code == 200
+        assert len(transport.calls) == 2
+
+    def test_circuit_breaker_fails_fast_per_upstream(self):
+        transport = FlakyTransport([503] * 10)
+        # The call tripping the breaker gives up with a typed error rather than the 503 response
+        with pytest.raises(RetriesExhaustedError) as err:
+            self.resilience.call("mexc", lambda: transport.request("GET", "/"), get_response_failure)
+        assert err.value.ATTEMPTS == 3 and err.value.STATUS == 503
+        assert len(transport.calls) == 3
+
+        # MEXC fails fast without a request, other upstreams are unaffected
+        with pytest.raises(CircuitOpenError):
+            self.resilience.call("mexc", lambda: transport.request("GET", "/"), get_response_failure)
+        assert len(transport.calls) == 3
+        assert self.resilience.call("binance", lambda: FakeResponse({}), get_response_failure).status_code == 200
+
+        # A successful probe once the breaker resets closes it
+        time.sleep(0.25)
+        transport.failures = []
+        assert self.resilience.call("mexc", lambda: transport.request("GET", "/"), get_response_failure).status_code == 200
+        assert not self.resilience.get_breaker("mexc").is_open()
+
+    def test_exchange_raises_unavailable_once_retries_are_exhausted(self):
+        transport = FlakyTransport([requests.exceptions.ConnectionError("reset")] * 2 + [503] * 2)
+        binance = BinanceExchange("Binance", "key", "secret", transport, QuotaManager(), resilience=Resilience(max_attempts=4, base_delay=0))
+
+        # Not a JSONDecodeError on the body of the last 503
+        with pytest.raises(UpstreamUnavailableError) as err:
+            binance.request("GET", "/api/v3/account", {})
+        assert isinstance(err.value, RetriesExhaustedError)
+        assert len(transport.calls) == 4
+
+    def test_notion_gateway_errors_are_transient(self):
+        import httpx
+        from notion_client.errors import HTTPResponseError
+        from src.services.notion_journal import get_notion_failure
+
+        # A gateway HTML page is not a Notion API error body, the client raises the base HTTPResponseError
+        calls = []
+        def gateway():
+            calls.append(1)
+            raise HTTPResponseError(httpx.Response(502, text="<html>Bad Gateway</html>"))
+
+        with pytest.raises(RetriesExhaustedError) as err:
+            self.resilience.call("notion", gateway, get_notion_failure)
+        assert err.value.STATUS == 502
+        assert len(calls) == 3
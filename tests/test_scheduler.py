@@ -0,0 +1,56 @@
+import threading
+import time
+from datetime import datetime as dt
+
+import pytest
+
+from src.scheduler import CronSchedule, IntervalSchedule, Scheduler, parse_schedule
+
+class TestScheduler:
+    def setup_method(self, method):
+        self.scheduler = Scheduler()
+
+    def test_cron_next_after(self):
+        assert CronSchedule("*/15 * * * *").next_after(dt(2024, 5, 27, 10, 7, 30)) == dt(2024, 5, 27, 10, 15)
+        assert CronSchedule("0 9 * * 1-5").next_after(dt(2024, 5, 25, 12, 0)) == dt(2024, 5, 27, 9, 0)
+        assert CronSchedule("30 0 1 * *").next_after(dt(2024, 12, 31, 23, 59)) == dt(2025, 1, 1, 0, 30)
+        # Day of month or day of week when both are restricted
+        assert CronSchedule("0 0 15 * 0").next_after(dt(2024, 5, 27)) == dt(2024, 6, 2)
+
+    def test_parse_schedule(self):
+        assert isinstance(parse_schedule("60"), IntervalSchedule)
+        assert isinstance(parse_schedule("*/5 * * * *"), CronSchedule)
+        with pytest.raises(ValueError):
+            parse_schedule("61 * * * *")
+
+    def test_run_jobs_without_overlap_until_stopped(self):
+        running = []
+        overlaps = []
+
+        def job():
+            if running:
+                overlaps.append(True)
+            running.append(True)
+            time.sleep(0.03)
+            running.pop()
+
+        def failing_job():
+            raise ValueError("Exchange unavailable")
+
+        self.scheduler.add_job("job", job, IntervalSchedule(0.01))
+        self.scheduler.add_job("failing", failing_job, IntervalSchedule(0.01))
+        refreshes = []
+        self.scheduler.add_background_task("refresh", lambda: refreshes.append(True), 0.01)
+
+        thread = threading.Thread(target=self.scheduler.run)
+        thread.start()
+        time.sleep(0.2)
+        self.scheduler.stop()
+        thread.join(timeout=1)
+
+        assert not thread.is_alive()
+        assert not overlaps
+        assert self.scheduler.JOBS[0]["runs"] >= 2
+        # A failing job stays scheduled
+        assert self.scheduler.JOBS[1]["runs"] >= 2
+        assert len(refreshes) >= 2